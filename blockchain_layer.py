@@ -54,6 +54,25 @@ class SimpleBlockchain:
         new_block['data'].append(block_data)
         return new_block
 
+    def add_transactions(self, transactions):
+        """Add a batch of transactions as entries of a single block"""
+        last_block = self.chain[-1]
+        block_hash = self.hash_block(last_block)
+
+        new_block = self.create_block(block_hash)
+        for transaction in transactions:
+            data = {
+                'donor_id': transaction['donor_id'],
+                'organ_type': transaction['organ_type'],
+                'hospital': transaction['hospital'],
+                'receiver_id': transaction['receiver_id']
+            }
+            new_block['data'].append({
+                'data_encrypted': self.encrypt_data(data),
+                'block_hash': block_hash
+            })
+        return new_block
+
     def get_chain(self, decrypt=False):
         if decrypt:
             for block in self.chain:
@@ -121,7 +121,7 @@ contract OrganChain {
         string memory patientHospital,
         string memory date
     ) public {
-        matches.push(Match(
+        storeMatch(Match(
             donorName,
             donorAge,
             donorHospital,
@@ -132,25 +132,39 @@ contract OrganChain {
             patientHospital,
             date
         ));
+    }
+    
+    // Add many matches in one transaction, each with its own MatchAdded event
+    function addMatches(Match[] memory newMatches) public {
+        for (uint256 i = 0; i < newMatches.length; i++) {
+            storeMatch(newMatches[i]);
+        }
+    }
+    
+    // Store one match and emit its event. Taking the struct keeps a single
+    // stack slot for the nine fields, so both entry points stay clear of
+    // "stack too deep"
+    function storeMatch(Match memory m) internal {
+        matches.push(m);
         
         // Create a detailed description for the event
         string memory details = string(abi.encodePacked(
-            "Organ match created: Donor ", donorName, " (", toString(donorAge), " years) from ", donorHospital,
-            " matched with Patient ", patientName, " (", toString(patientAge), " years) from ", patientHospital,
-            " for ", getOrganName(encryptedOrgan), " transplant on ", date
+            "Organ match created: Donor ", m.donorName, " (", toString(m.donorAge), " years) from ", m.donorHospital,
+            " matched with Patient ", m.patientName, " (", toString(m.patientAge), " years) from ", m.patientHospital,
+            " for ", getOrganName(m.encryptedOrgan), " transplant on ", m.date
         ));
         
         emit MatchAdded(
             matches.length - 1,
-            donorName,
-            donorAge,
-            donorHospital,
-            encryptedOrgan,
-            encryptedBloodType,
-            patientName,
-            patientAge,
-            patientHospital,
-            date,
+            m.donorName,
+            m.donorAge,
+            m.donorHospital,
+            m.encryptedOrgan,
+            m.encryptedBloodType,
+            m.patientName,
+            m.patientAge,
+            m.patientHospital,
+            m.date,
             details
         );
     }
@@ -163,16 +177,63 @@ contract OrganChain {
         return matches.length;
     }
     
+    // One page of matches: up to limit matches starting at offset
+    function getMatches(uint256 offset, uint256 limit) public view returns (Match[] memory page) {
+        uint256 end = pageEnd(offset, limit, matches.length);
+        page = new Match[](end > offset ? end - offset : 0);
+        for (uint256 i = offset; i < end; i++) {
+            page[i - offset] = matches[i];
+        }
+    }
+    
     // Simple record function as per the example
     function addRecord(string memory donorId, string memory organType, string memory hospital, string memory receiverId) public {
         records.push(Record(donorId, organType, hospital, receiverId, block.timestamp));
         emit OrganRegistered(donorId, organType, hospital, receiverId);
     }
 
+    // Add many records in one transaction; the arrays are read in parallel.
+    // Memory arrays take one stack slot each (calldata ones take two)
+    function addRecords(
+        string[] memory donorIds,
+        string[] memory organTypes,
+        string[] memory hospitalNames,
+        string[] memory receiverIds
+    ) public {
+        require(
+            organTypes.length == donorIds.length && hospitalNames.length == donorIds.length && receiverIds.length == donorIds.length,
+            "Record arrays must have the same length"
+        );
+        for (uint256 i = 0; i < donorIds.length; i++) {
+            addRecord(donorIds[i], organTypes[i], hospitalNames[i], receiverIds[i]);
+        }
+    }
+
     function getAllRecords() public view returns (Record[] memory) {
         return records;
     }
     
+    function getRecordsCount() public view returns (uint256) {
+        return records.length;
+    }
+    
+    // One page of records: up to limit records starting at offset
+    function getRecords(uint256 offset, uint256 limit) public view returns (Record[] memory page) {
+        uint256 end = pageEnd(offset, limit, records.length);
+        page = new Record[](end > offset ? end - offset : 0);
+        for (uint256 i = offset; i < end; i++) {
+            page[i - offset] = records[i];
+        }
+    }
+    
+    // End of the page [offset, offset + limit) clamped to the array length
+    function pageEnd(uint256 offset, uint256 limit, uint256 length) internal pure returns (uint256) {
+        if (offset >= length) {
+            return offset;
+        }
+        return limit > length - offset ? length : offset + limit;
+    }
+    
     // Helper function to convert uint to string
     function toString(uint256 value) internal pure returns (string memory) {
         if (value == 0) {
@@ -7,6 +7,9 @@ import json
 import os
 from web3 import Web3
 
+# Functions the server calls that older builds of OrganChain lack
+REQUIRED_FUNCTIONS = ['addRecords', 'addMatches', 'getRecords', 'getMatches', 'getRecordsCount']
+
 def deploy_contract():
     # Connect to local Ethereum node (Ganache)
     ganache_url = "http://127.0.0.1:7545"
@@ -36,6 +39,14 @@ def deploy_contract():
     abi = contract_json['abi']
     bytecode = contract_json['bytecode']
     
+    # The ABI and bytecode must come from a build of the current contracts/OrganChain.sol
+    names = {entry.get('name') for entry in abi if entry.get('type') == 'function'}
+    missing = [name for name in REQUIRED_FUNCTIONS if name not in names]
+    if missing:
+        print("Error: Contract build is out of date, missing", ", ".join(missing))
+        print("Please recompile the contract using 'truffle compile'")
+        return
+    
     # Create contract instance
     OrganChain = web3.eth.contract(abi=abi, bytecode=bytecode)
     
@@ -52,10 +63,11 @@ def deploy_contract():
     print("Transaction hash:", tx_hash.hex())
     print("Gas used:", tx_receipt.gasUsed)
     
-    # Save contract address to a file for the backend
+    # Save contract address to a file for the backend, with the ABI and bytecode of the same build
     contract_info = {
         "address": contract_address,
         "abi": abi,
+        "bytecode": bytecode,
         "transaction_hash": tx_hash.hex(),
         "block_number": tx_receipt.blockNumber
     }
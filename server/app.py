@@ -5,12 +5,26 @@ import uuid
 import datetime
 import os
 import sys
+import threading
 
 # Add the project root to the Python path
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
 # Import the blockchain service
 from blockchain_layer import SimpleBlockchain, load_key, generate_key
+from matching_service import (find_matches, load_unmatched_donors, load_unmatched_patients, load_donor, load_patient,
+                              persist_matches, release_matches, load_hospital_names, load_allocation_circles,
+                              match_ledger_entries, match_pool)
+from geo import geocode
+from donor_organs import (DONOR_ORGAN_SCHEMA, add_donor_organs, backfill_donor_organs, load_donor_organs,
+                          sync_donor_status)
+from waiting_list import get_waiting_list, cached_waiting_list, invalidate_waiting_list, parse_urgency, waiting_list_lock
+from candidate_index import MAX_CANDIDATES, get_candidate_index, cached_candidate_index
+from viability import ViabilitySweeper, viability_deadline
+from chain_outbox import OutboxDispatcher, init_outbox
+from blockchain_service import OUTBOX_DB
+from offer_service import (ACCEPTED, DECLINED, TIMED_OUT, OfferScheduler, accept_offer, close_offer, cascade_offer,
+                           declined_patients, offer_expiry, open_offers_since)
 import json
 
 app = Flask(__name__, 
@@ -47,8 +61,8 @@ DB = os.path.join(os.path.dirname(__file__), "database.db")
 
 # Print blockchain status
 
-def init_db():
-    conn = sqlite3.connect(DB)
+def init_db(db=DB):
+    conn = sqlite3.connect(db)
     c = conn.cursor()
     
     # Admin table
@@ -69,7 +83,9 @@ def init_db():
         email TEXT UNIQUE,
         location TEXT,
         password TEXT,
-        wallet_address TEXT UNIQUE  -- Add wallet address for blockchain integration
+        wallet_address TEXT UNIQUE,  -- Add wallet address for blockchain integration
+        latitude REAL,
+        longitude REAL
     )
     ''')
     
@@ -87,10 +103,18 @@ def init_db():
         status TEXT DEFAULT 'Not Matched',
         registration_date TEXT DEFAULT CURRENT_TIMESTAMP,
         medical_document_path TEXT,
-        FOREIGN KEY (hospital_id) REFERENCES hospital(id)
+        hla_typing TEXT,
+        viability_deadline TEXT,
+        paired_patient_id INTEGER,
+        non_directed INTEGER DEFAULT 0,
+        FOREIGN KEY (hospital_id) REFERENCES hospital(id),
+        FOREIGN KEY (paired_patient_id) REFERENCES patient(id)
     )
     ''')
     
+    # Organs offered by each donor, allocated one by one (donor.organ is the first of them)
+    c.execute(DONOR_ORGAN_SCHEMA)
+    
     # Patient table with unique_id and registration_date for FCFS
     c.execute('''
     CREATE TABLE IF NOT EXISTS patient (
@@ -105,6 +129,9 @@ def init_db():
         status TEXT DEFAULT 'Not Matched',
         registration_date TEXT DEFAULT CURRENT_TIMESTAMP,
         medical_document_path TEXT,
+        hla_typing TEXT,
+        unacceptable_antigens TEXT,
+        urgency INTEGER DEFAULT 0,
         FOREIGN KEY (hospital_id) REFERENCES hospital(id)
     )
     ''')
@@ -120,6 +147,29 @@ def init_db():
         organ TEXT,
         blood_type TEXT,
         match_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        offer_status TEXT DEFAULT 'Accepted',
+        offered_at TEXT,
+        offer_expires_at TEXT,
+        responded_at TEXT,
+        FOREIGN KEY (donor_id) REFERENCES donor(id),
+        FOREIGN KEY (patient_id) REFERENCES patient(id)
+    )
+    ''')
+    
+    # Declined and timed out offers, kept so a donor is never re-offered to the same patient
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS offer_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        match_id INTEGER,
+        donor_id INTEGER,
+        patient_id INTEGER,
+        donor_hospital_id INTEGER,
+        patient_hospital_id INTEGER,
+        organ TEXT,
+        blood_type TEXT,
+        offered_at TEXT,
+        responded_at TEXT,
+        outcome TEXT,
         FOREIGN KEY (donor_id) REFERENCES donor(id),
         FOREIGN KEY (patient_id) REFERENCES patient(id)
     )
@@ -142,6 +192,9 @@ def init_db():
     )
     ''')
     
+    # Contract writes queued for the chain outbox dispatcher
+    init_outbox(c)
+    
     # Check if columns exist and add them if they don't
     c.execute("PRAGMA table_info(donor)")
     donor_columns = [column[1] for column in c.fetchall()]
@@ -174,6 +227,11 @@ def init_db():
     if 'wallet_address' not in hospital_columns:
         c.execute("ALTER TABLE hospital ADD COLUMN wallet_address TEXT")
     
+    # Add coordinate columns for distance-aware matching if they don't exist
+    for column in ('latitude', 'longitude'):
+        if column not in hospital_columns:
+            c.execute(f"ALTER TABLE hospital ADD COLUMN {column} REAL")
+    
     # Add medical_document_path columns if they don't exist
     if 'medical_document_path' not in donor_columns:
         c.execute("ALTER TABLE donor ADD COLUMN medical_document_path TEXT")
@@ -181,6 +239,40 @@ def init_db():
     if 'medical_document_path' not in patient_columns:
         c.execute("ALTER TABLE patient ADD COLUMN medical_document_path TEXT")
     
+    # Add HLA typing columns if they don't exist
+    if 'hla_typing' not in donor_columns:
+        c.execute("ALTER TABLE donor ADD COLUMN hla_typing TEXT")
+    
+    if 'hla_typing' not in patient_columns:
+        c.execute("ALTER TABLE patient ADD COLUMN hla_typing TEXT")
+    
+    if 'unacceptable_antigens' not in patient_columns:
+        c.execute("ALTER TABLE patient ADD COLUMN unacceptable_antigens TEXT")
+    
+    # Add viability_deadline column for donor organ expiry if it doesn't exist
+    if 'viability_deadline' not in donor_columns:
+        c.execute("ALTER TABLE donor ADD COLUMN viability_deadline TEXT")
+    
+    # Add living donor columns for kidney paired exchange if they don't exist
+    if 'paired_patient_id' not in donor_columns:
+        c.execute("ALTER TABLE donor ADD COLUMN paired_patient_id INTEGER")
+    
+    if 'non_directed' not in donor_columns:
+        c.execute("ALTER TABLE donor ADD COLUMN non_directed INTEGER DEFAULT 0")
+    
+    # Add urgency column for the priority waiting list if it doesn't exist
+    if 'urgency' not in patient_columns:
+        c.execute("ALTER TABLE patient ADD COLUMN urgency INTEGER DEFAULT 0")
+    
+    # Add offer workflow columns if they don't exist (existing matches count as accepted)
+    c.execute("PRAGMA table_info(match_record)")
+    match_columns = [column[1] for column in c.fetchall()]
+    if 'offer_status' not in match_columns:
+        c.execute("ALTER TABLE match_record ADD COLUMN offer_status TEXT DEFAULT 'Accepted'")
+    for column in ('offered_at', 'offer_expires_at', 'responded_at'):
+        if column not in match_columns:
+            c.execute(f"ALTER TABLE match_record ADD COLUMN {column} TEXT")
+    
     # Update existing records with unique IDs and registration dates if they don't have them
     c.execute("UPDATE donor SET unique_id = ? WHERE unique_id IS NULL", (str(uuid.uuid4()),))
     c.execute("UPDATE patient SET unique_id = ? WHERE unique_id IS NULL", (str(uuid.uuid4()),))
@@ -190,6 +282,25 @@ def init_db():
     c.execute("UPDATE donor SET registration_date = ? WHERE registration_date IS NULL", (current_time,))
     c.execute("UPDATE patient SET registration_date = ? WHERE registration_date IS NULL", (current_time,))
     
+    # Geocode hospitals that have a location but no coordinates yet (offline gazetteer)
+    c.execute("SELECT id, location FROM hospital WHERE latitude IS NULL AND location IS NOT NULL")
+    located = [(coordinates[0], coordinates[1], hospital_id)
+               for hospital_id, coordinates in ((row[0], geocode(row[1])) for row in c.fetchall()) if coordinates]
+    c.executemany("UPDATE hospital SET latitude=?, longitude=? WHERE id=?", located)
+    
+    # Donors registered before per-organ allocation offer their single organ
+    backfill_donor_organs(c)
+    
+    # One match per donor organ and per patient: clean up historical duplicates once, then let
+    # UNIQUE indexes reject new ones (statuses are kept in sync by the match transactions)
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_match_record_donor_organ'")
+    if not c.fetchone():
+        c.execute("UPDATE match_record SET organ = (SELECT organ FROM donor WHERE id = match_record.donor_id) WHERE organ IS NULL")
+        dedupe_matches(c)
+        c.execute("DROP INDEX IF EXISTS idx_match_record_donor")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_match_record_donor_organ ON match_record(donor_id, organ)")
+        c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_match_record_patient ON match_record(patient_id)")
+    
     # Insert default admin if not exists
     c.execute("SELECT * FROM admin WHERE email='admin@gmail.com'")
     if not c.fetchone():
@@ -198,10 +309,8 @@ def init_db():
     conn.commit()
     conn.close()
 
-# Deduplicate historical match records and fix statuses
-def dedupe_matches():
-    conn = sqlite3.connect(DB)
-    c = conn.cursor()
+# Deduplicate historical match records and fix statuses (run by init_db before the UNIQUE indexes exist)
+def dedupe_matches(c):
     # Remove extra matches per patient (keep earliest id)
     c.execute('''
         DELETE FROM match_record
@@ -209,22 +318,24 @@ def dedupe_matches():
             SELECT MIN(id) FROM match_record GROUP BY patient_id
         )
     ''')
-    # Remove extra matches per donor (keep earliest id)
+    # Remove extra matches per donor organ (keep earliest id)
     c.execute('''
         DELETE FROM match_record
         WHERE id NOT IN (
-            SELECT MIN(id) FROM match_record GROUP BY donor_id
+            SELECT MIN(id) FROM match_record GROUP BY donor_id, organ
         )
     ''')
-    # Sync donor statuses
+    # Sync donor organ statuses, then the donor summaries
     c.execute('''
-        UPDATE donor SET status='Matched'
-        WHERE id IN (SELECT donor_id FROM match_record)
+        UPDATE donor_organ SET status='Matched'
+        WHERE EXISTS (SELECT 1 FROM match_record mr WHERE mr.donor_id = donor_organ.donor_id AND mr.organ = donor_organ.organ)
     ''')
     c.execute('''
-        UPDATE donor SET status='Not Matched'
-        WHERE id NOT IN (SELECT donor_id FROM match_record)
+        UPDATE donor_organ SET status='Not Matched'
+        WHERE status='Matched'
+          AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.donor_id = donor_organ.donor_id AND mr.organ = donor_organ.organ)
     ''')
+    sync_donor_status(c)
     # Sync patient statuses
     c.execute('''
         UPDATE patient SET status='Matched'
@@ -234,12 +345,55 @@ def dedupe_matches():
         UPDATE patient SET status='Not Matched'
         WHERE id NOT IN (SELECT patient_id FROM match_record)
     ''')
-    conn.commit()
-    conn.close()
 
 # Initialize DB
 init_db()
 
+# Drops expired donor organs from a loaded candidate index
+def forget_expired_donors(keys):
+    index = cached_candidate_index()
+    if index is not None:
+        for donor_id, organ in keys:
+            index.discard_donor(donor_id, organ)
+
+# Expires donor organs as their viability deadlines pass (started with the server)
+viability_sweeper = ViabilitySweeper(DB, on_expire=forget_expired_donors)
+
+# Times out unanswered offers and cascades them (started with the server)
+offer_scheduler = OfferScheduler(on_timeout=lambda match_id: settle_offer(match_id, TIMED_OUT))
+
+# Sends queued contract writes once the node is reachable (started with the server).
+# Drains CHAIN_OUTBOX_DB when set, else the outbox the sync scripts fill in this DB
+outbox_dispatcher = OutboxDispatcher(OUTBOX_DB or DB)
+
+_workers_lock = threading.Lock()
+_workers_started = False
+
+# Background workers start with the first request, so they run once and only in the
+# process that serves requests: not in the debug reloader's watcher process, not in
+# scripts that import this module, and under any WSGI server
+@app.before_request
+def start_background_workers():
+    global _workers_started
+    if _workers_started:
+        return
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+    # The matching pool is created here, never under the write or waiting-list locks
+    match_pool()
+    viability_sweeper.start()
+    conn = sqlite3.connect(DB)
+    offer_scheduler.load(conn.cursor())
+    conn.close()
+    offer_scheduler.start()
+    conn = outbox_dispatcher.connect()
+    init_outbox(conn.cursor())
+    conn.commit()
+    conn.close()
+    outbox_dispatcher.start()
+
 # Function to sync all database records to blockchain
 def sync_all_to_blockchain():
     conn = sqlite3.connect(DB)
@@ -261,7 +415,11 @@ def sync_all_to_blockchain():
             print(f"Error adding hospital {hospital_id} to blockchain: {e}")
     
     # Sync donors
-    c.execute("SELECT id, unique_id, name, organ, blood_type, hospital_id FROM donor")
+    c.execute('''
+        SELECT d.id, d.unique_id, d.name, COALESCE(o.organ, d.organ), d.blood_type, d.hospital_id
+        FROM donor d LEFT JOIN donor_organ o ON o.donor_id = d.id
+        ORDER BY d.id, o.id
+    ''')
     donors = c.fetchall()
     for donor in donors:
         donor_id, unique_id, name, organ, blood_type, hospital_id = donor
@@ -406,6 +564,7 @@ def admin_donors():
             ORDER BY d.registration_date ASC
         ''')
         donors = c.fetchall()
+        donor_organs = load_donor_organs(c)
     except sqlite3.OperationalError:
         # Fallback for old database structure
         c.execute('''
@@ -416,9 +575,11 @@ def admin_donors():
         ''')
         old_donors = c.fetchall()
         donors = [(d[0], 'N/A', d[1], d[2], d[3], d[4], d[5], d[6], 'N/A', d[7], None) for d in old_donors]
+        donor_organs = {}
     
     conn.close()
-    return render_template('admin_donors.html', donors=donors)
+    organ_names = sorted({organ for organs in donor_organs.values() for organ, _ in organs})
+    return render_template('admin_donors.html', donors=donors, donor_organs=donor_organs, organ_names=organ_names)
 
 # Admin: View all patients
 @app.route('/admin_patients')
@@ -553,9 +714,10 @@ def add_hospital():
         try:
             conn = sqlite3.connect(DB)
             c = conn.cursor()
-            # Insert hospital without wallet_address
-            c.execute("INSERT INTO hospital (name,email,location,password) VALUES (?,?,?,?)",
-                      (name,email,location,password))
+            # Insert hospital without wallet_address; coordinates stay NULL if the location is unknown
+            latitude, longitude = geocode(location) or (None, None)
+            c.execute("INSERT INTO hospital (name,email,location,password,latitude,longitude) VALUES (?,?,?,?,?,?)",
+                      (name,email,location,password,latitude,longitude))
             conn.commit()
             hospital_id = c.lastrowid
             conn.close()
@@ -659,7 +821,8 @@ def delete_hospital():
     c = conn.cursor()
     # Delete match records where this hospital is involved
     c.execute("DELETE FROM match_record WHERE donor_hospital_id=? OR patient_hospital_id=?", (hospital_id, hospital_id))
-    # Delete donors and patients for this hospital
+    # Delete donors (with their organs) and patients for this hospital
+    c.execute("DELETE FROM donor_organ WHERE donor_id IN (SELECT id FROM donor WHERE hospital_id=?)", (hospital_id,))
     c.execute("DELETE FROM donor WHERE hospital_id=?", (hospital_id,))
     c.execute("DELETE FROM patient WHERE hospital_id=?", (hospital_id,))
     # Delete the hospital itself
@@ -686,6 +849,7 @@ def hospital_dashboard():
     try:
         c.execute("SELECT id, unique_id, name, age, gender, blood_type, organ, status, registration_date FROM donor WHERE hospital_id=? ORDER BY registration_date ASC", (hospital_id,))
         donors = c.fetchall()
+        donor_organs = load_donor_organs(c, hospital_id)
         c.execute("SELECT id, unique_id, name, age, gender, blood_type, organ, status, registration_date FROM patient WHERE hospital_id=? ORDER BY registration_date ASC", (hospital_id,))
         patients = c.fetchall()
     except sqlite3.OperationalError:
@@ -697,12 +861,14 @@ def hospital_dashboard():
         c.execute("SELECT id, name, age, gender, blood_type, organ, status FROM patient WHERE hospital_id=?", (hospital_id,))
         old_patients = c.fetchall()
         patients = [(p[0], 'N/A', p[1], p[2], p[3], p[4], p[5], p[6], 'N/A') for p in old_patients]
+        donor_organs = {}
     
     conn.close()
     # Pass hospital_wallet to the template
     return render_template('hospital_login.html', hospital_name=hospital_name, 
                           hospital_email=hospital_email, hospital_location=hospital_location,
-                          hospital_wallet=hospital_wallet, donors=donors, patients=patients)
+                          hospital_wallet=hospital_wallet, donors=donors, patients=patients,
+                          donor_organs=donor_organs)
 
 @app.route('/add_donor', methods=['GET','POST'])
 def add_donor():
@@ -714,7 +880,30 @@ def add_donor():
         age = request.form['age']
         gender = request.form['gender']
         blood_type = request.form['blood_type']
-        organ = request.form['organ']
+        # One registration per donor, offering one or more organs (donor.organ keeps the first)
+        organs = list(dict.fromkeys(organ for organ in request.form.getlist('organ') if organ))
+        if not organs:
+            return jsonify({'success': False, 'message': 'Select at least one organ'}), 400
+        organ = organs[0]
+        hla_typing = request.form.get('hla_typing', '').strip() or None
+        
+        # Living kidney donors for paired exchange: paired with one of this hospital's patients, or non-directed
+        paired_patient = request.form.get('paired_patient_id', '').strip()
+        non_directed = 1 if request.form.get('non_directed') else 0
+        paired_patient_id = None
+        if paired_patient or non_directed:
+            if organs != ['Kidney'] or (paired_patient and non_directed):
+                return jsonify({'success': False, 'message': 'Living donors must be kidney donors, either paired or non-directed'}), 400
+        if paired_patient:
+            conn = sqlite3.connect(DB)
+            c = conn.cursor()
+            c.execute("SELECT id FROM patient WHERE unique_id = ? AND hospital_id = ? AND organ = 'Kidney'",
+                      (paired_patient, hospital_id))
+            patient_record = c.fetchone()
+            conn.close()
+            if not patient_record:
+                return jsonify({'success': False, 'message': 'Paired patient must be a kidney patient of this hospital'}), 400
+            paired_patient_id = patient_record[0]
         
         # Handle PDF file upload
         medical_document_path = None
@@ -733,27 +922,44 @@ def add_donor():
                 # Store only the filename, not the full path
                 medical_document_path = filename
         
-        # Generate unique ID and current timestamp
+        # Generate unique ID, current timestamp and each organ's viability deadline
         unique_id = str(uuid.uuid4())
-        registration_date = datetime.datetime.now().isoformat()
+        registered_at = datetime.datetime.now()
+        registration_date = registered_at.isoformat()
+        # Living donations are scheduled surgeries, so only deceased donor organs get a viability deadline
+        living = paired_patient_id is not None or non_directed
+        deadlines = [(organ, None if living else viability_deadline(organ, registered_at)) for organ in organs]
+        deadline = deadlines[0][1]
         
         conn = sqlite3.connect(DB)
         c = conn.cursor()
         
-        # Try new insert with unique_id, status, registration_date, and medical_document_path, fallback to old insert if needed
+        # Try new insert with unique_id, status, registration_date, medical_document_path, HLA typing, viability deadline and living donor pairing, fallback to old insert if needed
         try:
-            c.execute("INSERT INTO donor (unique_id, hospital_id, name, age, gender, blood_type, organ, status, registration_date, medical_document_path) VALUES (?,?,?,?,?,?,?,?,?,?)",
-                      (unique_id, hospital_id, name, age, gender, blood_type, organ, 'Not Matched', registration_date, medical_document_path))
+            c.execute("INSERT INTO donor (unique_id, hospital_id, name, age, gender, blood_type, organ, status, registration_date, medical_document_path, hla_typing, viability_deadline, paired_patient_id, non_directed) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                      (unique_id, hospital_id, name, age, gender, blood_type, organ, 'Not Matched', registration_date, medical_document_path, hla_typing, deadline, paired_patient_id, non_directed))
         except sqlite3.OperationalError:
             # Fallback to old insert without new columns
             c.execute("INSERT INTO donor (hospital_id, name, age, gender, blood_type, organ, status) VALUES (?,?,?,?,?,?,?)",
                       (hospital_id, name, age, gender, blood_type, organ, 'Not Matched'))
             unique_id = 'N/A'
-        
-        conn.commit()
+            deadlines = [(organ, None) for organ in organs]
         donor_id = c.lastrowid
+        add_donor_organs(c, donor_id, deadlines)
+        conn.commit()
         conn.close()
         
+        for organ, deadline in deadlines:
+            if deadline:
+                viability_sweeper.schedule(donor_id, organ, deadline)
+        
+        # Keep an already loaded candidate index current without reloading it
+        index = cached_candidate_index()
+        if index is not None and unique_id != 'N/A' and not living:
+            for organ, deadline in deadlines:
+                index.add_donor((donor_id, name, organ, blood_type, hospital_id, unique_id, registration_date,
+                                 age, hla_typing, None, None, deadline))
+        
         # Add to blockchain
         try:
             # Get hospital name
@@ -764,12 +970,13 @@ def add_donor():
             hospital_name = hospital_record[0] if hospital_record else "Unknown"
             conn.close()
             
-            block = blockchain.add_transaction(
-                donor_id=unique_id,
-                organ_type=organ,
-                hospital=hospital_name,
-                receiver_id=f"donor_{donor_id}"
-            )
+            # One entry per organ offered, all under the donor's single registration
+            block = blockchain.add_transactions([{
+                'donor_id': unique_id,
+                'organ_type': organ,
+                'hospital': hospital_name,
+                'receiver_id': f"donor_{donor_id}"
+            } for organ, _ in deadlines])
             
             # Save blockchain to JSON file
             with open('../blockchain.json', 'w') as f:
@@ -792,6 +999,12 @@ def add_patient():
         gender = request.form['gender']
         blood_type = request.form['blood_type']
         organ = request.form['organ']
+        hla_typing = request.form.get('hla_typing', '').strip() or None
+        unacceptable_antigens = request.form.get('unacceptable_antigens', '').strip() or None
+        try:
+            urgency = parse_urgency(request.form.get('urgency'))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
         
         # Handle PDF file upload
         medical_document_path = None
@@ -817,10 +1030,10 @@ def add_patient():
         conn = sqlite3.connect(DB)
         c = conn.cursor()
         
-        # Try new insert with unique_id, status, registration_date, and medical_document_path, fallback to old insert if needed
+        # Try new insert with unique_id, status, registration_date, medical_document_path and HLA typing, fallback to old insert if needed
         try:
-            c.execute("INSERT INTO patient (unique_id, hospital_id, name, age, gender, blood_type, organ, status, registration_date, medical_document_path) VALUES (?,?,?,?,?,?,?,?,?,?)",
-                      (unique_id, hospital_id, name, age, gender, blood_type, organ, 'Not Matched', registration_date, medical_document_path))
+            c.execute("INSERT INTO patient (unique_id, hospital_id, name, age, gender, blood_type, organ, status, registration_date, medical_document_path, hla_typing, unacceptable_antigens, urgency) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+                      (unique_id, hospital_id, name, age, gender, blood_type, organ, 'Not Matched', registration_date, medical_document_path, hla_typing, unacceptable_antigens, urgency))
         except sqlite3.OperationalError:
             # Fallback to old insert without new columns
             c.execute("INSERT INTO patient (hospital_id, name, age, gender, blood_type, organ, status) VALUES (?,?,?,?,?,?,?)",
@@ -831,6 +1044,17 @@ def add_patient():
         patient_id = c.lastrowid
         conn.close()
         
+        # Keep an already loaded waiting list and candidate index current without reloading them
+        patient_row = (patient_id, name, organ, blood_type, hospital_id, unique_id, registration_date,
+                       age, hla_typing, unacceptable_antigens, urgency, None)
+        with waiting_list_lock():
+            waiting = cached_waiting_list()
+            if waiting is not None and unique_id != 'N/A':
+                waiting.add(patient_row)
+        index = cached_candidate_index()
+        if index is not None and unique_id != 'N/A':
+            index.add_patient(patient_row)
+        
         # Add to blockchain
         try:
             # Get hospital name
@@ -858,6 +1082,141 @@ def add_patient():
     
     return render_template('add_patient.html')
 
+@app.route('/patient/<unique_id>/urgency', methods=['POST'])
+def update_patient_urgency(unique_id):
+    if 'hospital' not in session and 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    try:
+        urgency = parse_urgency((request.get_json(silent=True) or request.form).get('urgency'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute("SELECT id, hospital_id, status FROM patient WHERE unique_id = ?", (unique_id,))
+    patient = c.fetchone()
+    # Hospitals may only change their own patients
+    if not patient or ('admin' not in session and patient[1] != session['hospital']):
+        conn.close()
+        return jsonify({'success': False, 'message': 'Patient not found'}), 404
+    
+    c.execute("UPDATE patient SET urgency = ? WHERE id = ?", (urgency, patient[0]))
+    conn.commit()
+    conn.close()
+    
+    # Re-key the patient in the loaded waiting list instead of reloading it
+    with waiting_list_lock():
+        waiting = cached_waiting_list()
+        if waiting is not None:
+            waiting.set_urgency(patient[0], urgency)
+    index = cached_candidate_index()
+    if index is not None and index.patient(patient[0]):
+        row = index.patient(patient[0])
+        index.update_patient(row[:10] + (urgency,) + row[11:])
+    
+    return jsonify({'success': True, 'message': 'Urgency updated', 'unique_id': unique_id, 'urgency': urgency})
+
+@app.route('/patient/<unique_id>/position')
+def patient_position(unique_id):
+    """A waiting patient's place in their organ's priority queue, per compatible donor blood type"""
+    if 'hospital' not in session and 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute("SELECT id, hospital_id, organ, blood_type, urgency FROM patient WHERE unique_id = ?", (unique_id,))
+    patient = c.fetchone()
+    # Hospitals may only look up their own patients
+    if not patient or ('admin' not in session and patient[1] != session['hospital']):
+        conn.close()
+        return jsonify({'success': False, 'message': 'Patient not found'}), 404
+    with waiting_list_lock():
+        waiting = get_waiting_list(c, load_unmatched_patients, DB)
+        organ_list = waiting.organ(patient[2])
+        positions = organ_list.position(patient[0]) if organ_list else None
+    conn.close()
+    
+    if positions is None:
+        return jsonify({'success': False, 'message': 'Patient is not on the waiting list'}), 409
+    return jsonify({
+        'success': True,
+        'unique_id': unique_id,
+        'organ': patient[2],
+        'blood_type': patient[3],
+        'urgency': patient[4],
+        # Position 1 is offered first by a donor of that blood type (before allocation circles)
+        'positions': {donor_blood: {'position': position, 'queue_size': size}
+                      for donor_blood, (position, size) in positions.items()}
+    })
+
+def candidate_summary(row, hospital_names):
+    """Public fields of a donor or patient row for the candidates API (no names)"""
+    summary = {
+        'unique_id': row[5],
+        'organ': row[2],
+        'blood_type': row[3],
+        'hospital': hospital_names.get(row[4], "Unknown"),
+        'registration_date': row[6],
+        'age': row[7]
+    }
+    if row[10] is not None:
+        summary['urgency'] = row[10]
+    if row[11] is not None:
+        summary['viability_deadline'] = row[11]
+    return summary
+
+@app.route('/api/candidates/<kind>/<unique_id>')
+def compatible_candidates(kind, unique_id):
+    """Top k compatible waiting patients for a donor, or donors for a patient, without a matching run"""
+    if 'hospital' not in session and 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    if kind not in ('donor', 'patient'):
+        return jsonify({'success': False, 'message': 'Lookups are by donor or patient'}), 404
+    try:
+        k = min(max(int(request.args.get('k', 10)), 1), MAX_CANDIDATES)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'k must be a number'}), 400
+    
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    c.execute(f"SELECT id, hospital_id FROM {kind} WHERE unique_id = ?", (unique_id,))
+    registrant = c.fetchone()
+    # Hospitals may only look up their own donors and patients
+    if not registrant or ('admin' not in session and registrant[1] != session['hospital']):
+        conn.close()
+        return jsonify({'success': False, 'message': f'{kind.capitalize()} not found'}), 404
+    hospital_names = load_hospital_names(c)
+    if kind == 'donor':
+        # Donors are matched per organ: the ?organ= asked for, else their first organ still waiting
+        c.execute("SELECT organ FROM donor_organ WHERE donor_id = ? ORDER BY id", (registrant[0],))
+        organs = [row[0] for row in c.fetchall()]
+        if request.args.get('organ'):
+            organs = [organ for organ in organs if organ == request.args['organ']]
+        # Never list a patient who already declined (or let time out) an offer of this donor's organ
+        c.execute("SELECT patient_id, organ FROM offer_history WHERE donor_id = ?", (registrant[0],))
+    else:
+        # Nor a donor organ this patient already declined
+        c.execute("SELECT donor_id, organ FROM offer_history WHERE patient_id = ?", (registrant[0],))
+    declined = c.fetchall()
+    conn.close()
+    
+    index = get_candidate_index(DB)
+    if kind == 'donor':
+        row = next((row for row in (index.donor(registrant[0], organ) for organ in organs) if row), None)
+    else:
+        row = index.patient(registrant[0])
+    if row is None:
+        return jsonify({'success': False, 'message': f'{kind.capitalize()} is not waiting to be matched'}), 409
+    if kind == 'donor':
+        candidates = index.compatible_patients(row, k, exclude={patient_id for patient_id, organ in declined if organ == row[2]})
+    else:
+        candidates = index.compatible_donors(row, k, exclude=set(declined))
+    return jsonify({
+        'success': True,
+        kind: candidate_summary(row, hospital_names),
+        'candidates': [candidate_summary(candidate, hospital_names) for candidate in candidates]
+    })
+
 # ----------------- HOSPITAL VIEWS -----------------
 @app.route('/hospital_donors')
 def hospital_donors():
@@ -878,6 +1237,7 @@ def hospital_donors():
             ORDER BY registration_date ASC
         ''', (hospital_id,))
         donors = c.fetchall()
+        donor_organs = load_donor_organs(c, hospital_id)
     except sqlite3.OperationalError:
         # Fallback for old database structure
         c.execute('''
@@ -888,9 +1248,10 @@ def hospital_donors():
         ''', (hospital_id,))
         old_donors = c.fetchall()
         donors = [(d[0], 'N/A', d[1], d[2], d[3], d[4], d[5], d[6], 'N/A') for d in old_donors]
+        donor_organs = {}
     
     conn.close()
-    return render_template('hospital_donors.html', donors=donors, hospital_name=hospital_name)
+    return render_template('hospital_donors.html', donors=donors, donor_organs=donor_organs, hospital_name=hospital_name)
 
 @app.route('/hospital_patients')
 def hospital_patients():
@@ -945,7 +1306,7 @@ def hospital_matches():
                 mr.match_date,
                 d.name as donor_name,
                 d.unique_id as donor_unique_id,
-                d.organ as donor_organ,
+                COALESCE(mr.organ, d.organ) as donor_organ,
                 d.blood_type as donor_blood_type,
                 p.name as patient_name,
                 p.unique_id as patient_unique_id,
@@ -1047,189 +1408,179 @@ def matches():
     c = conn.cursor()
     
     # Improved matching algorithm with proper FCFS implementation and blood compatibility
-    try:
-        # Get all unmatched donors ordered by registration date (FCFS)
-        c.execute('''
-        SELECT d.id, d.name, d.organ, d.blood_type, d.hospital_id, d.unique_id, d.registration_date, d.age
-        FROM donor d
-        WHERE d.status='Not Matched'
-          AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.donor_id = d.id)
-        ORDER BY d.registration_date ASC
-        ''')
-        donors = c.fetchall()
-        
-        # Get all unmatched patients ordered by registration date (FCFS)
-        c.execute('''
-        SELECT p.id, p.name, p.organ, p.blood_type, p.hospital_id, p.unique_id, p.registration_date, p.age
-        FROM patient p
-        WHERE p.status='Not Matched'
-          AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.patient_id = p.id)
-        ORDER BY p.registration_date ASC
-        ''')
-        patients = c.fetchall()
-        
-        display_results = []
-        matched_donor_ids = set()
-        matched_patient_ids = set()
-        
-        # Blood compatibility rules (who can receive from whom)
-        # A+ can receive from A+, A-, O+, O-
-        # A- can receive from A-, O-
-        # B+ can receive from B+, B-, O+, O-
-        # B- can receive from B-, O-
-        # AB+ can receive from all (universal recipient)
-        # AB- can receive from AB-, A-, B-, O-
-        # O+ can receive from O+, O-
-        # O- can receive from O- (universal donor)
-        blood_compatibility = {
-            'A+': ['A+', 'A-', 'O+', 'O-'],
-            'A-': ['A-', 'O-'],
-            'B+': ['B+', 'B-', 'O+', 'O-'],
-            'B-': ['B-', 'O-'],
-            'AB+': ['A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-'],  # Universal recipient
-            'AB-': ['A-', 'B-', 'AB-', 'O-'],
-            'O+': ['O+', 'O-'],
-            'O-': ['O-']  # Universal donor
-        }
-        
-        # Create a mapping of patients by organ and compatible blood types for efficient lookup
-        patient_map = {}
-        for patient in patients:
-            patient_id, patient_name, organ, blood_type, hospital_id, unique_id, reg_date, patient_age = patient
-            # For each compatible blood type, add this patient
-            if blood_type in blood_compatibility:
-                for compatible_blood in blood_compatibility[blood_type]:
-                    key = (organ, compatible_blood)
-                    if key not in patient_map:
-                        patient_map[key] = []
-                    patient_map[key].append(patient)
-        
-        # Match donors with patients based on organ and blood compatibility (FCFS)
-        for donor in donors:
-            donor_id, donor_name, organ, blood_type, donor_hosp_id, donor_unique_id, donor_reg_date, donor_age = donor
+    # Load, match and persist the whole run under the database write lock and then the
+    # waiting-list lock, so a concurrent run, response or delete cannot take the same
+    # donors or patients in between. Pairs persist_matches still skips are not released
+    c.execute("BEGIN IMMEDIATE")
+    with waiting_list_lock():
+        try:
+            # Still-viable donors earliest-expiring first, and the priority waiting list of patients
+            donors = load_unmatched_donors(c)
+            waiting = get_waiting_list(c, load_unmatched_patients, DB)
             
-            # Skip if donor already matched
-            if donor_id in matched_donor_ids:
-                continue
-                
-            # Look for compatible patient
-            key = (organ, blood_type)
-            if key in patient_map and patient_map[key]:
-                # Get the first (earliest registered) compatible patient
-                patient = patient_map[key].pop(0)
-                patient_id, patient_name, _, _, patient_hosp_id, patient_unique_id, patient_reg_date, patient_age = patient
-                
-                # Skip if patient already matched
-                if patient_id in matched_patient_ids:
-                    continue
-                
-                # Create match in database
-                c.execute("UPDATE donor SET status='Matched' WHERE id=?", (donor_id,))
-                c.execute("UPDATE patient SET status='Matched' WHERE id=?", (patient_id,))
-                c.execute("INSERT INTO match_record (donor_id, patient_id, donor_hospital_id, patient_hospital_id, organ, blood_type) VALUES (?, ?, ?, ?, ?, ?)",
-                          (donor_id, patient_id, donor_hosp_id, patient_hosp_id, organ, blood_type))
-                
-                # Add to blockchain
-                try:
-                    # Get hospital names
-                    c.execute("SELECT name FROM hospital WHERE id = ?", (donor_hosp_id,))
-                    donor_hospital_record = c.fetchone()
-                    donor_hospital_name = donor_hospital_record[0] if donor_hospital_record else "Unknown"
-                    
-                    c.execute("SELECT name FROM hospital WHERE id = ?", (patient_hosp_id,))
-                    patient_hospital_record = c.fetchone()
-                    patient_hospital_name = patient_hospital_record[0] if patient_hospital_record else "Unknown"
-                    
-                    block = blockchain.add_transaction(
-                        donor_id=donor_unique_id,
-                        organ_type=f"{organ}_match",
-                        hospital=f"{donor_hospital_name}_to_{patient_hospital_name}",
-                        receiver_id=patient_unique_id
-                    )
-                    
-                    # Save blockchain to JSON file
-                    with open('../blockchain.json', 'w') as f:
-                        json.dump(blockchain.get_chain(), f, indent=4)
-                except Exception as e:
-                    print(f"Error adding match to blockchain: {e}")
-                
-                matched_donor_ids.add(donor_id)
-                matched_patient_ids.add(patient_id)
-                display_results.append((donor_name, patient_name, organ, blood_type, donor_unique_id, patient_unique_id))
-                
-    except sqlite3.OperationalError as e:
-        print(f"Error in matching algorithm: {e}")
-        # Fallback to old query without unique_id and registration_date
-        c.execute('''
-        SELECT d.id as donor_id, p.id as patient_id, d.name as donor, p.name as patient,
-               d.organ, d.blood_type, d.hospital_id as donor_hospital_id,
-               p.hospital_id as patient_hospital_id, d.age as donor_age, p.age as patient_age
-        FROM donor d
-        JOIN patient p
-          ON d.organ = p.organ AND d.blood_type = p.blood_type
-        WHERE d.status='Not Matched'
-          AND p.status='Not Matched'
-          AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.donor_id = d.id)
-          AND NOT EXISTS (SELECT 1 FROM match_record mr2 WHERE mr2.patient_id = p.id)
-        ORDER BY d.id ASC, p.id ASC
-        ''')
-        results = c.fetchall()
-        display_results = []
-        matched_donor_ids = set()
-        matched_patient_ids = set()
-        for r in results:
-            donor_id, patient_id, donor_name, patient_name, organ, blood, donor_hosp_id, patient_hosp_id, donor_age, patient_age = r
-            if donor_id in matched_donor_ids or patient_id in matched_patient_ids:
-                continue
-            c.execute("SELECT 1 FROM match_record WHERE donor_id=? OR patient_id=? LIMIT 1", (donor_id, patient_id))
-            if c.fetchone():
-                continue
-            c.execute("UPDATE donor SET status='Matched' WHERE id=?", (donor_id,))
-            c.execute("UPDATE patient SET status='Matched' WHERE id=?", (patient_id,))
-            c.execute("INSERT INTO match_record (donor_id, patient_id, donor_hospital_id, patient_hospital_id, organ, blood_type) VALUES (?, ?, ?, ?, ?, ?)",
-                      (donor_id, patient_id, donor_hosp_id, patient_hosp_id, organ, blood))
+            # Match organ partitions independently (priority order with blood compatibility,
+            # nearest allocation circle first), never re-offering an organ to a patient who already declined it
+            pairs = find_matches(donors, waiting, declined=declined_patients(c), circles=load_allocation_circles(c))
             
-            # Add to blockchain
+            # Persist the whole run in one write transaction, as offers to the receiving hospitals
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM match_record")
+            last_match_id = c.fetchone()[0]
+            recorded = persist_matches(c, pairs, offer_expiry)
+            conn.commit()
+        except Exception:
+            # The waiting list may already be popped for a run that was not saved
+            conn.rollback()
+            invalidate_waiting_list()
+            raise
+        if len(recorded) < len(pairs):
+            # Skipped patients were popped too; reload rather than guess their state
+            invalidate_waiting_list()
+        pairs = recorded
+        release_matches(waiting, pairs)
+    index = cached_candidate_index()
+    if index is not None:
+        for donor, patient in pairs:
+            index.discard_donor(donor[0], donor[2])
+            index.discard_patient(patient[0])
+    viability_sweeper.cancel([(donor[0], donor[2]) for donor, _ in pairs])
+    for match_id, expires_at in open_offers_since(c, last_match_id):
+        offer_scheduler.schedule(match_id, expires_at)
+    
+    display_results = [(donor[1], patient[1], donor[2], donor[3], donor[5], patient[5]) for donor, patient in pairs]
+    
+    conn.close()
+    return render_template('matches.html', results=display_results)
+
+# ----------------- OFFERS -----------------
+def settle_offer(match_id, outcome, hospital_id=None):
+    """
+    Apply a response to an open offer. Declines and timeouts cascade the organ
+    to the next candidate. Returns (applied, new (donor, patient) pair or None).
+    """
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    
+    if outcome == ACCEPTED:
+        accepted = accept_offer(c, match_id, hospital_id)
+        conn.commit()
+        if accepted:
+            offer_scheduler.cancel(match_id)
+            # Only accepted matches go on the ledger: an offer can still be declined or time out
+            c.execute("SELECT donor_id, patient_id, organ FROM match_record WHERE id=?", (match_id,))
+            donor_id, patient_id, organ = c.fetchone()
+            pair = (load_donor(c, donor_id, organ), load_patient(c, patient_id))
             try:
-                # Get hospital names
-                c.execute("SELECT name FROM hospital WHERE id = ?", (donor_hosp_id,))
-                donor_hospital_record = c.fetchone()
-                donor_hospital_name = donor_hospital_record[0] if donor_hospital_record else "Unknown"
-                
-                c.execute("SELECT name FROM hospital WHERE id = ?", (patient_hosp_id,))
-                patient_hospital_record = c.fetchone()
-                patient_hospital_name = patient_hospital_record[0] if patient_hospital_record else "Unknown"
-                
-                block = blockchain.add_transaction(
-                    donor_id=f"donor_{donor_id}",
-                    organ_type=f"{organ}_match",
-                    hospital=f"{donor_hospital_name}_to_{patient_hospital_name}",
-                    receiver_id=f"patient_{patient_id}"
-                )
-                
-                # Save blockchain to JSON file
+                block = blockchain.add_transactions(match_ledger_entries([pair], load_hospital_names(c)))
                 with open('../blockchain.json', 'w') as f:
                     json.dump(blockchain.get_chain(), f, indent=4)
             except Exception as e:
-                print(f"Error adding match to blockchain: {e}")
-            
-            matched_donor_ids.add(donor_id)
-            matched_patient_ids.add(patient_id)
-            display_results.append((donor_name, patient_name, organ, blood, 'N/A', 'N/A'))
+                print(f"Error adding accepted match to blockchain: {e}")
+        conn.close()
+        return accepted, None
+    
+    # Hold the write lock from the waiting-list check to the commit, so a concurrent
+    # run or response cannot take the cascade's patient, and two responses to the
+    # same offer cannot both close it. Load the waiting list before the closed
+    # offer changes the patient table
+    c.execute("BEGIN IMMEDIATE")
+    with waiting_list_lock():
+        waiting = get_waiting_list(c, load_unmatched_patients, DB)
+        closed = close_offer(c, match_id, outcome, hospital_id)
+        if not closed:
+            conn.rollback()
+            conn.close()
+            return False, None
+        donor_id, patient_id, organ = closed
+        
+        try:
+            # The patient goes back on the waiting list; the organ goes to the next candidate
+            waiting.add(load_patient(c, patient_id))
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM match_record")
+            last_match_id = c.fetchone()[0]
+            pair = cascade_offer(c, donor_id, organ, waiting)
+            conn.commit()
+        except Exception:
+            invalidate_waiting_list()
+            conn.close()
+            raise
+        if pair:
+            release_matches(waiting, [pair])
+    offer_scheduler.cancel(match_id)
+    
+    # The patient is waiting again; the donor only if nobody else took the organ
+    index = cached_candidate_index()
+    if index is not None:
+        index.add_patient(load_patient(c, patient_id))
+    
+    if pair:
+        if index is not None:
+            index.discard_patient(pair[1][0])
+        for new_match_id, expires_at in open_offers_since(c, last_match_id):
+            offer_scheduler.schedule(new_match_id, expires_at)
+    else:
+        # Nobody left to offer it to: the organ waits for the next run until it expires
+        c.execute("SELECT viability_deadline FROM donor_organ WHERE donor_id=? AND organ=? AND status='Not Matched'",
+                  (donor_id, organ))
+        donor = c.fetchone()
+        if donor and donor[0]:
+            viability_sweeper.schedule(donor_id, organ, donor[0])
+        if donor and index is not None:
+            index.add_donor(load_donor(c, donor_id, organ))
+    conn.close()
+    return True, pair
+
+@app.route('/offers')
+def offers():
+    if 'hospital' not in session and 'admin' not in session:
+        return redirect('/login')
     
-    conn.commit()
+    conn = sqlite3.connect(DB)
+    c = conn.cursor()
+    query = '''
+        SELECT mr.id, d.unique_id, p.unique_id, p.name, mr.organ, mr.blood_type,
+               dh.name, mr.offered_at, mr.offer_expires_at
+        FROM match_record mr
+        JOIN donor d ON mr.donor_id = d.id
+        JOIN patient p ON mr.patient_id = p.id
+        LEFT JOIN hospital dh ON mr.donor_hospital_id = dh.id
+        WHERE mr.offer_status = 'Offered'
+    '''
+    # Hospitals only see offers for their own patients
+    if 'admin' in session:
+        c.execute(query + " ORDER BY mr.offer_expires_at ASC")
+    else:
+        c.execute(query + " AND mr.patient_hospital_id = ? ORDER BY mr.offer_expires_at ASC", (session['hospital'],))
+    rows = c.fetchall()
     conn.close()
-    # Clean up any historical duplicates and sync statuses
-    dedupe_matches()
-    return render_template('matches.html', results=display_results)
+    
+    keys = ('match_id', 'donor_id', 'patient_id', 'patient_name', 'organ', 'blood_type',
+            'donor_hospital', 'offered_at', 'expires_at')
+    return jsonify({'success': True, 'offers': [dict(zip(keys, row)) for row in rows]})
+
+@app.route('/offers/<int:match_id>/<action>', methods=['POST'])
+def respond_to_offer(match_id, action):
+    if 'hospital' not in session and 'admin' not in session:
+        return jsonify({'success': False, 'message': 'Login required'}), 401
+    outcomes = {'accept': ACCEPTED, 'decline': DECLINED}
+    if action not in outcomes:
+        return jsonify({'success': False, 'message': 'Action must be accept or decline'}), 404
+    
+    # Admins may respond for any hospital; hospitals only to offers for their patients
+    hospital_id = None if 'admin' in session else session['hospital']
+    applied, pair = settle_offer(match_id, outcomes[action], hospital_id)
+    if not applied:
+        return jsonify({'success': False, 'message': 'No open offer with that id for this hospital'}), 409
+    
+    response = {'success': True, 'message': f"Offer {outcomes[action].lower()}", 'match_id': match_id}
+    if pair:
+        response['cascaded_to'] = pair[1][5]
+    return jsonify(response)
 
 # ----------------- VIEW MATCH RECORDS -----------------
 @app.route('/match_records')
 def match_records():
     if 'admin' not in session:
         return redirect('/login')
-    # Ensure no duplicates before reporting
-    dedupe_matches()
     conn = sqlite3.connect(DB)
     c = conn.cursor()
     
@@ -1451,9 +1802,17 @@ def delete_donor():
             # Note: In a real blockchain, you can't actually delete records
             # This is just for demonstration purposes
             
+        c.execute("SELECT organ FROM donor_organ WHERE donor_id = ?", (donor_id,))
+        keys = [(int(donor_id), row[0]) for row in c.fetchall()]
+        c.execute("DELETE FROM donor_organ WHERE donor_id = ?", (donor_id,))
         c.execute("DELETE FROM donor WHERE id = ?", (donor_id,))
         conn.commit()
         conn.close()
+        viability_sweeper.cancel(keys)
+        index = cached_candidate_index()
+        if index is not None:
+            for key in keys:
+                index.discard_donor(*key)
         return redirect('/admin_donors?message=Donor+deleted+successfully!')
     except Exception as e:
         conn.close()
@@ -1492,6 +1851,13 @@ def delete_patient():
         c.execute("DELETE FROM patient WHERE id = ?", (patient_id,))
         conn.commit()
         conn.close()
+        with waiting_list_lock():
+            waiting = cached_waiting_list()
+            if waiting is not None:
+                waiting.discard(int(patient_id))
+        index = cached_candidate_index()
+        if index is not None:
+            index.discard_patient(int(patient_id))
         return redirect('/admin_patients?message=Patient+deleted+successfully!')
     except Exception as e:
         conn.close()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Chain Gas Benchmark
+Compares gas per item of the single-item contract path (addRecord /
+addMatch, one transaction each) against the batch entry points (addRecords
+/ addMatches, chunked to a gas budget). Needs a Ganache-compatible node at
+GANACHE_RPC with OrganChain deployed, or CHAIN_BACKEND=tester for an
+in-process EVM running the truffle build. Batch cases are measured only
+when the deployed build has the batch functions. Emits one JSON object per
+(kind, path) case.
+
+Example:
+    python benchmark_chain_gas.py --items 200 --budgets 2000000 6000000 --output gas.jsonl
+    CHAIN_BACKEND=tester python benchmark_chain_gas.py --items 50
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add the current directory to the Python path
+sys.path.append(os.path.dirname(__file__))
+
+import blockchain_service
+
+BATCH_FUNCTIONS = {'record': 'addRecords', 'match': 'addMatches'}
+
+
+def sample_records(count):
+    return [(f"BENCH_DONOR_{i:06d}", "Kidney", f"Benchmark Hospital {i % 10}", f"BENCH_PATIENT_{i:06d}")
+            for i in range(count)]
+
+
+def sample_matches(count):
+    return [{
+        'donorName': f"Donor {i}",
+        'donorAge': 30 + i % 40,
+        'donorHospital': f"Benchmark Hospital {i % 10}",
+        'organ': "Kidney",
+        'bloodType': "O+",
+        'patientName': f"Patient {i}",
+        'patientAge': 20 + i % 50,
+        'patientHospital': f"Benchmark Hospital {(i + 3) % 10}",
+        'date': "2025-01-01"
+    } for i in range(count)]
+
+
+def measure(kind, path, items, send, budget=None):
+    """Send items, then total the gas of the distinct transactions that carried them"""
+    started = time.perf_counter()
+    receipts = send(items)
+    seconds = time.perf_counter() - started
+    mined = {receipt['transactionHash']: receipt for receipt in receipts if receipt}
+    gas_used = sum(receipt['gasUsed'] for receipt in mined.values())
+    recorded = sum(1 for receipt in receipts if receipt and receipt['status'] == 1)
+    return {
+        'kind': kind,
+        'path': path,
+        'gas_budget': budget,
+        'items': len(items),
+        'recorded': recorded,
+        'transactions': len(mined),
+        'gas_used': gas_used,
+        'gas_per_item': round(gas_used / recorded) if recorded else None,
+        'seconds': round(seconds, 3)
+    }
+
+
+def run(items, budgets, kinds):
+    records = sample_records(items)
+    matches = sample_matches(items)
+    samples = {'record': records, 'match': matches}
+    for kind in kinds:
+        yield measure(kind, 'single', samples[kind], lambda rows: blockchain_service.send_batches(kind, rows, single=True))
+        if not blockchain_service.client.has_function(BATCH_FUNCTIONS[kind]):
+            continue
+        for budget in budgets:
+            yield measure(kind, 'batch', samples[kind],
+                          lambda rows: blockchain_service.send_batches(kind, rows, budget), budget)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gas per item: single-item vs batch contract calls")
+    parser.add_argument('--items', type=int, default=100, help="Records and matches written per case")
+    parser.add_argument('--budgets', type=int, nargs='+', default=[blockchain_service.BATCH_GAS_BUDGET],
+                        help="Gas budgets per batch transaction")
+    parser.add_argument('--kinds', nargs='+', choices=['record', 'match'], default=['record', 'match'])
+    parser.add_argument('--output', help="Append JSON lines to this file as well as printing them")
+    args = parser.parse_args()
+
+    if not blockchain_service.is_connected() or not blockchain_service.contract or not blockchain_service.FROM_ADDRESS:
+        print(f"Blockchain is not available at {blockchain_service.GANACHE_RPC}; start Ganache and deploy OrganChain first")
+        return 1
+    missing = [BATCH_FUNCTIONS[kind] for kind in args.kinds if not blockchain_service.client.has_function(BATCH_FUNCTIONS[kind])]
+    if missing:
+        print(f"The deployed OrganChain has no {', '.join(missing)}; measuring single-item calls only "
+              f"(rebuild and redeploy it for batches: truffle compile, python deploy_contract.py)")
+
+    out = open(args.output, 'a') if args.output else None
+    for case in run(args.items, args.budgets, args.kinds):
+        line = json.dumps(case)
+        print(line)
+        if out:
+            out.write(line + "\n")
+    if out:
+        out.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
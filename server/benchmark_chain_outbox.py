@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Chain Outbox Load Test
+Drains queued contract writes through the chain outbox against the fake
+chain backend (fake_chain.py), so dispatcher throughput can be measured
+offline and repeatably at several simulated node round-trip latencies.
+Each case starts from an empty chain and a scratch outbox; with --sync the
+sync scripts run instead, against a copy of database.db (their dispatcher
+honours OUTBOX_BATCH_SIZE and OUTBOX_POLL_SECONDS). Emits one JSON object
+per case.
+
+Example:
+    python benchmark_chain_outbox.py --items 1000 --latencies 0 0.005 0.02 --output outbox.jsonl
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+# Add the current directory to the Python path
+sys.path.append(os.path.dirname(__file__))
+
+import blockchain_service
+import chain_outbox
+from benchmark_chain_gas import sample_matches, sample_records
+from chain_backends import FakeBackend
+
+DB = os.path.join(os.path.dirname(__file__), "database.db")
+
+
+def use_fake_chain(latency):
+    """Point blockchain_service at a fresh fake chain; returns its node"""
+    backend = FakeBackend(blockchain_service.CONTRACT_JSON_PATH, latency)
+    blockchain_service.client = blockchain_service.ChainClient(backend=backend)
+    return backend.node
+
+
+def summarize(db, node, case, seconds):
+    conn = sqlite3.connect(db)
+    c = conn.cursor()
+    counts = chain_outbox.outbox_counts(c)
+    c.execute("SELECT COUNT(DISTINCT tx_hash) FROM chain_outbox WHERE status=?", (chain_outbox.CONFIRMED,))
+    transactions = c.fetchone()[0]
+    conn.close()
+    confirmed = counts.get(chain_outbox.CONFIRMED, 0)
+    return dict(case, **{
+        'confirmed': confirmed,
+        'failed': counts.get(chain_outbox.FAILED, 0),
+        'left': sum(counts.values()) - confirmed - counts.get(chain_outbox.FAILED, 0),
+        'transactions': transactions,
+        'round_trips': node.round_trips,
+        'blocks': node.head(),
+        'seconds': round(seconds, 3),
+        'per_second': round(confirmed / seconds, 1) if seconds else None
+    })
+
+
+def run_outbox(items, latency, batch_size, workdir):
+    """Queue items records and items matches, then drain them with one dispatcher"""
+    node = use_fake_chain(latency)
+    db = os.path.join(workdir, f"outbox_{latency}_{batch_size}.db")
+    conn = sqlite3.connect(db)
+    c = conn.cursor()
+    chain_outbox.init_outbox(c)
+    chain_outbox.enqueue_many(c, 'record', [(f"record:bench:{i}", list(record)) for i, record in enumerate(sample_records(items))])
+    chain_outbox.enqueue_many(c, 'match', [(f"match:bench:{i}", match) for i, match in enumerate(sample_matches(items))])
+    conn.commit()
+    conn.close()
+
+    started = time.perf_counter()
+    chain_outbox.OutboxDispatcher(db, batch_size=batch_size, poll_seconds=0).drain()
+    seconds = time.perf_counter() - started
+    return summarize(db, node, {'mode': 'outbox', 'items': 2 * items, 'latency': latency, 'batch_size': batch_size}, seconds)
+
+
+def run_sync(latency, workdir):
+    """Run both sync scripts against a copy of database.db"""
+    import sync_blockchain_records
+    import sync_matches_to_blockchain
+
+    node = use_fake_chain(latency)
+    db = os.path.join(workdir, f"sync_{latency}.db")
+    shutil.copyfile(DB, db)
+    conn = sqlite3.connect(db)
+    c = conn.cursor()
+    # Entries confirmed on a real node earlier would not be sent again
+    chain_outbox.init_outbox(c)
+    c.execute("DELETE FROM chain_outbox")
+    conn.commit()
+    conn.close()
+    sync_blockchain_records.DB = db
+    sync_matches_to_blockchain.DB = db
+
+    started = time.perf_counter()
+    sync_blockchain_records.sync_blockchain_records()
+    sync_matches_to_blockchain.sync_matches_to_blockchain()
+    seconds = time.perf_counter() - started
+    return summarize(db, node, {'mode': 'sync', 'latency': latency, 'batch_size': chain_outbox.BATCH_SIZE}, seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chain outbox throughput against the fake chain backend")
+    parser.add_argument('--items', type=int, default=500, help="Records and matches queued per case")
+    parser.add_argument('--latencies', type=float, nargs='+', default=[0.0, 0.01],
+                        help="Simulated round-trip per node request or batch, in seconds")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[chain_outbox.BATCH_SIZE],
+                        help="Outbox entries claimed per dispatch")
+    parser.add_argument('--sync', action='store_true', help="Run the sync scripts on a copy of database.db instead")
+    parser.add_argument('--output', help="Append JSON lines to this file as well as printing them")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="outbox_bench_")
+    out = open(args.output, 'a') if args.output else None
+    try:
+        for latency in args.latencies:
+            cases = [run_sync(latency, workdir)] if args.sync else \
+                [run_outbox(args.items, latency, batch_size, workdir) for batch_size in args.batch_sizes]
+            for case in cases:
+                line = json.dumps(case)
+                print(line)
+                if out:
+                    out.write(line + "\n")
+    finally:
+        if out:
+            out.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Matching Benchmark
+Times the /matches pipeline and alternative matching engines on generated
+backlogs and emits one JSON object per (engine, size) case.
+
+Example:
+    python benchmark_matching.py --sizes 1000 10000 100000 1000000 --output bench.jsonl
+    python benchmark_matching.py --sizes 10000 --baseline bench.jsonl --tolerance 0.2
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the current directory and project root to the Python path
+sys.path.append(os.path.dirname(__file__))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+import hla_scoring
+import matching_service
+import offer_service
+from generate_dataset import generate_dataset
+from waiting_list import WaitingList
+
+PHASES = ('load', 'bucket_build', 'assign', 'persist', 'ledger')
+
+# Share of generated registrants that are patients (waiting lists outnumber donors)
+PATIENT_SHARE = 0.6
+
+
+class FCFSEngine:
+    """Baseline: organ partitions, blood buckets, pure registration-date FCFS assignment"""
+    name = 'fcfs'
+
+    def build(self, donors, patients, cursor):
+        return [(part_donors, matching_service.build_patient_buckets(part_patients))
+                for part_donors, part_patients in matching_service.partition_by_organ(donors, patients).values()]
+
+    def assign(self, state):
+        return matching_service.merge_pairs(
+            [matching_service.assign_fcfs(part_donors, buckets) for part_donors, buckets in state])
+
+
+class PriorityEngine:
+    """The serial /matches algorithm: urgency-weighted waiting list of indexed heaps"""
+    name = 'priority'
+
+    def build(self, donors, patients, cursor):
+        return donors, WaitingList(patients)
+
+    def assign(self, state):
+        return matching_service.find_matches(*state, parallel=False)
+
+
+class ParallelPriorityEngine(PriorityEngine):
+    """/matches with organ partitions of the waiting list in a process pool"""
+    name = 'priority-parallel'
+
+    def assign(self, state):
+        return matching_service.find_matches(*state, parallel=True)
+
+
+class CirclesPriorityEngine:
+    """The serial /matches algorithm with distance-aware allocation circles over geocoded hospitals"""
+    name = 'priority-circles'
+
+    def build(self, donors, patients, cursor):
+        return donors, WaitingList(patients), matching_service.load_allocation_circles(cursor)
+
+    def assign(self, state):
+        donors, waiting, circles = state
+        return matching_service.find_matches(donors, waiting, parallel=False, circles=circles)
+
+
+class HLAEngine:
+    """Waiting-list priority order followed by the vectorized HLA crossmatch scoring stage"""
+    name = 'hla'
+
+    def build(self, donors, patients, cursor):
+        waiting = WaitingList(patients)
+        return [(part_donors, hla_scoring.build_candidate_pool(part_donors, organ_list.ordered_patients()))
+                for part_donors, organ_list in matching_service.partition_waiting_list(donors, waiting).values()]
+
+    def assign(self, state):
+        return matching_service.merge_pairs(
+            [hla_scoring.assign_from_pool(part_donors, pool) for part_donors, pool in state])
+
+
+# Register replacement engines here to benchmark them side by side
+ENGINES = {engine.name: engine for engine in (FCFSEngine(), PriorityEngine(), ParallelPriorityEngine(),
+                                              CirclesPriorityEngine(), HLAEngine())}
+
+
+def dataset_path(workdir, registrants, seed, hla_fraction):
+    return os.path.join(workdir, f"backlog_{registrants}_{seed}_hla{hla_fraction:g}.db")
+
+
+def prepare_dataset(workdir, registrants, seed, hla_fraction=0.0):
+    """Generate (or reuse) an unmatched backlog of the given size"""
+    path = dataset_path(workdir, registrants, seed, hla_fraction)
+    if not os.path.exists(path):
+        patients = int(registrants * PATIENT_SHARE)
+        # Keep generator progress off stdout, which carries the JSON results
+        with contextlib.redirect_stdout(sys.stderr):
+            generate_dataset(path, hospitals=max(10, registrants // 2000), donors=registrants - patients,
+                             patients=patients, seed=seed, batch_size=100000, hla_fraction=hla_fraction)
+    return path
+
+
+def peak_rss_kb():
+    """Peak resident set size of this process and any pool workers it waited on"""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    scale = 1024 if sys.platform == 'darwin' else 1
+    return max(own, children) // scale
+
+
+def run_case(engine_name, source_db, workdir):
+    """Run one engine end to end against a private copy of source_db"""
+    from blockchain_layer import SimpleBlockchain
+    from cryptography.fernet import Fernet
+
+    engine = ENGINES[engine_name]
+    db = os.path.join(workdir, f"run_{engine_name}_{os.getpid()}.db")
+    shutil.copy(source_db, db)
+    timings = {}
+
+    try:
+        conn = sqlite3.connect(db)
+        c = conn.cursor()
+
+        started = time.perf_counter()
+        donors, patients = matching_service.load_unmatched(c)
+        timings['load'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        state = engine.build(donors, patients, c)
+        timings['bucket_build'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        pairs = engine.assign(state)
+        timings['assign'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        matching_service.persist_matches(c, pairs, offer_service.offer_expiry)
+        conn.commit()
+        timings['persist'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        blockchain = SimpleBlockchain(Fernet.generate_key())
+        if pairs:
+            hospital_names = matching_service.load_hospital_names(c)
+            blockchain.add_transactions(matching_service.match_ledger_entries(pairs, hospital_names))
+        with open(os.path.join(workdir, f"chain_{os.getpid()}.json"), 'w') as f:
+            json.dump(blockchain.get_chain(), f)
+        timings['ledger'] = time.perf_counter() - started
+        conn.close()
+    finally:
+        for path in (db, os.path.join(workdir, f"chain_{os.getpid()}.json")):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return {
+        'donors': len(donors),
+        'patients': len(patients),
+        'matches': len(pairs),
+        'phases': {phase: round(timings[phase], 6) for phase in PHASES},
+        'total': round(sum(timings.values()), 6),
+        'peak_rss_kb': peak_rss_kb()
+    }
+
+
+def run_isolated(engine_name, source_db, workdir):
+    """Run a case in a fresh interpreter so peak memory is per case"""
+    # Executor workers are not daemonic, so engines may start their own pools
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+        return pool.submit(run_case, engine_name, source_db, workdir).result()
+
+
+def baseline_key(case):
+    """Cases are only comparable on the same backlog and HLA candidate window"""
+    return (case['engine'], case['registrants'], case.get('hla_fraction', 0.0),
+            case.get('candidate_window', hla_scoring.CANDIDATE_WINDOW))
+
+
+def compare_to_baseline(results, baseline_path, tolerance):
+    """Return the cases whose total time regressed by more than tolerance"""
+    baseline = {}
+    with open(baseline_path) as f:
+        for line in f:
+            if line.strip():
+                case = json.loads(line)
+                baseline[baseline_key(case)] = case
+
+    regressions = []
+    for case in results:
+        previous = baseline.get(baseline_key(case))
+        if previous and case['total'] > previous['total'] * (1 + tolerance):
+            regressions.append((case, previous))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the matching pipeline on generated backlogs")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000],
+                        help="registrants (donors + patients) per backlog")
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--hla-fraction', type=float, default=0.3,
+                        help="share of generated registrants with HLA typing; any typed donor in an organ "
+                             "partition sends it through the HLA scoring stage (HLA_CANDIDATE_WINDOW)")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per case; the fastest is reported")
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'organchain_bench'),
+                        help="where generated backlogs are cached")
+    parser.add_argument('--output', help="append JSON lines here instead of stdout")
+    parser.add_argument('--baseline', help="JSON lines from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="allowed slowdown vs the baseline before failing (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    environment = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+    results = []
+    out = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for registrants in args.sizes:
+            print(f"Preparing backlog of {registrants:,} registrants ({args.hla_fraction:g} HLA-typed, "
+                  f"candidate window {hla_scoring.CANDIDATE_WINDOW:,})...", file=sys.stderr)
+            source_db = prepare_dataset(args.workdir, registrants, args.seed, args.hla_fraction)
+            for engine_name in args.engines:
+                runs = [run_isolated(engine_name, source_db, args.workdir) for _ in range(args.repeat)]
+                best = min(runs, key=lambda run: run['total'])
+                case = {'engine': engine_name, 'registrants': registrants, 'seed': args.seed,
+                        'hla_fraction': args.hla_fraction, 'candidate_window': hla_scoring.CANDIDATE_WINDOW,
+                        **best, 'environment': environment}
+                results.append(case)
+                out.write(json.dumps(case) + "\n")
+                out.flush()
+                phases = ", ".join(f"{phase} {best['phases'][phase]:.3f}s" for phase in PHASES)
+                print(f"  {engine_name}: {best['matches']:,} matches in {best['total']:.3f}s "
+                      f"({phases}; peak {best['peak_rss_kb'] / 1024:.0f} MB)", file=sys.stderr)
+    finally:
+        if args.output:
+            out.close()
+
+    if args.baseline:
+        regressions = compare_to_baseline(results, args.baseline, args.tolerance)
+        for case, previous in regressions:
+            print(f"REGRESSION {case['engine']} @ {case['registrants']:,}: "
+                  f"{previous['total']:.3f}s -> {case['total']:.3f}s", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
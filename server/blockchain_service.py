@@ -1,9 +1,16 @@
 import json
 import os
 import hashlib
-from web3 import Web3
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+from chain_backends import CHAIN_BACKEND, make_backend
+from circuit_breaker import CircuitBreaker
+from tx_cache import TransactionCache
+
 load_dotenv()
 
 GANACHE_RPC = os.getenv("GANACHE_RPC", "http://127.0.0.1:7545")
@@ -11,69 +18,468 @@ PRIVATE_KEY = os.getenv("PRIVATE_KEY")
 # Fix the path to the contract JSON file
 CONTRACT_JSON_PATH = os.getenv("CONTRACT_JSON_PATH", "./deployed_contract.json")
 
-def is_connected():
-    """Check if we can connect to the blockchain"""
-    try:
-        web3 = Web3(Web3.HTTPProvider(GANACHE_RPC))
-        return web3.is_connected()
-    except:
-        return False
+# Gas limits per contract call and the gas price used for every transaction
+MATCH_GAS = 400000
+RECORD_GAS = 200000
+HOSPITAL_GAS = 200000
+GAS_PRICE_GWEI = os.getenv("GAS_PRICE_GWEI", "20")
+
+# Entries fetched per getRecords/getMatches call when reading contract storage
+PAGE_SIZE = int(os.getenv("CHAIN_PAGE_SIZE", "200"))
+
+# Gas budget for one addRecords/addMatches transaction (Ganache's default block gas limit is 6,721,975)
+BATCH_GAS_BUDGET = int(os.getenv("BATCH_GAS_BUDGET", "6000000"))
+# Rough gas model for batches: per-transaction base, per-item overhead (loop, push, event)
+# and per storage slot written; estimates get BATCH_GAS_MARGIN on top
+BATCH_BASE_GAS = 60000
+RECORD_ITEM_GAS = 15000
+MATCH_ITEM_GAS = 40000
+SLOT_GAS = 22100
+BATCH_GAS_MARGIN = 1.2
+
+# How long to wait for receipts, how often to poll, and how many receipt lookups run at once
+RECEIPT_TIMEOUT = float(os.getenv("RECEIPT_TIMEOUT", "120"))
+RECEIPT_POLL_INTERVAL = float(os.getenv("RECEIPT_POLL_INTERVAL", "0.5"))
+RECEIPT_WORKERS = int(os.getenv("RECEIPT_WORKERS", "8"))
+
+# Seconds a connection check is trusted before the node is asked again
+CONNECTION_TTL = float(os.getenv("CHAIN_CONNECTION_TTL", "30"))
+
+# Consecutive node failures that open the circuit, and seconds before a half-open probe
+BREAKER_FAILURES = int(os.getenv("CHAIN_BREAKER_FAILURES", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("CHAIN_BREAKER_RESET_SECONDS", "15"))
+
+# SQLite database whose chain_outbox takes writes while the node is unavailable (unset: fail fast)
+OUTBOX_DB = os.getenv("CHAIN_OUTBOX_DB")
 
-# Initialize web3 connection
-web3 = Web3(Web3.HTTPProvider(GANACHE_RPC))
+# SQLite database holding the cache of confirmed transaction details
+TX_CACHE_DB = os.getenv("CHAIN_TX_CACHE_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.db"))
 
-# Check connection and warn if not connected
-if not web3.is_connected():
-    print("Warning: Cannot connect to Ganache at " + GANACHE_RPC)
-    print("Blockchain features will be disabled")
+class NonceManager:
+    """
+    Hands out nonces for one sender locally, so many transactions can be
+    signed and sent back-to-back without a get_transaction_count round-trip
+    each. Synced from the node's pending count on first use and after any
+    failed send (which may have left a gap).
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.next_nonce = None
+        self.lock = threading.Lock()
+
+    def allocate(self):
+        with self.lock:
+            if self.next_nonce is None:
+                self.next_nonce = client.web3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self.next_nonce
+            self.next_nonce += 1
+            return nonce
+
+    def reset(self):
+        with self.lock:
+            self.next_nonce = None
 
-acct = None
-FROM_ADDRESS = None
+class ChainClient:
+    """
+    The web3 connection, sending account and contract, built on first use
+    so importing this module costs no RPC (nor the web3 import). The node
+    behind it is a chain_backends backend (CHAIN_BACKEND). Whether the
+    node is reachable is cached for CONNECTION_TTL seconds; a failed call
+    drops the cached state so the next caller checks again. A circuit
+    breaker shared by every caller counts the failures: while it is open
+    the client reports itself disconnected without touching the network,
+    and every BREAKER_RESET_SECONDS one caller's check probes the node.
+    """
+
+    def __init__(self, rpc=GANACHE_RPC, private_key=PRIVATE_KEY, contract_json_path=CONTRACT_JSON_PATH, backend=None):
+        self.backend = backend or make_backend(CHAIN_BACKEND, rpc, contract_json_path)
+        self.private_key = private_key
+        # A backend that deploys a build of its own reads that build's ABI
+        self.contract_json_path = getattr(self.backend, 'contract_json_path', contract_json_path)
+        self.lock = threading.RLock()
+        self.breaker = CircuitBreaker(self.backend.name, BREAKER_FAILURES, BREAKER_RESET_SECONDS)
+        self._web3 = None
+        self._connected = None
+        self._checked_at = 0
+        self._warned = False
+        self._account_loaded = False
+        self._acct = None
+        self._from_address = None
+        self._nonces = None
+        self._contract_loaded = False
+        self._contract = None
+        self._abi = None
+        self._contract_address = None
+        self._deploy_block = int(os.getenv("CHAIN_INDEX_START_BLOCK", "0"))
+        self._chain_id = None
 
-# Only set up accounts if we're connected
-if web3.is_connected():
-    if PRIVATE_KEY:
+    @property
+    def web3(self):
+        if self._web3 is None:
+            with self.lock:
+                if self._web3 is None:
+                    self._web3 = self.backend.web3()
+        return self._web3
+
+    def batch(self, calls):
+        """
+        Send (method, params) pairs to the node as JSON-RPC batches. Returns
+        the raw results in order, None where the node answered with an error.
+        """
         try:
-            acct = web3.eth.account.from_key(PRIVATE_KEY)
-            FROM_ADDRESS = acct.address
-        except Exception as e:
-            print(f"Warning: Could not create account from private key: {e}")
-            # Fall back to using unlocked accounts
-            if web3.eth.accounts:
-                FROM_ADDRESS = web3.eth.accounts[0]
-    else:
-        # Use unlocked accounts if available
-        if web3.eth.accounts:
-            FROM_ADDRESS = web3.eth.accounts[0]
+            results = self.backend.batch(calls)
+        except Exception:
+            self.invalidate()
+            raise
+        self.breaker.record_success()
+        return results
 
-# Load contract ABI + address only if connected
-contract = None
-abi = None
-contract_address = None
+    def connected(self):
+        """Whether the node answers, re-checked once the cached answer is CONNECTION_TTL old"""
+        if not self.breaker.allow():
+            return False
+        if self._connected and time.time() - self._checked_at < CONNECTION_TTL:
+            return True
+        with self.lock:
+            try:
+                self._connected = self.web3.is_connected()
+            except Exception:
+                self._connected = False
+            self._checked_at = time.time()
+            if self._connected:
+                self.breaker.record_success()
+                self._warned = False
+            else:
+                self.breaker.record_failure()
+                if not self._warned:
+                    # Check connection and warn if not connected
+                    print("Warning: Cannot connect to " + self.backend.name)
+                    print("Blockchain features will be disabled")
+                    self._warned = True
+            return self._connected
 
-if web3.is_connected():
-    try:
-        with open(CONTRACT_JSON_PATH) as f:
-            contract_json = json.load(f)
-        abi = contract_json['abi']
-
-        # try to find deployed address for current network id
-        network_id = list(contract_json.get('networks', {}).keys())
-        if len(network_id) > 0:
-            # pick the first network entry deployed by truffle
-            net = contract_json['networks'][network_id[0]]
-            contract_address = net.get('address')
-        else:
-            # fallback: you can manually set address in .env or below
-            contract_address = os.getenv("CONTRACT_ADDRESS", None)
+    def invalidate(self):
+        """Forget the cached connection state after a failed call, and count it against the breaker"""
+        self._connected = None
+        self.breaker.record_failure()
 
-        if not contract_address:
-            print("Warning: Contract address not found in build file. Set CONTRACT_ADDRESS in .env or redeploy contract.")
-        else:
-            contract = web3.eth.contract(address=contract_address, abi=abi)
+    def failed(self, error):
+        """invalidate() if error means the node could not be reached (not a reverted or rejected call)"""
+        if self.backend.unreachable(error):
+            self.invalidate()
+
+    def _load_account(self):
+        with self.lock:
+            if self._account_loaded:
+                return
+            # Only set up accounts if we're connected
+            if not self.connected():
+                return
+            web3 = self.web3
+            if self.private_key:
+                try:
+                    self._acct = web3.eth.account.from_key(self.private_key)
+                    self._from_address = self._acct.address
+                except Exception as e:
+                    print(f"Warning: Could not create account from private key: {e}")
+                    # Fall back to using unlocked accounts
+                    if web3.eth.accounts:
+                        self._from_address = web3.eth.accounts[0]
+            else:
+                # Use unlocked accounts if available
+                if web3.eth.accounts:
+                    self._from_address = web3.eth.accounts[0]
+            if self._from_address:
+                self._nonces = NonceManager(self._from_address)
+            self._account_loaded = True
+
+    @property
+    def acct(self):
+        self._load_account()
+        return self._acct
+
+    @property
+    def from_address(self):
+        self._load_account()
+        return self._from_address
+
+    @property
+    def nonces(self):
+        self._load_account()
+        return self._nonces
+
+    def _load_contract(self):
+        with self.lock:
+            if self._contract_loaded:
+                return
+            # Load contract ABI + address only if connected
+            if not self.connected():
+                return
+            try:
+                with open(self.contract_json_path) as f:
+                    contract_json = json.load(f)
+                self._abi = contract_json['abi']
+                if not os.getenv("CHAIN_INDEX_START_BLOCK"):
+                    self._deploy_block = contract_json.get('block_number') or 0
+
+                # Backends with a chain of their own (tester, fake) deploy the contract themselves
+                deployed = self.backend.deploy(self.web3, contract_json)
+                network_id = list(contract_json.get('networks', {}).keys())
+                if deployed:
+                    self._contract_address, self._deploy_block = deployed
+                # try to find deployed address for current network id
+                elif len(network_id) > 0:
+                    # pick the first network entry deployed by truffle
+                    net = contract_json['networks'][network_id[0]]
+                    self._contract_address = net.get('address')
+                else:
+                    # fallback: you can manually set address in .env or below
+                    self._contract_address = os.getenv("CONTRACT_ADDRESS", None)
+
+                if not self._contract_address:
+                    print("Warning: Contract address not found in build file. Set CONTRACT_ADDRESS in .env or redeploy contract.")
+                else:
+                    self._contract = self.web3.eth.contract(address=self._contract_address, abi=self._abi)
+                self._contract_loaded = True
+            except Exception as e:
+                # Not marked loaded: the next call retries, once the breaker lets it reach the node
+                print(f"Warning: Could not load contract: {e}")
+                self._contract = None
+
+    @property
+    def contract(self):
+        self._load_contract()
+        return self._contract
+
+    @property
+    def abi(self):
+        self._load_contract()
+        return self._abi
+
+    @property
+    def contract_address(self):
+        self._load_contract()
+        return self._contract_address
+
+    def has_function(self, name):
+        """Whether the contract's ABI has the function; builds deployed before it was added lack it"""
+        return any(entry.get('type') == 'function' and entry.get('name') == name for entry in self.abi or [])
+
+    @property
+    def deploy_block(self):
+        """Block the contract was deployed in, where log indexing starts"""
+        self._load_contract()
+        return self._deploy_block
+
+    @property
+    def chain_id(self):
+        if self._chain_id is None:
+            self._chain_id = self.web3.eth.chain_id
+        return self._chain_id
+
+    def ready(self):
+        """Connected, with a contract and an account to send from"""
+        return bool(self.connected() and self.contract and self.from_address)
+
+client = ChainClient()
+tx_cache = TransactionCache(TX_CACHE_DB)
+
+# Module attributes kept for scripts that import them, resolved through the client on first access
+_CLIENT_ATTRIBUTES = {
+    'web3': 'web3',
+    'contract': 'contract',
+    'abi': 'abi',
+    'contract_address': 'contract_address',
+    'acct': 'acct',
+    'FROM_ADDRESS': 'from_address',
+    'nonces': 'nonces',
+    'deploy_block': 'deploy_block'
+}
+
+def __getattr__(name):
+    if name in _CLIENT_ATTRIBUTES:
+        return getattr(client, _CLIENT_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def queue_for_outbox(kind, payloads):
+    """
+    Queue writes that cannot be sent now in the chain outbox at OUTBOX_DB,
+    for the dispatcher to send once the node is back. Returns False (and
+    queues nothing) when no outbox is configured.
+    """
+    if not OUTBOX_DB:
+        return False
+    from chain_outbox import enqueue, init_outbox
+    conn = sqlite3.connect(OUTBOX_DB, timeout=30)
+    c = conn.cursor()
+    init_outbox(c)
+    for payload in payloads:
+        enqueue(c, kind, payload)
+    conn.commit()
+    conn.close()
+    print(f"Blockchain not available, queued {len(payloads)} {kind} write(s) in the chain outbox")
+    return True
+
+def is_connected():
+    """Check if we can connect to the blockchain (cached for CONNECTION_TTL seconds)"""
+    return client.connected()
+
+def send_contract_call(function_call, gas):
+    """Build, sign and send one contract call with a locally allocated nonce. Returns the tx hash."""
+    web3 = client.web3
+    tx = function_call.build_transaction({
+        'from': client.from_address,
+        'nonce': client.nonces.allocate(),
+        'gas': gas,
+        'gasPrice': web3.to_wei(GAS_PRICE_GWEI, 'gwei'),
+        'chainId': client.chain_id
+    })
+    try:
+        if PRIVATE_KEY and client.acct:
+            signed = web3.eth.account.sign_transaction(tx, PRIVATE_KEY)
+            return web3.eth.send_raw_transaction(signed.raw_transaction)
+        # If using unlocked accounts on Ganache, can send directly
+        return web3.eth.send_transaction(tx)
     except Exception as e:
-        print(f"Warning: Could not load contract: {e}")
-        contract = None
+        # The nonce was not used; resync before the next send
+        client.nonces.reset()
+        client.failed(e)
+        raise
+
+def submit_contract_calls(calls):
+    """
+    Send many (function_call, gas) pairs back-to-back without waiting for
+    any receipt. Returns their tx hashes in order (None where the send failed).
+    """
+    tx_hashes = []
+    for function_call, gas in calls:
+        try:
+            tx_hashes.append(send_contract_call(function_call, gas))
+        except Exception as e:
+            print(f"Error sending transaction: {e}")
+            tx_hashes.append(None)
+    return tx_hashes
+
+def _receipt_or_none(tx_hash):
+    from web3.exceptions import TransactionNotFound
+    try:
+        return client.web3.eth.get_transaction_receipt(tx_hash)
+    except TransactionNotFound:
+        return None
+
+def get_receipts(tx_hashes):
+    """One concurrent receipt lookup per tx hash; None where it is not mined yet"""
+    with ThreadPoolExecutor(max_workers=RECEIPT_WORKERS) as pool:
+        return list(pool.map(_receipt_or_none, tx_hashes))
+
+def wait_for_receipts(tx_hashes, timeout=RECEIPT_TIMEOUT, poll_interval=RECEIPT_POLL_INTERVAL):
+    """
+    Collect the receipts of many pending transactions at once, polling the
+    outstanding ones concurrently. Returns receipts in order (None where the
+    send failed or nothing was mined before the timeout).
+    """
+    receipts = [None] * len(tx_hashes)
+    pending = [i for i, tx_hash in enumerate(tx_hashes) if tx_hash is not None]
+    deadline = time.time() + timeout
+    while pending:
+        found = get_receipts([tx_hashes[i] for i in pending])
+        for i, receipt in zip(pending, found):
+            receipts[i] = receipt
+        pending = [i for i, receipt in zip(pending, found) if receipt is None]
+        if not pending or time.time() >= deadline:
+            break
+        time.sleep(poll_interval)
+    if pending:
+        print(f"Warning: {len(pending)} transaction(s) not mined within {timeout:.0f}s")
+    return receipts
+
+def send_and_wait(function_calls, gas):
+    """Pipelined submission: send every call, then wait for all receipts together"""
+    return wait_for_receipts(submit_contract_calls([(function_call, gas) for function_call in function_calls]))
+
+def value_gas(*values):
+    """Storage, calldata and log gas of the strings and numbers one item appends"""
+    gas = 0
+    for value in values:
+        size = len(str(value).encode('utf-8'))
+        slots = 1 if size < 32 else 1 + (size + 31) // 32
+        gas += SLOT_GAS * slots + 24 * size
+    return gas
+
+def chunk_by_gas(items, item_gas, budget=BATCH_GAS_BUDGET):
+    """
+    Split items into consecutive chunks whose estimated gas fits the budget.
+    Yields (first index, chunk, gas limit); an item over budget on its own
+    gets a chunk of its own.
+    """
+    start, chunk, total = 0, [], BATCH_BASE_GAS
+    for i, item in enumerate(items):
+        gas = item_gas(item)
+        if chunk and (total + gas) * BATCH_GAS_MARGIN > budget:
+            yield start, chunk, min(budget, int(total * BATCH_GAS_MARGIN))
+            start, chunk, total = i, [], BATCH_BASE_GAS
+        chunk.append(item)
+        total += gas
+    if chunk:
+        yield start, chunk, min(budget, int(total * BATCH_GAS_MARGIN))
+
+def record_gas(record):
+    # Four strings plus the block timestamp
+    return RECORD_ITEM_GAS + value_gas(*record) + SLOT_GAS
+
+def match_gas(match):
+    # MATCH_ITEM_GAS also covers the details string built for the MatchAdded event
+    return MATCH_ITEM_GAS + value_gas(*match_args(match))
+
+def single_gas(item_gas, item, floor):
+    """Gas limit for an item sent in a transaction of its own: the batch estimate for a batch of one"""
+    return max(floor, int((BATCH_BASE_GAS + item_gas(item)) * BATCH_GAS_MARGIN))
+
+def single_calls(kind, payloads):
+    """One addRecord/addMatch call per 'record' or 'match' payload, as batch_calls triples"""
+    if kind == 'record':
+        return [(client.contract.functions.addRecord(*payload), single_gas(record_gas, payload, RECORD_GAS), [i])
+                for i, payload in enumerate(payloads)]
+    if kind == 'match':
+        return [(match_call(match), single_gas(match_gas, match, MATCH_GAS), [i]) for i, match in enumerate(payloads)]
+    raise ValueError(f"Unknown single call kind: {kind}")
+
+def batch_calls(kind, payloads, budget=BATCH_GAS_BUDGET):
+    """
+    Group 'record' argument lists or 'match' dicts into addRecords/addMatches
+    calls that fit the gas budget; 'hospital' entries are sent one per call
+    (addHospital registers msg.sender), and so are records and matches when
+    the deployed contract has no batch functions. Returns (function_call, gas,
+    indexes) triples, indexes being the payload positions each call covers.
+    """
+    if kind == 'hospital':
+        return [(client.contract.functions.addHospital(*payload), HOSPITAL_GAS, [i]) for i, payload in enumerate(payloads)]
+    if kind == 'record' and not client.has_function('addRecords') or kind == 'match' and not client.has_function('addMatches'):
+        return single_calls(kind, payloads)
+    if kind == 'record':
+        return [(client.contract.functions.addRecords(*[list(column) for column in zip(*chunk)]), gas,
+                 list(range(start, start + len(chunk))))
+                for start, chunk, gas in chunk_by_gas(payloads, record_gas, budget)]
+    if kind == 'match':
+        return [(client.contract.functions.addMatches([match_args(match) for match in chunk]), gas,
+                 list(range(start, start + len(chunk))))
+                for start, chunk, gas in chunk_by_gas(payloads, match_gas, budget)]
+    raise ValueError(f"Unknown batch call kind: {kind}")
+
+def send_batches(kind, payloads, budget=BATCH_GAS_BUDGET, single=False):
+    """
+    Send payloads as gas-budgeted batch transactions (or with single, one
+    transaction each), pipelined, and return one receipt per payload (the
+    receipt of the transaction that carried it, or None).
+    """
+    batches = single_calls(kind, payloads) if single else batch_calls(kind, payloads, budget)
+    tx_hashes = submit_contract_calls([(function_call, gas) for function_call, gas, _ in batches])
+    receipts = [None] * len(payloads)
+    for (_, _, indexes), receipt in zip(batches, wait_for_receipts(tx_hashes)):
+        for i in indexes:
+            receipts[i] = receipt
+    return receipts
 
 def encrypt_sensitive_data(data):
     """Encrypt sensitive data using SHA-256"""
@@ -86,110 +492,188 @@ def add_match_to_chain(match):
       patientName, patientAge, patientHospital, date
     """
     # Return early if blockchain is not available
-    if not web3.is_connected() or not contract or not FROM_ADDRESS:
-        print("Blockchain not available, skipping match recording")
+    if not client.ready():
+        if not queue_for_outbox('match', [match]):
+            print("Blockchain not available, skipping match recording")
         return None
         
     try:
-        # Encrypt sensitive fields
-        encrypted_organ = encrypt_sensitive_data(match['organ'])
-        encrypted_blood_type = encrypt_sensitive_data(match['bloodType'])
-        
-        tx = contract.functions.addMatch(
-            match['donorName'],
-            match['donorAge'],
-            match['donorHospital'],
-            encrypted_organ,
-            encrypted_blood_type,
-            match['patientName'],
-            match['patientAge'],
-            match['patientHospital'],
-            match['date']
-        ).build_transaction({
-            'from': FROM_ADDRESS,
-            'nonce': web3.eth.get_transaction_count(FROM_ADDRESS),
-            'gas': 400000,
-            'gasPrice': web3.to_wei('20', 'gwei')
-        })
-
-        if PRIVATE_KEY and acct:
-            signed = web3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = web3.eth.send_raw_transaction(signed.raw_transaction)
-        else:
-            # If using unlocked accounts on Ganache, can send directly
-            tx_hash = web3.eth.send_transaction(tx)
-
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-        return receipt
+        return send_and_wait([match_call(match)], single_gas(match_gas, match, MATCH_GAS))[0]
     except Exception as e:
         print(f"Error adding match to blockchain: {e}")
         return None
 
+def match_args(match):
+    """addMatch arguments (and the Match struct) for a match dict, with organ and blood type encrypted"""
+    return (
+        match['donorName'],
+        match['donorAge'],
+        match['donorHospital'],
+        encrypt_sensitive_data(match['organ']),
+        encrypt_sensitive_data(match['bloodType']),
+        match['patientName'],
+        match['patientAge'],
+        match['patientHospital'],
+        match['date']
+    )
+
+def match_call(match):
+    return client.contract.functions.addMatch(*match_args(match))
+
+def add_matches_to_chain(matches):
+    """
+    add_match_to_chain for many matches: addMatches batches sized to the gas
+    budget, all sent back-to-back and their receipts collected together.
+    Returns one receipt per match (None for matches that failed).
+    """
+    if not client.ready():
+        if not queue_for_outbox('match', matches):
+            print("Blockchain not available, skipping match recording")
+        return [None] * len(matches)
+    return send_batches('match', matches)
+
 def add_record_to_chain(donor_id, organ_type, hospital, receiver_id):
     """
     Add a simple record to the blockchain (as per the example)
     """
     # Return early if blockchain is not available
-    if not web3.is_connected() or not contract or not FROM_ADDRESS:
-        print("Blockchain not available, skipping record recording")
+    if not client.ready():
+        if not queue_for_outbox('record', [[donor_id, organ_type, hospital, receiver_id]]):
+            print("Blockchain not available, skipping record recording")
         return None
         
     try:
-        tx = contract.functions.addRecord(
-            donor_id, organ_type, hospital, receiver_id
-        ).build_transaction({
-            'from': FROM_ADDRESS,
-            'nonce': web3.eth.get_transaction_count(FROM_ADDRESS),
-            'gas': 200000,
-            'gasPrice': web3.to_wei('20', 'gwei')
-        })
-
-        if PRIVATE_KEY and acct:
-            signed = web3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = web3.eth.send_raw_transaction(signed.raw_transaction)
-        else:
-            # If using unlocked accounts on Ganache, can send directly
-            tx_hash = web3.eth.send_transaction(tx)
-
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-        return receipt
+        record = (donor_id, organ_type, hospital, receiver_id)
+        return send_and_wait([client.contract.functions.addRecord(*record)], single_gas(record_gas, record, RECORD_GAS))[0]
     except Exception as e:
         print(f"Error adding record to blockchain: {e}")
         return None
 
+def add_records_to_chain(records):
+    """
+    add_record_to_chain for many (donor_id, organ_type, hospital, receiver_id)
+    tuples, sent as gas-budgeted addRecords batches. Returns one receipt per
+    record (None for records that failed).
+    """
+    if not client.ready():
+        if not queue_for_outbox('record', [list(record) for record in records]):
+            print("Blockchain not available, skipping record recording")
+        return [None] * len(records)
+    return send_batches('record', records)
+
+MATCH_FIELDS = ['donorName', 'donorAge', 'donorHospital', 'encryptedOrgan', 'encryptedBloodType',
+                'patientName', 'patientAge', 'patientHospital', 'date']
+RECORD_FIELDS = ['donorId', 'organType', 'hospital', 'receiverId', 'timestamp']
+
+def iter_pages(read_page, fields, page_size=PAGE_SIZE, start=0):
+    """
+    Walk contract storage from start, page_size entries per read_page(offset,
+    limit) call, yielding each struct as a dict. Stops at the first short
+    page. Errors propagate so callers never mistake a failed read for the
+    end of the data.
+    """
+    offset = start
+    while True:
+        page = read_page(offset, page_size)
+        for entry in page:
+            yield dict(zip(fields, entry))
+        if len(page) < page_size:
+            return
+        offset += len(page)
+
+def view_pages(view_function):
+    """read_page for a paginated view function (getMatches/getRecords)"""
+    return lambda offset, limit: view_function(offset, limit).call()
+
+def array_pages(getter, length):
+    """
+    read_page for a build without the paginated views: the public array
+    getter (matches(i)/records(i)) for every index of the page, sent as one
+    JSON-RPC batch of eth_calls and stopping at length.
+    """
+    def read_page(offset, limit):
+        calls = [getter(i) for i in range(offset, min(offset + limit, length))]
+        if not calls:
+            return []
+        results = client.batch([('eth_call', [{'to': client.contract_address, 'data': call._encode_transaction_data()}, 'latest'])
+                                for call in calls])
+        failed = results.count(None)
+        if failed:
+            raise RuntimeError(f"{failed} of {len(calls)} contract reads from index {offset} failed")
+        from hexbytes import HexBytes
+        types = [output['type'] for output in calls[0].abi['outputs']]
+        return [client.web3.codec.decode(types, HexBytes(result)) for result in results]
+    return read_page
+
+def array_length(getter, count_function=None):
+    """
+    Length of a public storage array: its count view when the build has one,
+    otherwise the first index the getter reverts on, found by doubling and
+    then bisecting.
+    """
+    if count_function is not None:
+        return count_function().call()
+    from web3.exceptions import ContractLogicError
+
+    def exists(index):
+        try:
+            getter(index).call()
+            return True
+        except ContractLogicError:
+            return False
+
+    if not exists(0):
+        return 0
+    low, high = 0, 1
+    while exists(high):
+        low, high = high, high * 2
+    while high - low > 1:
+        middle = (low + high) // 2
+        if exists(middle):
+            low = middle
+        else:
+            high = middle
+    return high
+
+def iter_matches(page_size=PAGE_SIZE, start=0):
+    """Every match stored on the contract, read page_size at a time"""
+    functions = client.contract.functions
+    if client.has_function('getMatches'):
+        read_page = view_pages(functions.getMatches)
+    else:
+        read_page = array_pages(functions.matches, array_length(functions.matches, functions.getMatchesCount))
+    return iter_pages(read_page, MATCH_FIELDS, page_size, start)
+
+def iter_records(page_size=PAGE_SIZE, start=0):
+    """Every record stored on the contract, read page_size at a time"""
+    functions = client.contract.functions
+    if client.has_function('getRecords'):
+        read_page = view_pages(functions.getRecords)
+    else:
+        count_function = functions.getRecordsCount if client.has_function('getRecordsCount') else None
+        read_page = array_pages(functions.records, array_length(functions.records, count_function))
+    return iter_pages(read_page, RECORD_FIELDS, page_size, start)
+
 def get_all_matches():
-    if not web3.is_connected() or not contract:
+    if not client.connected() or not client.contract:
         return []
         
     try:
-        matches = contract.functions.getAllMatches().call()
-        # returns list of tuples corresponding to struct fields
-        # convert to list of dicts
-        fields = ['donorName', 'donorAge', 'donorHospital', 'encryptedOrgan', 'encryptedBloodType',
-                  'patientName', 'patientAge', 'patientHospital', 'date']
-        out = []
-        for m in matches:
-            out.append({fields[i]: m[i] for i in range(len(fields))})
-        return out
+        return list(iter_matches())
     except Exception as e:
         print(f"Error getting matches from blockchain: {e}")
+        client.failed(e)
         return []
 
 def get_all_records():
-    if not web3.is_connected() or not contract:
+    if not client.connected() or not client.contract:
         return []
         
     try:
-        records = contract.functions.getAllRecords().call()
-        # returns list of tuples corresponding to struct fields
-        # convert to list of dicts
-        fields = ['donorId', 'organType', 'hospital', 'receiverId', 'timestamp']
-        out = []
-        for r in records:
-            out.append({fields[i]: r[i] for i in range(len(fields))})
-        return out
+        return list(iter_records())
     except Exception as e:
         print(f"Error getting records from blockchain: {e}")
+        client.failed(e)
         return []
 
 def add_hospital_to_blockchain(name, email, location):
@@ -197,73 +681,138 @@ def add_hospital_to_blockchain(name, email, location):
     Add a hospital to the blockchain
     """
     # Return early if blockchain is not available
-    if not web3.is_connected() or not contract or not FROM_ADDRESS:
-        print("Blockchain not available, skipping hospital registration")
+    if not client.ready():
+        if not queue_for_outbox('hospital', [[name, email, location]]):
+            print("Blockchain not available, skipping hospital registration")
         return None
         
     try:
-        tx = contract.functions.addHospital(name, email, location).build_transaction({
-            'from': FROM_ADDRESS,
-            'nonce': web3.eth.get_transaction_count(FROM_ADDRESS),
-            'gas': 200000,
-            'gasPrice': web3.to_wei('20', 'gwei')
-        })
-
-        if PRIVATE_KEY and acct:
-            signed = web3.eth.account.sign_transaction(tx, PRIVATE_KEY)
-            tx_hash = web3.eth.send_raw_transaction(signed.raw_transaction)
-        else:
-            # If using unlocked accounts on Ganache, can send directly
-            tx_hash = web3.eth.send_transaction(tx)
-
-        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
-        return receipt
+        return send_and_wait([client.contract.functions.addHospital(name, email, location)], HOSPITAL_GAS)[0]
     except Exception as e:
         print(f"Error adding hospital to blockchain: {e}")
         return None
 
-def is_hospital_registered(hospital_address):
+def add_hospitals_to_blockchain(hospitals):
+    """Pipelined add_hospital_to_blockchain for many (name, email, location) tuples"""
+    if not client.ready():
+        if not queue_for_outbox('hospital', [list(hospital) for hospital in hospitals]):
+            print("Blockchain not available, skipping hospital registration")
+        return [None] * len(hospitals)
+    return send_and_wait([client.contract.functions.addHospital(*hospital) for hospital in hospitals], HOSPITAL_GAS)
+
+# Output types of the hospitals(address) getter: name, email, location, isRegistered
+HOSPITAL_TYPES = ['string', 'string', 'string', 'bool']
+
+def hospitals_registered(hospital_addresses):
     """
-    Check if a hospital is registered on the blockchain
+    Whether each address is a registered hospital, with every hospitals()
+    eth_call sent in one JSON-RPC batch
     """
-    if not web3.is_connected() or not contract:
-        return False
+    if not client.connected() or not client.contract:
+        return [False] * len(hospital_addresses)
         
     try:
-        result = contract.functions.hospitals(hospital_address).call()
-        # result is a tuple: (name, email, location, isRegistered)
-        return result[3]  # isRegistered field
+        contract = client.contract
+        results = client.batch([('eth_call', [{'to': contract.address,
+                                               'data': contract.encodeABI(fn_name='hospitals', args=[address])},
+                                              'latest'])
+                                for address in hospital_addresses])
+        # each result is an encoded tuple: (name, email, location, isRegistered)
+        return [bool(result) and result != '0x' and client.web3.codec.decode(HOSPITAL_TYPES, _to_bytes(result))[3]
+                for result in results]
     except Exception as e:
         print(f"Error checking hospital registration: {e}")
-        return False
+        client.failed(e)
+        return [False] * len(hospital_addresses)
 
-def get_transaction_details(tx_hash):
+def is_hospital_registered(hospital_address):
     """
-    Get detailed information about a transaction
+    Check if a hospital is registered on the blockchain
     """
-    if not web3.is_connected():
-        return None
-        
-    try:
-        tx = web3.eth.get_transaction(tx_hash)
-        receipt = web3.eth.get_transaction_receipt(tx_hash)
-        
-        # Get block information
-        block = web3.eth.get_block(receipt['blockNumber'])
-        
-        return {
+    return hospitals_registered([hospital_address])[0]
+
+def _hex_to_int(value):
+    return int(value, 16) if isinstance(value, str) else value
+
+def _to_bytes(value):
+    return bytes.fromhex(value[2:]) if isinstance(value, str) else bytes(value)
+
+def _tx_hash_hex(tx_hash):
+    if isinstance(tx_hash, str):
+        return (tx_hash if tx_hash.startswith('0x') else '0x' + tx_hash).lower()
+    return '0x' + bytes(tx_hash).hex()
+
+def _fetch_transactions_details(hashes):
+    """
+    Details of transactions from the node in two JSON-RPC batches: every
+    transaction and receipt (plus the head block number), then every block
+    they were mined in. Returns (details in order, head block number).
+    """
+    replies = client.batch([('eth_blockNumber', [])] +
+                           [(method, [tx_hash]) for tx_hash in hashes
+                            for method in ('eth_getTransactionByHash', 'eth_getTransactionReceipt')])
+    head = _hex_to_int(replies[0])
+    pairs = [(replies[1 + 2 * i], replies[2 + 2 * i]) for i in range(len(hashes))]
+    
+    # Get block information
+    block_numbers = sorted({_hex_to_int(receipt['blockNumber']) for _, receipt in pairs if receipt})
+    blocks = dict(zip(block_numbers, client.batch([('eth_getBlockByNumber', [hex(number), False]) for number in block_numbers])))
+    
+    details = []
+    for tx_hash, (tx, receipt) in zip(hashes, pairs):
+        block = blocks.get(_hex_to_int(receipt['blockNumber'])) if receipt else None
+        if not tx or not receipt or not block:
+            details.append(None)
+            continue
+        details.append({
             'transaction_hash': tx_hash,
             'from': tx['from'],
             'to': tx['to'],
-            'gas': tx['gas'],
-            'gas_price': tx['gasPrice'],
-            'value': tx['value'],
-            'block_number': receipt['blockNumber'],
-            'block_timestamp': block['timestamp'],
-            'gas_used': receipt['gasUsed'],
-            'status': receipt['status'],
+            'gas': _hex_to_int(tx['gas']),
+            'gas_price': _hex_to_int(tx['gasPrice']),
+            'value': _hex_to_int(tx['value']),
+            'block_number': _hex_to_int(receipt['blockNumber']),
+            'block_timestamp': _hex_to_int(block['timestamp']),
+            'gas_used': _hex_to_int(receipt['gasUsed']),
+            'status': _hex_to_int(receipt['status']),
             'logs': receipt['logs']
-        }
+        })
+    return details, head
+
+def get_transactions_details(tx_hashes):
+    """
+    get_transaction_details for many transactions. Confirmed transactions
+    come from tx_cache without touching the node; the rest are fetched in
+    two JSON-RPC batches and cached once they are deep enough.
+    Returns details in order, None for unknown or pending transactions.
+    """
+    hashes = [_tx_hash_hex(tx_hash) for tx_hash in tx_hashes]
+    try:
+        details = tx_cache.get_many(hashes)
+    except sqlite3.Error as e:
+        print(f"Error reading transaction cache: {e}")
+        details = [None] * len(hashes)
+    missing = list(dict.fromkeys(tx_hash for tx_hash, found in zip(hashes, details) if found is None))
+    if not missing or not client.connected():
+        return details
+        
+    try:
+        fetched, head = _fetch_transactions_details(missing)
     except Exception as e:
         print(f"Error getting transaction details: {e}")
-        return None
\ No newline at end of file
+        client.failed(e)
+        return details
+    try:
+        # Without the head block nothing is known to be confirmed
+        if head is not None:
+            tx_cache.put_many(fetched, head)
+    except sqlite3.Error as e:
+        print(f"Error writing transaction cache: {e}")
+    fetched = dict(zip(missing, fetched))
+    return [found if found is not None else fetched.get(tx_hash) for tx_hash, found in zip(hashes, details)]
+
+def get_transaction_details(tx_hash):
+    """
+    Get detailed information about a transaction
+    """
+    return get_transactions_details([tx_hash])[0]
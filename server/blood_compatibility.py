@@ -0,0 +1,90 @@
+"""
+Blood compatibility
+ABO/Rh compatibility encoded as bitmasks. Each of the 8 blood types is one
+bit, so a set of blood types is an int and a compatibility check is a single AND.
+"""
+
+# Bit position of each blood type
+BLOOD_TYPES = ('O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+')
+BLOOD_INDEX = {blood_type: i for i, blood_type in enumerate(BLOOD_TYPES)}
+BLOOD_BITS = {blood_type: 1 << i for i, blood_type in enumerate(BLOOD_TYPES)}
+ALL_BLOOD_TYPES = (1 << len(BLOOD_TYPES)) - 1
+
+
+def _antigens(blood_type):
+    """A, B and Rh(D) antigens carried by a blood type"""
+    abo, rh = blood_type[:-1], blood_type[-1]
+    return {antigen for antigen in abo if antigen in 'AB'} | ({'D'} if rh == '+' else set())
+
+
+# A recipient can receive from any donor whose antigens it also carries:
+# A+ can receive from A+, A-, O+, O-
+# A- can receive from A-, O-
+# B+ can receive from B+, B-, O+, O-
+# B- can receive from B-, O-
+# AB+ can receive from all (universal recipient)
+# AB- can receive from AB-, A-, B-, O-
+# O+ can receive from O+, O-
+# O- can receive from O- (universal donor)
+RECEIVE_MASKS = {
+    recipient: sum(BLOOD_BITS[donor] for donor in BLOOD_TYPES if _antigens(donor) <= _antigens(recipient))
+    for recipient in BLOOD_TYPES
+}
+DONATE_MASKS = {
+    donor: sum(BLOOD_BITS[recipient] for recipient in BLOOD_TYPES if RECEIVE_MASKS[recipient] & BLOOD_BITS[donor])
+    for donor in BLOOD_TYPES
+}
+
+
+def blood_bit(blood_type):
+    """Bit for a blood type, or 0 for unknown values"""
+    return BLOOD_BITS.get(blood_type, 0)
+
+
+def receive_mask(recipient_blood):
+    """Bitset of donor blood types a recipient can receive from"""
+    return RECEIVE_MASKS.get(recipient_blood, 0)
+
+
+def donate_mask(donor_blood):
+    """Bitset of recipient blood types a donor can give to"""
+    return DONATE_MASKS.get(donor_blood, 0)
+
+
+def is_compatible(donor_blood, recipient_blood):
+    """True if a recipient can receive from a donor"""
+    return bool(RECEIVE_MASKS.get(recipient_blood, 0) & BLOOD_BITS.get(donor_blood, 0))
+
+
+def iter_bits(mask):
+    """Yield the blood type indexes set in a bitset, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def blood_types_in(mask):
+    """Blood type names set in a bitset"""
+    return [BLOOD_TYPES[i] for i in iter_bits(mask)]
+
+
+def compatible_donor_types(recipient_blood):
+    """Donor blood types a recipient can receive from"""
+    return blood_types_in(receive_mask(recipient_blood))
+
+
+def compatible_recipient_types(donor_blood):
+    """Recipient blood types that can receive from a donor"""
+    return blood_types_in(donate_mask(donor_blood))
+
+
+def register_sql_functions(conn):
+    """Expose blood_compatible(donor_blood, recipient_blood) to SQLite queries"""
+    conn.create_function("blood_compatible", 2,
+                         lambda donor_blood, recipient_blood: int(is_compatible(donor_blood, recipient_blood)),
+                         deterministic=True)
+
+
+# Recipient -> compatible donor blood types, for code that wants plain lists
+BLOOD_COMPATIBILITY = {recipient: compatible_donor_types(recipient) for recipient in BLOOD_TYPES}
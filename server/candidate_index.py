@@ -0,0 +1,251 @@
+"""
+Candidate index
+Read-only lookups of compatible candidates without a matching run. Waiting
+patients and donors are kept in per-(organ, blood type) buckets already in
+queue order, so the top k compatible candidates are a k-way merge of at
+most eight bucket heads.
+"""
+
+import bisect
+import datetime
+import heapq
+import itertools
+import sqlite3
+import threading
+
+from blood_compatibility import BLOOD_INDEX, DONATE_MASKS, RECEIVE_MASKS, iter_bits
+from db_watch import CommitWatch
+from matching_service import (BLOOD_TYPE, ID, ORGAN, VIABILITY_DEADLINE,
+                              donor_order, load_unmatched_donors, load_unmatched_patients)
+from waiting_list import default_priority
+
+# Most candidates a single lookup may return
+MAX_CANDIDATES = 100
+
+# Same filters as load_unmatched_donors(include_expired=True) and load_unmatched_patients()
+DONOR_SIGNATURE_QUERY = '''
+    SELECT COUNT(*), TOTAL(d.id)
+    FROM donor_organ o
+    JOIN donor d ON d.id = o.donor_id
+    WHERE o.status='Not Matched'
+      AND d.paired_patient_id IS NULL AND NOT COALESCE(d.non_directed, 0)
+      AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.donor_id = d.id AND mr.organ = o.organ)
+'''
+PATIENT_SIGNATURE_QUERY = '''
+    SELECT COUNT(*), TOTAL(p.id)
+    FROM patient p
+    WHERE p.status='Not Matched'
+      AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.patient_id = p.id)
+'''
+
+
+def patient_order(row):
+    """Patient queue order: the matcher's priority score, highest first, then id"""
+    return (-default_priority(row), row[ID])
+
+
+def donor_key(row):
+    """Donor rows are per organ, so a multi-organ donor has one row per organ"""
+    return row[ID], row[ORGAN]
+
+
+def patient_key(row):
+    return row[ID]
+
+
+class OrderedBucket:
+    """
+    Rows of one (organ, blood type) bucket, kept sorted by their queue key.
+    Each row's key is kept, so it is removed at the position it was added
+    at even if its key would now come out differently.
+    """
+
+    def __init__(self, rows, order):
+        self.order = order
+        entries = sorted((order(row), row) for row in rows)
+        self.keys = [key for key, _ in entries]
+        self.rows = [row for _, row in entries]
+        self.row_keys = {row: key for key, row in entries}
+
+    def __len__(self):
+        return len(self.rows)
+
+    def add(self, row):
+        key = self.order(row)
+        i = bisect.bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.rows.insert(i, row)
+        self.row_keys[row] = key
+
+    def remove(self, row):
+        key = self.row_keys.pop(row, None)
+        if key is None:
+            return False
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+            del self.rows[i]
+            return True
+        return False
+
+    def __iter__(self):
+        return zip(self.keys, self.rows)
+
+
+class CandidateIndex:
+    """
+    Unmatched donor organs (donor_order) and patients (patient_order, the
+    matcher's priority) bucketed by organ and blood type. Donor rows are
+    keyed by (donor id, organ), patient rows by id. Tracks the count and id
+    total of each side, like the waiting list, so a stale index can be
+    detected cheaply. Mutators and lookups hold the module lock, as lookups
+    and the routes applying writes run on different request threads.
+    """
+
+    def __init__(self, donors=(), patients=()):
+        self.donors = self._build(donors, donor_order)
+        self.patients = self._build(patients, patient_order)
+        self.donor_rows = {donor_key(row): row for row in donors}
+        self.patient_rows = {patient_key(row): row for row in patients}
+        self.donor_signature = [len(donors), sum(row[ID] for row in donors)]
+        self.patient_signature = [len(patients), sum(row[ID] for row in patients)]
+
+    @staticmethod
+    def _build(rows, order):
+        grouped = {}
+        for row in rows:
+            index = BLOOD_INDEX.get(row[BLOOD_TYPE])
+            if index is not None:
+                grouped.setdefault((row[ORGAN], index), []).append(row)
+        return {bucket: OrderedBucket(bucket_rows, order) for bucket, bucket_rows in grouped.items()}
+
+    def signature(self):
+        return tuple(self.donor_signature), tuple(self.patient_signature)
+
+    def donor(self, donor_id, organ):
+        return self.donor_rows.get((donor_id, organ))
+
+    def patient(self, patient_id):
+        return self.patient_rows.get(patient_id)
+
+    @staticmethod
+    def _add(buckets, rows, signature, row, order, key):
+        if key in rows:
+            return
+        index = BLOOD_INDEX.get(row[BLOOD_TYPE])
+        if index is not None:
+            buckets.setdefault((row[ORGAN], index), OrderedBucket([], order)).add(row)
+        rows[key] = row
+        signature[0] += 1
+        signature[1] += row[ID]
+
+    @staticmethod
+    def _discard(buckets, rows, signature, key):
+        row = rows.pop(key, None)
+        if row is None:
+            return
+        bucket = buckets.get((row[ORGAN], BLOOD_INDEX.get(row[BLOOD_TYPE])))
+        if bucket is not None:
+            bucket.remove(row)
+        signature[0] -= 1
+        signature[1] -= row[ID]
+
+    def add_donor(self, row):
+        with _lock:
+            self._add(self.donors, self.donor_rows, self.donor_signature, row, donor_order, donor_key(row))
+
+    def add_patient(self, row):
+        with _lock:
+            self._add(self.patients, self.patient_rows, self.patient_signature, row, patient_order, patient_key(row))
+
+    def update_patient(self, row):
+        """Replace a waiting patient's row after a change, re-ranking it if its priority moved (e.g. urgency)"""
+        with _lock:
+            old = self.patient_rows.get(row[ID])
+            if old is None:
+                return
+            bucket = self.patients.get((old[ORGAN], BLOOD_INDEX.get(old[BLOOD_TYPE])))
+            if bucket is not None and bucket.remove(old):
+                bucket.add(row)
+            self.patient_rows[row[ID]] = row
+
+    def discard_donor(self, donor_id, organ):
+        """Forget a donor organ that was matched, expired or deleted"""
+        with _lock:
+            self._discard(self.donors, self.donor_rows, self.donor_signature, (donor_id, organ))
+
+    def discard_patient(self, patient_id):
+        """Forget a patient that was matched or deleted"""
+        with _lock:
+            self._discard(self.patients, self.patient_rows, self.patient_signature, patient_id)
+
+    def compatible_patients(self, donor, k=10, exclude=()):
+        """Top k waiting patients who could receive this donor organ, in priority order, skipping exclude ids"""
+        with _lock:
+            buckets = [self.patients.get((donor[ORGAN], index)) for index in iter_bits(DONATE_MASKS.get(donor[BLOOD_TYPE], 0))]
+            merged = heapq.merge(*[bucket for bucket in buckets if bucket])
+            rows = (row for _, row in merged if patient_key(row) not in exclude)
+            return list(itertools.islice(rows, k))
+
+    def compatible_donors(self, patient, k=10, now=None, exclude=()):
+        """
+        Top k still-viable donors whose organ patient could receive, in donor
+        queue order, skipping exclude (donor id, organ) keys
+        """
+        now = now or datetime.datetime.now().isoformat()
+        with _lock:
+            buckets = [self.donors.get((patient[ORGAN], index)) for index in iter_bits(RECEIVE_MASKS.get(patient[BLOOD_TYPE], 0))]
+            merged = heapq.merge(*[bucket for bucket in buckets if bucket])
+            # Keys start with the deadline, so expired donors not yet swept come first and are skipped
+            viable = (row for _, row in merged
+                      if (not row[VIABILITY_DEADLINE] or row[VIABILITY_DEADLINE] > now) and donor_key(row) not in exclude)
+            return list(itertools.islice(viable, k))
+
+
+def load_candidate_index(cursor):
+    return CandidateIndex(load_unmatched_donors(cursor, include_expired=True), load_unmatched_patients(cursor))
+
+
+def database_signature(cursor):
+    cursor.execute(DONOR_SIGNATURE_QUERY)
+    donor_count, donor_total = cursor.fetchone()
+    cursor.execute(PATIENT_SIGNATURE_QUERY)
+    patient_count, patient_total = cursor.fetchone()
+    return (donor_count, int(donor_total)), (patient_count, int(patient_total))
+
+
+# Process-wide index and the watch that tells when to re-check it; _lock also
+# guards the loaded index's buckets
+_index = None
+_watch = None
+_lock = threading.Lock()
+
+
+def get_candidate_index(db):
+    """
+    Return the process-wide candidate index. The signature queries only run
+    after someone committed (CommitWatch), and the index is only reloaded
+    when that write was not already applied in-process.
+    """
+    global _index, _watch
+    with _lock:
+        if _watch is None or _watch.db != db:
+            _watch = CommitWatch(db)
+        if _watch.changed() or _index is None:
+            conn = sqlite3.connect(db)
+            cursor = conn.cursor()
+            if _index is None or _index.signature() != database_signature(cursor):
+                _index = load_candidate_index(cursor)
+            conn.close()
+        return _index
+
+
+def cached_candidate_index():
+    """The loaded candidate index, or None if nothing has loaded it yet"""
+    return _index
+
+
+def invalidate_candidate_index():
+    """Force the next get_candidate_index() call to reload from the database"""
+    global _index
+    _index = None
@@ -0,0 +1,197 @@
+"""
+Chain backends
+What blockchain_service's ChainClient talks to. A backend builds the web3
+instance, answers raw JSON-RPC batches, deploys the contract if it brings
+its own chain, and says which errors mean the node is unreachable.
+CHAIN_BACKEND picks one:
+    http    a node at GANACHE_RPC over pooled keep-alive HTTP (the default)
+    tester  an in-process EVM running the truffle build (needs eth-tester with py-evm)
+    fake    fake_chain's pure-Python OrganChain, CHAIN_FAKE_LATENCY seconds per round-trip
+The last two need no Ganache, so the sync scripts and the chain outbox can
+be tested and load-tested offline and repeatably.
+"""
+
+import json
+import os
+import threading
+
+CHAIN_BACKEND = os.getenv("CHAIN_BACKEND", "http")
+
+# Keep-alive connections kept open to the node, per-request timeout, and most requests per JSON-RPC batch
+RPC_POOL_SIZE = int(os.getenv("RPC_POOL_SIZE", "16"))
+RPC_TIMEOUT = float(os.getenv("RPC_TIMEOUT", "10"))
+RPC_BATCH_SIZE = int(os.getenv("RPC_BATCH_SIZE", "100"))
+
+# Simulated network round-trip of the fake backend, in seconds
+FAKE_LATENCY = float(os.getenv("CHAIN_FAKE_LATENCY", "0"))
+
+# Compiled contract (ABI and bytecode) the tester backend deploys
+TESTER_ARTIFACT = os.getenv("CHAIN_TESTER_ARTIFACT",
+                            os.path.join(os.path.dirname(__file__), "..", "build", "contracts", "OrganChain.json"))
+
+
+def batch_results(replies, count):
+    """Results of one JSON-RPC batch in request order, None where the node answered with an error"""
+    by_id = {}
+    for reply in replies:
+        if 'error' in reply:
+            print(f"RPC error in batch: {reply['error']}")
+        by_id[reply.get('id')] = reply.get('result')
+    return [by_id.get(i) for i in range(count)]
+
+
+class HTTPBackend:
+    """A JSON-RPC node over one pooled keep-alive session, shared by the web3 provider and batches"""
+
+    def __init__(self, rpc):
+        self.rpc = rpc
+        self.name = "Ganache at " + rpc
+        self.lock = threading.Lock()
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self.lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=RPC_POOL_SIZE)
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def web3(self):
+        from web3 import Web3
+        return Web3(Web3.HTTPProvider(self.rpc, request_kwargs={'timeout': RPC_TIMEOUT}, session=self.session))
+
+    def batch(self, calls):
+        """Send (method, params) pairs as JSON-RPC batch requests of at most RPC_BATCH_SIZE calls"""
+        results = []
+        for start in range(0, len(calls), RPC_BATCH_SIZE):
+            chunk = calls[start:start + RPC_BATCH_SIZE]
+            payload = [{'jsonrpc': '2.0', 'id': i, 'method': method, 'params': params}
+                       for i, (method, params) in enumerate(chunk)]
+            response = self.session.post(self.rpc, json=payload, timeout=RPC_TIMEOUT)
+            response.raise_for_status()
+            results.extend(batch_results(response.json(), len(chunk)))
+        return results
+
+    def deploy(self, web3, contract_json):
+        # The contract is deployed on the node already; its address comes from the contract JSON or .env
+        return None
+
+    def unreachable(self, error):
+        import requests
+        return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class TesterBackend:
+    """
+    An in-process EVM through web3's EthereumTesterProvider. OrganChain is
+    deployed from the truffle build's bytecode by the first account, which
+    is also the sending account (leave PRIVATE_KEY unset), and the client
+    reads that build's ABI, so functions the build lacks take the
+    single-call fallbacks.
+    """
+
+    def __init__(self, artifact_path=TESTER_ARTIFACT):
+        self.name = "in-process EVM"
+        self.contract_json_path = artifact_path
+        self.lock = threading.Lock()
+        self._web3 = None
+
+    def web3(self):
+        if self._web3 is None:
+            with self.lock:
+                if self._web3 is None:
+                    from web3 import Web3
+                    try:
+                        from web3.providers.eth_tester import EthereumTesterProvider
+                        from eth_tester.exceptions import TransactionFailed
+                    except ImportError:
+                        print("CHAIN_BACKEND=tester needs eth-tester: pip install 'eth-tester[py-evm]'")
+                        raise
+
+                    class RevertingProvider(EthereumTesterProvider):
+                        # Answer reverts with a JSON-RPC error as a node does, so web3 raises
+                        # ContractLogicError and batches get an error reply for that call
+                        def make_request(self, method, params):
+                            try:
+                                return super().make_request(method, params)
+                            except TransactionFailed as e:
+                                return {'jsonrpc': '2.0', 'error': {'code': 3, 'message': str(e)}}
+
+                    self._web3 = Web3(RevertingProvider())
+        return self._web3
+
+    def batch(self, calls):
+        # In process there is no round-trip to save: answer the calls one by one
+        web3 = self.web3()
+        request = web3.provider.request_func(web3, web3.middleware_onion)
+        return batch_results([dict(request(method, params), id=i) for i, (method, params) in enumerate(calls)], len(calls))
+
+    def deploy(self, web3, contract_json):
+        bytecode = contract_json.get('bytecode')
+        if not bytecode:
+            print(f"Warning: {self.contract_json_path} has no bytecode; run 'truffle compile' first")
+            return None
+        tx_hash = web3.eth.contract(abi=contract_json['abi'], bytecode=bytecode).constructor().transact({'from': web3.eth.accounts[0]})
+        receipt = web3.eth.wait_for_transaction_receipt(tx_hash)
+        return receipt['contractAddress'], receipt['blockNumber']
+
+    def unreachable(self, error):
+        return False
+
+
+class FakeBackend:
+    """fake_chain's in-memory node and OrganChain, sleeping latency seconds per request or batch"""
+
+    def __init__(self, contract_json_path, latency=FAKE_LATENCY):
+        self.name = "fake chain node"
+        self.contract_json_path = contract_json_path
+        self.latency = latency
+        self.lock = threading.Lock()
+        self._node = None
+
+    @property
+    def node(self):
+        if self._node is None:
+            with self.lock:
+                if self._node is None:
+                    from fake_chain import FakeNode
+                    with open(self.contract_json_path) as f:
+                        abi = json.load(f)['abi']
+                    self._node = FakeNode(abi, self.latency)
+        return self._node
+
+    def web3(self):
+        from web3 import Web3
+        return Web3(self.node)
+
+    def batch(self, calls):
+        results = []
+        for start in range(0, len(calls), RPC_BATCH_SIZE):
+            chunk = calls[start:start + RPC_BATCH_SIZE]
+            results.extend(batch_results(self.node.batch(chunk), len(chunk)))
+        return results
+
+    def deploy(self, web3, contract_json):
+        # OrganChain is there from the genesis block
+        return self.node.contract_address, 0
+
+    def unreachable(self, error):
+        return isinstance(error, ConnectionError)
+
+
+def make_backend(kind, rpc, contract_json_path):
+    """The backend named by CHAIN_BACKEND"""
+    if kind == 'http':
+        return HTTPBackend(rpc)
+    if kind == 'tester':
+        return TesterBackend()
+    if kind == 'fake':
+        return FakeBackend(contract_json_path)
+    raise ValueError(f"Unknown CHAIN_BACKEND {kind!r}: use http, tester or fake")
@@ -0,0 +1,180 @@
+"""
+Chain indexer
+Mirrors the contract's OrganRegistered, MatchAdded and HospitalAdded logs
+into SQLite with eth_getLogs over block ranges. Only blocks at least
+CONFIRMATIONS deep are indexed, and a last-processed-block checkpoint
+(number and hash) makes each run cost only the blocks since the previous
+one. If the checkpoint block's hash changed, a deeper reorg happened: the
+last REORG_REWIND blocks are dropped and indexed again.
+"""
+
+import json
+import os
+
+INDEXED_EVENTS = ('OrganRegistered', 'MatchAdded', 'HospitalAdded')
+
+CHAIN_EVENT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS chain_event (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event TEXT NOT NULL,
+        block_number INTEGER NOT NULL,
+        block_hash TEXT NOT NULL,
+        block_timestamp INTEGER,
+        tx_hash TEXT NOT NULL,
+        log_index INTEGER NOT NULL,
+        args TEXT NOT NULL,
+        UNIQUE (tx_hash, log_index)
+    )
+'''
+CHAIN_EVENT_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_chain_event_block ON chain_event(block_number)",
+    "CREATE INDEX IF NOT EXISTS idx_chain_event_event ON chain_event(event, block_number)"
+)
+# Named checkpoints: 'events' is the last indexed block, other names belong to consumers of chain_event
+CHAIN_CHECKPOINT_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS chain_checkpoint (
+        name TEXT PRIMARY KEY,
+        position INTEGER NOT NULL,
+        block_hash TEXT
+    )
+'''
+
+# Blocks a log must be buried under before it is indexed
+CONFIRMATIONS = int(os.getenv("CHAIN_CONFIRMATIONS", "6"))
+# Blocks per eth_getLogs call (halved when the node rejects a range)
+LOG_BLOCK_RANGE = int(os.getenv("CHAIN_LOG_BLOCK_RANGE", "2000"))
+# Blocks re-indexed when the checkpoint block was reorganized away
+REORG_REWIND = int(os.getenv("CHAIN_REORG_REWIND", "64"))
+
+
+def init_chain_index(cursor):
+    cursor.execute(CHAIN_EVENT_SCHEMA)
+    for index in CHAIN_EVENT_INDEXES:
+        cursor.execute(index)
+    cursor.execute(CHAIN_CHECKPOINT_SCHEMA)
+
+
+def get_checkpoint(cursor, name):
+    """(position, block_hash) of a checkpoint, or None"""
+    cursor.execute("SELECT position, block_hash FROM chain_checkpoint WHERE name=?", (name,))
+    return cursor.fetchone()
+
+
+def set_checkpoint(cursor, name, position, block_hash=None):
+    cursor.execute('''
+        INSERT INTO chain_checkpoint (name, position, block_hash) VALUES (?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET position=excluded.position, block_hash=excluded.block_hash
+    ''', (name, position, block_hash))
+
+
+def event_topics(contract):
+    """topic0 -> event name for the indexed events"""
+    from web3 import Web3
+    topics = {}
+    for entry in contract.abi:
+        if entry.get('type') == 'event' and entry['name'] in INDEXED_EVENTS:
+            signature = f"{entry['name']}({','.join(arg['type'] for arg in entry['inputs'])})"
+            topics[_topic_key(Web3.keccak(text=signature))] = entry['name']
+    return topics
+
+
+def _hex(value):
+    return value if isinstance(value, str) else '0x' + bytes(value).hex()
+
+
+def _topic_key(topic):
+    # HexBytes.hex() has a 0x prefix in some versions and not in others
+    text = _hex(topic)
+    return text if text.startswith('0x') else '0x' + text
+
+
+def get_logs(web3, contract, topics, from_block, to_block):
+    """eth_getLogs for [from_block, to_block], splitting the range if the node rejects it"""
+    try:
+        return web3.eth.get_logs({
+            'address': contract.address,
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            'topics': [list(topics)]
+        })
+    except Exception:
+        if from_block >= to_block:
+            raise
+        middle = (from_block + to_block) // 2
+        return get_logs(web3, contract, topics, from_block, middle) + get_logs(web3, contract, topics, middle + 1, to_block)
+
+
+def check_reorg(cursor, web3):
+    """
+    Rewind the checkpoint if its block is no longer on the canonical chain.
+    Returns the block the checkpoint was rewound to, or None.
+    """
+    checkpoint = get_checkpoint(cursor, 'events')
+    if not checkpoint:
+        return None
+    position, block_hash = checkpoint
+    if _hex(web3.eth.get_block(position)['hash']) == block_hash:
+        return None
+    rewound = max(position - REORG_REWIND, 0)
+    cursor.execute("DELETE FROM chain_event WHERE block_number > ?", (rewound,))
+    set_checkpoint(cursor, 'events', rewound, _hex(web3.eth.get_block(rewound)['hash']))
+    print(f"Chain reorganized below block {position}; re-indexing from block {rewound + 1}")
+    return rewound
+
+
+def index_events(cursor, web3, contract, start_block=0, confirmations=CONFIRMATIONS, block_range=LOG_BLOCK_RANGE):
+    """
+    Index logs from the block after the checkpoint (or start_block) up to
+    the latest block with enough confirmations, committing nothing itself.
+    Returns (events indexed, block the index now reaches, rewound block or None).
+    """
+    rewound = check_reorg(cursor, web3)
+    checkpoint = get_checkpoint(cursor, 'events')
+    from_block = checkpoint[0] + 1 if checkpoint else start_block
+    to_block = web3.eth.block_number - confirmations
+    if to_block < from_block:
+        return 0, from_block - 1, rewound
+
+    topics = event_topics(contract)
+    events = {name: getattr(contract.events, name)() for name in topics.values()}
+    timestamps = {}
+    indexed = 0
+    for start in range(from_block, to_block + 1, block_range):
+        end = min(start + block_range - 1, to_block)
+        rows = []
+        for log in get_logs(web3, contract, topics, start, end):
+            name = topics.get(_topic_key(log['topics'][0]))
+            if name is None:
+                continue
+            decoded = events[name].process_log(log)
+            block_number = log['blockNumber']
+            if block_number not in timestamps:
+                timestamps[block_number] = web3.eth.get_block(block_number)['timestamp']
+            args = {key: (_hex(value) if isinstance(value, bytes) else value) for key, value in decoded['args'].items()}
+            rows.append((name, block_number, _hex(log['blockHash']), timestamps[block_number],
+                         _hex(log['transactionHash']), log['logIndex'], json.dumps(args)))
+        cursor.executemany('''
+            INSERT INTO chain_event (event, block_number, block_hash, block_timestamp, tx_hash, log_index, args)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(tx_hash, log_index) DO UPDATE SET
+                event=excluded.event, block_number=excluded.block_number, block_hash=excluded.block_hash,
+                block_timestamp=excluded.block_timestamp, args=excluded.args
+        ''', rows)
+        indexed += len(rows)
+        set_checkpoint(cursor, 'events', end, _hex(web3.eth.get_block(end)['hash']))
+    return indexed, to_block, rewound
+
+
+def new_events(cursor, consumer, events=INDEXED_EVENTS):
+    """
+    Indexed events a consumer has not seen yet, in chain order, as
+    (id, event, block_number, block_timestamp, args) rows. Advance the
+    consumer with set_checkpoint(cursor, consumer, last id).
+    """
+    checkpoint = get_checkpoint(cursor, consumer)
+    cursor.execute(f'''
+        SELECT id, event, block_number, block_timestamp, args FROM chain_event
+        WHERE id > ? AND event IN ({','.join('?' * len(events))})
+        ORDER BY block_number, log_index
+    ''', (checkpoint[0] if checkpoint else 0, *events))
+    return [(row[0], row[1], row[2], row[3], json.loads(row[4])) for row in cursor.fetchall()]
@@ -0,0 +1,313 @@
+"""
+Chain outbox
+Contract writes queued in SQLite instead of sent inline. Each entry has an
+idempotency key, so queueing the same hospital, record or match twice is a
+no-op. A dispatcher sends pending entries in batches, a receipt tracker
+records the tx hash, block number and gas used once they are mined, and
+failed sends are retried with exponential backoff. Records and matches
+go out in addRecords/addMatches batches, so entries sent together share a
+tx hash and its gas_used.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import blockchain_service
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+CONFIRMED = 'confirmed'
+FAILED = 'failed'
+
+OUTBOX_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS chain_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        idempotency_key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt_at TEXT,
+        tx_hash TEXT,
+        sent_at TEXT,
+        block_number INTEGER,
+        gas_used INTEGER,
+        last_error TEXT,
+        created_at TEXT,
+        confirmed_at TEXT
+    )
+'''
+OUTBOX_INDEX = "CREATE INDEX IF NOT EXISTS idx_chain_outbox_status ON chain_outbox(status, next_attempt_at)"
+
+# Entries sent per dispatch, and seconds between dispatcher passes
+BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+
+# Retry backoff: RETRY_BASE_SECONDS * 2^(attempts-1), capped; given up after MAX_ATTEMPTS
+RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "600"))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+
+# A sent transaction with no receipt after this long is sent again
+RECEIPT_TIMEOUT = float(os.getenv("OUTBOX_RECEIPT_TIMEOUT", "300"))
+
+
+def init_outbox(cursor):
+    cursor.execute(OUTBOX_SCHEMA)
+    cursor.execute(OUTBOX_INDEX)
+
+
+def payload_key(kind, payload):
+    """Default idempotency key: the kind and a hash of the payload"""
+    encoded = json.dumps(payload, sort_keys=True)
+    return f"{kind}:{hashlib.sha256(encoded.encode('utf-8')).hexdigest()}"
+
+
+def enqueue(cursor, kind, payload, key=None):
+    """
+    Queue a contract write ('match' dict, 'record' or 'hospital' argument
+    list). Returns True if it was queued, False if the key was already there.
+    """
+    now = datetime.datetime.now().isoformat()
+    cursor.execute('''
+        INSERT OR IGNORE INTO chain_outbox (idempotency_key, kind, payload, next_attempt_at, created_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (key or payload_key(kind, payload), kind, json.dumps(payload), now, now))
+    return cursor.rowcount == 1
+
+
+def enqueue_many(cursor, kind, entries):
+    """Queue (key, payload) pairs of one kind. Returns how many were new."""
+    return sum(enqueue(cursor, kind, payload, key) for key, payload in entries)
+
+
+def retry_delay(attempts):
+    return min(RETRY_BASE_SECONDS * 2 ** max(attempts - 1, 0), RETRY_MAX_SECONDS)
+
+
+def outbox_counts(cursor):
+    """Entries per status"""
+    cursor.execute("SELECT status, COUNT(*) FROM chain_outbox GROUP BY status")
+    return dict(cursor.fetchall())
+
+
+class OutboxDispatcher:
+    """
+    Sends pending chain_outbox entries in batches and tracks their receipts.
+    Entries are claimed (pending -> sending) under a write lock, so several
+    dispatchers never send the same entry.
+    """
+
+    def __init__(self, db, batch_size=BATCH_SIZE, poll_seconds=POLL_SECONDS, chain=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.chain = chain
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def connect(self):
+        return sqlite3.connect(self.db, timeout=30)
+
+    def service(self):
+        return self.chain or blockchain_service
+
+    def available(self):
+        chain = self.service()
+        return bool(chain.is_connected() and chain.contract and chain.FROM_ADDRESS)
+
+    def recover(self):
+        """
+        Entries left in 'sending' by a dispatcher that stopped mid-batch go
+        back to pending. Their transaction may have reached the node, so
+        they can be written twice; the ledger is append-only either way.
+        """
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute("UPDATE chain_outbox SET status=? WHERE status=?", (PENDING, SENDING))
+        conn.commit()
+        conn.close()
+        return c.rowcount
+
+    def claim(self, c, now):
+        c.execute("BEGIN IMMEDIATE")
+        c.execute('''
+            SELECT id, kind, payload, attempts FROM chain_outbox
+            WHERE status=? AND next_attempt_at <= ?
+            ORDER BY id LIMIT ?
+        ''', (PENDING, now, self.batch_size))
+        rows = c.fetchall()
+        c.executemany("UPDATE chain_outbox SET status=? WHERE id=?", [(SENDING, row[0]) for row in rows])
+        c.execute("COMMIT")
+        return rows
+
+    def fail(self, c, entry_id, attempts, error):
+        """Schedule a retry with backoff, or give up after MAX_ATTEMPTS"""
+        if attempts >= MAX_ATTEMPTS:
+            c.execute("UPDATE chain_outbox SET status=?, attempts=?, last_error=? WHERE id=?",
+                      (FAILED, attempts, error, entry_id))
+            return
+        retry_at = datetime.datetime.now() + datetime.timedelta(seconds=retry_delay(attempts))
+        c.execute('''
+            UPDATE chain_outbox SET status=?, attempts=?, next_attempt_at=?, tx_hash=NULL, last_error=?
+            WHERE id=?
+        ''', (PENDING, attempts, retry_at.isoformat(), error, entry_id))
+
+    def dispatch(self):
+        """
+        Send one batch of due entries back-to-back, records and matches
+        packed into gas-budgeted addRecords/addMatches transactions.
+        Returns how many entries were sent.
+        """
+        if not self.available():
+            return 0
+        chain = self.service()
+        conn = self.connect()
+        c = conn.cursor()
+        rows = self.claim(c, datetime.datetime.now().isoformat())
+        by_kind = {}
+        for row in rows:
+            by_kind.setdefault(row[1], []).append(row)
+        sent = 0
+        for kind, entries in by_kind.items():
+            try:
+                batches = chain.batch_calls(kind, [json.loads(payload) for _, _, payload, _ in entries])
+            except Exception as e:
+                batches = []
+                for entry_id, _, _, attempts in entries:
+                    self.fail(c, entry_id, attempts + 1, str(e))
+            for function_call, gas, indexes in batches:
+                batch = [entries[i] for i in indexes]
+                try:
+                    tx_hash = chain.send_contract_call(function_call, gas)
+                except Exception as e:
+                    for entry_id, _, _, attempts in batch:
+                        self.fail(c, entry_id, attempts + 1, str(e))
+                else:
+                    now = datetime.datetime.now().isoformat()
+                    c.executemany("UPDATE chain_outbox SET status=?, attempts=?, tx_hash=?, sent_at=? WHERE id=?",
+                                  [(SENT, attempts + 1, '0x' + bytes(tx_hash).hex(), now, entry_id)
+                                   for entry_id, _, _, attempts in batch])
+                    sent += len(batch)
+                conn.commit()
+        conn.commit()
+        conn.close()
+        return sent
+
+    def track(self):
+        """Record receipts of sent entries. Returns how many were confirmed."""
+        conn = self.connect()
+        c = conn.cursor()
+        c.execute("SELECT id, tx_hash, attempts, sent_at FROM chain_outbox WHERE status=? ORDER BY id", (SENT,))
+        rows = c.fetchall()
+        if not rows:
+            conn.close()
+            return 0
+        chain = self.service()
+        # Entries sent in one batch share a transaction
+        tx_hashes = list(dict.fromkeys(tx_hash for _, tx_hash, _, _ in rows))
+        found = dict(zip(tx_hashes, chain.get_receipts(tx_hashes)))
+        receipts = [found[tx_hash] for _, tx_hash, _, _ in rows]
+        now = datetime.datetime.now()
+        confirmed = 0
+        stale = False
+        for (entry_id, tx_hash, attempts, sent_at), receipt in zip(rows, receipts):
+            if receipt is None:
+                if (now - datetime.datetime.fromisoformat(sent_at)).total_seconds() > RECEIPT_TIMEOUT:
+                    self.fail(c, entry_id, attempts, f"No receipt for {tx_hash} after {RECEIPT_TIMEOUT:.0f}s")
+                    stale = True
+            elif receipt['status'] == 1:
+                c.execute('''
+                    UPDATE chain_outbox SET status=?, block_number=?, gas_used=?, confirmed_at=?, last_error=NULL
+                    WHERE id=?
+                ''', (CONFIRMED, receipt['blockNumber'], receipt['gasUsed'], now.isoformat(), entry_id))
+                confirmed += 1
+            else:
+                # A reverted call reverts again, so it is not retried
+                c.execute("UPDATE chain_outbox SET status=?, block_number=?, gas_used=?, last_error=? WHERE id=?",
+                          (FAILED, receipt['blockNumber'], receipt['gasUsed'], "Transaction reverted", entry_id))
+        conn.commit()
+        conn.close()
+        if stale and chain.nonces:
+            # A dropped transaction leaves a nonce gap; resync from the node
+            chain.nonces.reset()
+        return confirmed
+
+    def counts(self):
+        conn = self.connect()
+        counts = outbox_counts(conn.cursor())
+        conn.close()
+        return counts
+
+    def run_once(self):
+        sent = self.dispatch()
+        confirmed = self.track()
+        return sent, confirmed
+
+    def drain(self, timeout=None):
+        """
+        Dispatch and track until nothing is pending or sent, the node is
+        unreachable or timeout passes. Entries left over stay queued for the
+        next run. Returns the final counts per status.
+        """
+        deadline = time.time() + timeout if timeout else None
+        while self.available():
+            self.run_once()
+            counts = self.counts()
+            if not counts.get(PENDING) and not counts.get(SENT):
+                break
+            if deadline and time.time() >= deadline:
+                break
+            time.sleep(self.poll_seconds)
+        return self.counts()
+
+    def run(self):
+        while not self.stopped.wait(self.poll_seconds):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error dispatching chain outbox: {e}")
+
+    def start(self):
+        """Recover interrupted sends and dispatch in a daemon thread"""
+        if self.thread is None:
+            self.recover()
+            self.thread = threading.Thread(target=self.run, name="chain-outbox", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    sys.path.append(os.path.dirname(__file__))
+    parser = argparse.ArgumentParser(description="Send queued contract writes and track their receipts")
+    parser.add_argument('--db', default=os.path.join(os.path.dirname(__file__), "database.db"))
+    parser.add_argument('--once', action='store_true', help="Drain the outbox and exit instead of running forever")
+    args = parser.parse_args()
+
+    dispatcher = OutboxDispatcher(args.db)
+    conn = dispatcher.connect()
+    init_outbox(conn.cursor())
+    conn.commit()
+    conn.close()
+    if args.once:
+        dispatcher.recover()
+        print(dispatcher.drain())
+    else:
+        dispatcher.start()
+        try:
+            while dispatcher.thread.is_alive():
+                dispatcher.thread.join(1)
+        except KeyboardInterrupt:
+            dispatcher.stop()
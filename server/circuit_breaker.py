@@ -0,0 +1,69 @@
+"""
+Circuit breaker
+Stops calling a dependency that keeps failing. After failure_threshold
+consecutive failures the breaker opens and callers fail fast; once
+reset_timeout has passed it lets a single probe through (half-open), and
+closes again if that probe succeeds.
+"""
+
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=15.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        """
+        Whether a call may go ahead. While open, only the first caller after
+        reset_timeout gets through, as the half-open probe; it must report
+        back with record_success() or record_failure().
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                self.probing = False
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            if self.state != CLOSED:
+                print(f"{self.name} recovered; circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state == CLOSED:
+                    print(f"{self.name} unavailable; failing fast for {self.reset_timeout:.0f}s")
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    def is_open(self):
+        with self.lock:
+            return self.state != CLOSED
@@ -0,0 +1,38 @@
+"""
+Database watch
+Cheap detection of commits made by other connections, so in-memory caches
+only re-check the database after something was written.
+"""
+
+import sqlite3
+import threading
+
+
+class CommitWatch:
+    """
+    PRAGMA data_version on one long-lived connection that never writes.
+    The value changes whenever another connection commits to the database.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.conn = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    def changed(self):
+        """True on the first call and whenever anyone committed since the previous call"""
+        with self.lock:
+            if self.conn is None:
+                self.conn = sqlite3.connect(self.db, check_same_thread=False)
+            version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            changed = version != self.version
+            self.version = version
+            return changed
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+                self.version = None
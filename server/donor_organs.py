@@ -0,0 +1,87 @@
+"""
+Donor organs
+A donor registers once and offers one or more organs. Each organ has its
+own row in donor_organ with its own status and viability deadline, and is
+matched, offered, declined and expired on its own. donor.organ keeps the
+first organ registered and donor.status a summary of the organs, for the
+views and tools that still read the donor row.
+"""
+
+DONOR_ORGAN_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS donor_organ (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        donor_id INTEGER NOT NULL,
+        organ TEXT NOT NULL,
+        status TEXT DEFAULT 'Not Matched',
+        viability_deadline TEXT,
+        UNIQUE (donor_id, organ)
+    )
+'''
+
+
+def backfill_donor_organs(cursor):
+    """One donor_organ row per donor registered before (or without) the table"""
+    cursor.execute('''
+        INSERT INTO donor_organ (donor_id, organ, status, viability_deadline)
+        SELECT d.id, d.organ, COALESCE(d.status, 'Not Matched'), d.viability_deadline
+        FROM donor d
+        WHERE d.organ IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM donor_organ o WHERE o.donor_id = d.id)
+    ''')
+    return cursor.rowcount
+
+
+def add_donor_organs(cursor, donor_id, organs):
+    """Register (organ, viability_deadline) pairs for a new donor"""
+    cursor.executemany("INSERT OR IGNORE INTO donor_organ (donor_id, organ, viability_deadline) VALUES (?, ?, ?)",
+                       [(donor_id, organ, deadline) for organ, deadline in organs])
+
+
+def set_organ_status(cursor, keys, status, only_if=None):
+    """
+    Set the status of (donor_id, organ) keys and re-summarize their donors.
+    With only_if, only organs currently in that status change.
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    if only_if is None:
+        cursor.executemany("UPDATE donor_organ SET status=? WHERE donor_id=? AND organ=?",
+                           [(status, donor_id, organ) for donor_id, organ in keys])
+    else:
+        cursor.executemany("UPDATE donor_organ SET status=? WHERE donor_id=? AND organ=? AND status=?",
+                           [(status, donor_id, organ, only_if) for donor_id, organ in keys])
+    sync_donor_status(cursor, {donor_id for donor_id, _ in keys})
+
+
+def sync_donor_status(cursor, donor_ids=None):
+    """
+    donor.status from its organs: Not Matched while any organ is waiting,
+    then Matched if any organ was allocated, otherwise Expired.
+    Donors without organ rows keep their status.
+    """
+    summary = '''
+        UPDATE donor SET status = CASE
+            WHEN EXISTS (SELECT 1 FROM donor_organ o WHERE o.donor_id = donor.id AND o.status = 'Not Matched') THEN 'Not Matched'
+            WHEN EXISTS (SELECT 1 FROM donor_organ o WHERE o.donor_id = donor.id AND o.status = 'Matched') THEN 'Matched'
+            ELSE 'Expired' END
+        WHERE EXISTS (SELECT 1 FROM donor_organ o WHERE o.donor_id = donor.id)
+    '''
+    if donor_ids is None:
+        cursor.execute(summary)
+    else:
+        cursor.executemany(summary + " AND id=?", [(donor_id,) for donor_id in donor_ids])
+
+
+def load_donor_organs(cursor, hospital_id=None):
+    """Map donor id -> [(organ, status)] in registration order, for all donors or one hospital's"""
+    cursor.execute('''
+        SELECT o.donor_id, o.organ, o.status
+        FROM donor_organ o JOIN donor d ON d.id = o.donor_id
+        WHERE ? IS NULL OR d.hospital_id = ?
+        ORDER BY o.donor_id, o.id
+    ''', (hospital_id, hospital_id))
+    organs = {}
+    for donor_id, organ, status in cursor.fetchall():
+        organs.setdefault(donor_id, []).append((organ, status))
+    return organs
@@ -0,0 +1,560 @@
+"""
+Fake chain
+A pure-Python stand-in for Ganache running OrganChain, so the sync scripts
+and the chain outbox can be load-tested without a node. FakeNode is a web3
+provider that answers the JSON-RPC methods this service uses from
+OrganChainModel, a Python copy of the contract's storage, functions and
+events, ABI-encoded from the contract JSON so web3 decodes them as usual.
+Every transaction is mined into a block of its own as it arrives (like
+Ganache's automine), and every request or JSON-RPC batch sleeps `latency`
+seconds to stand in for the round-trip. Hashes, addresses and timestamps
+come from counters, so runs are repeatable.
+"""
+
+import threading
+import time
+
+import rlp
+from eth_abi import decode, encode
+from eth_account import Account
+from eth_utils import keccak, to_checksum_address
+from web3.providers.base import BaseProvider
+
+CHAIN_ID = 1337
+ACCOUNT_COUNT = 10
+GENESIS_TIMESTAMP = 1700000000
+# Seconds between consecutive blocks' timestamps
+BLOCK_INTERVAL = 1
+BLOCK_GAS_LIMIT = 6721975
+GAS_PRICE = 20 * 10 ** 9
+
+# Gas model: intrinsic cost, calldata bytes, storage slots written and log topics/data
+TX_GAS = 21000
+ZERO_BYTE_GAS = 4
+BYTE_GAS = 16
+SLOT_GAS = 22100
+LOG_GAS = 375
+LOG_DATA_GAS = 8
+
+ZERO_HASH = '0x' + '00' * 32
+ZERO_ADDRESS = '0x' + '00' * 20
+EMPTY_BLOOM = '0x' + '00' * 256
+
+
+class Revert(Exception):
+    """A require() failed: the call or transaction reverts with this reason"""
+
+
+class RPCError(Exception):
+    """A request the node rejects, answered as a JSON-RPC error"""
+
+
+def abi_type(param):
+    """Canonical ABI type of an input or output, tuples spelled out"""
+    if param['type'].startswith('tuple'):
+        return '(' + ','.join(abi_type(component) for component in param['components']) + ')' + param['type'][5:]
+    return param['type']
+
+
+def signature(entry):
+    return f"{entry['name']}({','.join(abi_type(param) for param in entry['inputs'])})"
+
+
+def slots(value):
+    """Storage slots a value takes: one per number, a string's bytes past 31 get slots of their own"""
+    if isinstance(value, (tuple, list)):
+        return sum(slots(item) for item in value)
+    if isinstance(value, str):
+        size = len(value.encode('utf-8'))
+        return 1 if size < 32 else 1 + (size + 31) // 32
+    return 1
+
+
+def calldata_gas(data):
+    return sum(BYTE_GAS if byte else ZERO_BYTE_GAS for byte in data)
+
+
+class Execution:
+    """The sender and block timestamp of one contract call, and the storage writes and events it makes"""
+
+    def __init__(self, model, sender, timestamp):
+        self.sender = sender
+        self.timestamp = timestamp
+        self.writes = []
+        self.events = []
+        self.lengths = {'matches': len(model._matches), 'records': len(model._records)}
+
+    def write(self, table, key, value):
+        self.writes.append((table, key, value))
+
+    def push(self, table, value):
+        """Append to the matches or records array; returns the new entry's index"""
+        index = self.lengths[table]
+        self.lengths[table] += 1
+        self.writes.append((table, index, value))
+        return index
+
+    def emit(self, event, *args):
+        self.events.append((event, args))
+
+
+class OrganChainModel:
+    """
+    OrganChain's storage and functions. Methods are named after the
+    contract's functions and take the Execution first; writes and events go
+    to the Execution and only reach storage through apply(), so a reverted
+    or out-of-gas transaction leaves nothing behind.
+    """
+
+    def __init__(self, owner):
+        self._owner = owner
+        self._hospitals = {}
+        self._admins = {owner: True}
+        self._matches = []
+        self._records = []
+
+    def apply(self, execution):
+        for table, key, value in execution.writes:
+            if table in ('matches', 'records'):
+                getattr(self, '_' + table).append(value)
+            elif value is None:
+                getattr(self, '_' + table).pop(key, None)
+            else:
+                getattr(self, '_' + table)[key] = value
+
+    def _require(self, condition, reason):
+        if not condition:
+            raise Revert(reason)
+
+    # Public state variable getters
+    def hospitals(self, ex, address):
+        return self._hospitals.get(address, ('', '', '', False))
+
+    def authorizedAdmins(self, ex, address):
+        return self._admins.get(address, False)
+
+    def matches(self, ex, index):
+        self._require(index < len(self._matches), "index out of bounds")
+        return self._matches[index]
+
+    def records(self, ex, index):
+        self._require(index < len(self._records), "index out of bounds")
+        return self._records[index]
+
+    def owner(self, ex):
+        return self._owner
+
+    # Admins
+    def addAdmin(self, ex, admin):
+        self._require(ex.sender == self._owner, "Only owner can perform this action")
+        ex.write('admins', admin, True)
+        ex.emit('AdminAdded', admin)
+
+    def removeAdmin(self, ex, admin):
+        self._require(ex.sender == self._owner, "Only owner can perform this action")
+        ex.write('admins', admin, False)
+        ex.emit('AdminRemoved', admin)
+
+    def isAdmin(self, ex, address):
+        return self._admins.get(address, False) or address == self._owner
+
+    # Hospitals
+    def addHospital(self, ex, name, email, location):
+        ex.write('hospitals', ex.sender, (name, email, location, True))
+        ex.emit('HospitalAdded', ex.sender, name, email, location)
+
+    def removeHospital(self, ex):
+        hospital = self.hospitals(ex, ex.sender)
+        self._require(hospital[3], "Only registered hospitals can perform this action")
+        ex.write('hospitals', ex.sender, None)
+        ex.emit('HospitalRemoved', ex.sender, hospital[0])
+
+    def getHospital(self, ex, address):
+        return self.hospitals(ex, address)
+
+    def isHospitalRegistered(self, ex, address):
+        return self.hospitals(ex, address)[3]
+
+    # Matches
+    def addMatch(self, ex, donorName, donorAge, donorHospital, encryptedOrgan, encryptedBloodType,
+                 patientName, patientAge, patientHospital, date):
+        match = (donorName, donorAge, donorHospital, encryptedOrgan, encryptedBloodType,
+                 patientName, patientAge, patientHospital, date)
+        match_id = ex.push('matches', match)
+        details = (f"Organ match created: Donor {donorName} ({donorAge} years) from {donorHospital}"
+                   f" matched with Patient {patientName} ({patientAge} years) from {patientHospital}"
+                   f" for [Encrypted Organ] transplant on {date}")
+        ex.emit('MatchAdded', match_id, *match, details)
+
+    def addMatches(self, ex, new_matches):
+        for match in new_matches:
+            self.addMatch(ex, *match)
+
+    def getAllMatches(self, ex):
+        return list(self._matches)
+
+    def getMatchesCount(self, ex):
+        return len(self._matches)
+
+    def getMatches(self, ex, offset, limit):
+        return self._matches[offset:offset + limit]
+
+    # Records
+    def addRecord(self, ex, donorId, organType, hospital, receiverId):
+        ex.push('records', (donorId, organType, hospital, receiverId, ex.timestamp))
+        ex.emit('OrganRegistered', donorId, organType, hospital, receiverId)
+
+    def addRecords(self, ex, donorIds, organTypes, hospitalNames, receiverIds):
+        self._require(len(organTypes) == len(donorIds) and len(hospitalNames) == len(donorIds)
+                      and len(receiverIds) == len(donorIds), "Record arrays must have the same length")
+        for record in zip(donorIds, organTypes, hospitalNames, receiverIds):
+            self.addRecord(ex, *record)
+
+    def getAllRecords(self, ex):
+        return list(self._records)
+
+    def getRecordsCount(self, ex):
+        return len(self._records)
+
+    def getRecords(self, ex, offset, limit):
+        return self._records[offset:offset + limit]
+
+
+class FakeNode(BaseProvider):
+    """
+    A web3 provider holding a whole chain in memory: unlocked accounts,
+    OrganChain deployed at genesis, blocks, transactions, receipts and logs.
+    Set `online` to False to have every request fail as if the node were
+    down; `round_trips` counts requests and batches answered.
+    """
+
+    def __init__(self, abi, latency=0.0, chain_id=CHAIN_ID, account_count=ACCOUNT_COUNT):
+        self.latency = latency
+        self.chain_id = chain_id
+        self.online = True
+        self.round_trips = 0
+        self.lock = threading.RLock()
+        self.accounts = [to_checksum_address(keccak(text=f"fake account {i}")[-20:]) for i in range(account_count)]
+        # Where the first account's first contract creation would land
+        self.contract_address = to_checksum_address(keccak(rlp.encode([bytes.fromhex(self.accounts[0][2:]), 0]))[-20:])
+        self.model = OrganChainModel(self.accounts[0])
+        self.functions = {}
+        self.events = {}
+        for entry in abi:
+            if entry.get('type') == 'function':
+                self.functions[keccak(text=signature(entry))[:4]] = entry
+            elif entry.get('type') == 'event':
+                self.events[entry['name']] = (keccak(text=signature(entry)), entry)
+        self.nonces = {}
+        self.blocks = []
+        self.block_logs = []
+        self.block_numbers = {}
+        self.transactions = {}
+        self.mine()
+
+    # Provider interface
+    def make_request(self, method, params):
+        self.round_trip()
+        return self.respond(method, params)
+
+    def is_connected(self):
+        self.round_trip()
+        return self.online
+
+    def round_trip(self):
+        with self.lock:
+            self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def batch(self, calls):
+        """Answer (method, params) pairs as one JSON-RPC batch: one round-trip of latency for all"""
+        self.round_trip()
+        return [self.respond(method, params, request_id) for request_id, (method, params) in enumerate(calls)]
+
+    def respond(self, method, params, request_id=0):
+        if not self.online:
+            raise ConnectionError("Fake chain node is offline")
+        handler = getattr(self, 'rpc_' + method, None)
+        if handler is None:
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32601, 'message': f"Method {method} not supported"}}
+        try:
+            with self.lock:
+                result = handler(*params)
+        except RPCError as e:
+            return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': -32000, 'message': str(e)}}
+        return {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+
+    # Chain state
+    def head(self):
+        return len(self.blocks) - 1
+
+    def block_number(self, block_id):
+        if block_id in ('latest', 'pending', 'safe', 'finalized', None):
+            return self.head()
+        if block_id == 'earliest':
+            return 0
+        return int(block_id, 16) if isinstance(block_id, str) else block_id
+
+    def mine(self, tx_hash=None, gas_used=0, logs=()):
+        number = len(self.blocks)
+        parent_hash = self.blocks[-1]['hash'] if self.blocks else ZERO_HASH
+        block_hash = '0x' + keccak(text=f"{parent_hash}:{number}").hex()
+        self.blocks.append({
+            'number': hex(number),
+            'hash': block_hash,
+            'parentHash': parent_hash,
+            'nonce': '0x0000000000000000',
+            'sha3Uncles': ZERO_HASH,
+            'logsBloom': EMPTY_BLOOM,
+            'transactionsRoot': ZERO_HASH,
+            'stateRoot': ZERO_HASH,
+            'receiptsRoot': ZERO_HASH,
+            'miner': ZERO_ADDRESS,
+            'difficulty': '0x0',
+            'totalDifficulty': '0x0',
+            'extraData': '0x',
+            'size': '0x3e8',
+            'gasLimit': hex(BLOCK_GAS_LIMIT),
+            'gasUsed': hex(gas_used),
+            'timestamp': hex(GENESIS_TIMESTAMP + number * BLOCK_INTERVAL),
+            'transactions': [tx_hash] if tx_hash else [],
+            'uncles': []
+        })
+        self.block_numbers[block_hash] = number
+        self.block_logs.append([dict(log, blockNumber=hex(number), blockHash=block_hash) for log in logs])
+        return number, block_hash
+
+    def call_contract(self, sender, data, timestamp):
+        """Run a contract function. Returns (Execution, ABI entry, return value); raises Revert."""
+        entry = self.functions.get(bytes(data[:4]))
+        if entry is None:
+            raise Revert("function selector was not recognized")
+        try:
+            args = decode([abi_type(param) for param in entry['inputs']], bytes(data[4:]))
+        except Exception:
+            raise Revert("calldata could not be decoded")
+        args = [to_checksum_address(arg) if param['type'] == 'address' else arg for param, arg in zip(entry['inputs'], args)]
+        execution = Execution(self.model, sender, timestamp)
+        return execution, entry, getattr(self.model, entry['name'])(execution, *args)
+
+    def encode_log(self, event, args, tx_hash, log_index):
+        topic, entry = self.events[event]
+        topics = ['0x' + topic.hex()]
+        types, values = [], []
+        for param, value in zip(entry['inputs'], args):
+            if param.get('indexed'):
+                # OrganChain only indexes addresses and numbers, which are their own topics
+                topics.append('0x' + encode([param['type']], [value]).hex())
+            else:
+                types.append(abi_type(param))
+                values.append(value)
+        return {
+            'address': self.contract_address,
+            'topics': topics,
+            'data': '0x' + encode(types, values).hex(),
+            'transactionHash': tx_hash,
+            'transactionIndex': '0x0',
+            'logIndex': hex(log_index),
+            'removed': False
+        }
+
+    def execute(self, sender, to, data, gas, tx_hash=ZERO_HASH, commit=True):
+        """
+        Run a transaction against the contract. Returns (status, gas used,
+        logs); storage changes only when the transaction succeeds and commit
+        is set.
+        """
+        gas_used = TX_GAS + calldata_gas(data)
+        if not to or to.lower() != self.contract_address.lower():
+            return 1, gas_used, []
+        try:
+            timestamp = GENESIS_TIMESTAMP + len(self.blocks) * BLOCK_INTERVAL
+            execution, _, _ = self.call_contract(sender, data, timestamp)
+        except Revert:
+            return 0, min(gas_used, gas), []
+        logs = [self.encode_log(event, args, tx_hash, i) for i, (event, args) in enumerate(execution.events)]
+        gas_used += SLOT_GAS * sum(slots(value) for _, _, value in execution.writes if value is not None)
+        gas_used += sum(LOG_GAS * len(log['topics']) + LOG_GAS + LOG_DATA_GAS * (len(log['data']) - 2) // 2 for log in logs)
+        if gas_used > gas:
+            # Out of gas
+            return 0, gas, []
+        if commit:
+            self.model.apply(execution)
+        return 1, gas_used, logs
+
+    def send(self, sender, to, data, gas, gas_price, value, nonce, chain_id, tx_hash):
+        """Mine one transaction into a block of its own; returns its hash"""
+        expected = self.nonces.get(sender, 0)
+        if nonce is not None and nonce != expected:
+            raise RPCError(f"the tx doesn't have the correct nonce. account has nonce of: {expected} tx has nonce of: {nonce}")
+        if chain_id is not None and chain_id != self.chain_id:
+            raise RPCError(f"invalid chain id {chain_id}, expected {self.chain_id}")
+        if gas > BLOCK_GAS_LIMIT:
+            raise RPCError("exceeds block gas limit")
+        if gas < TX_GAS + calldata_gas(data):
+            raise RPCError("intrinsic gas too low")
+        self.nonces[sender] = expected + 1
+        status, gas_used, logs = self.execute(sender, to, data, gas, tx_hash)
+        number, block_hash = self.mine(tx_hash, gas_used, logs)
+        mined = {'blockNumber': hex(number), 'blockHash': block_hash, 'transactionIndex': '0x0'}
+        transaction = dict(mined, **{
+            'hash': tx_hash,
+            'from': sender,
+            'to': to,
+            'nonce': hex(expected),
+            'gas': hex(gas),
+            'gasPrice': hex(gas_price),
+            'value': hex(value),
+            'input': '0x' + bytes(data).hex(),
+            'type': '0x0'
+        })
+        receipt = dict(mined, **{
+            'transactionHash': tx_hash,
+            'from': sender,
+            'to': to,
+            'gasUsed': hex(gas_used),
+            'cumulativeGasUsed': hex(gas_used),
+            'effectiveGasPrice': hex(gas_price),
+            'contractAddress': None,
+            'logs': self.block_logs[number],
+            'logsBloom': EMPTY_BLOOM,
+            'status': hex(status),
+            'type': '0x0'
+        })
+        self.transactions[tx_hash] = (transaction, receipt)
+        return tx_hash
+
+    # JSON-RPC methods
+    def rpc_web3_clientVersion(self):
+        return "FakeChain/OrganChain"
+
+    def rpc_net_version(self):
+        return str(self.chain_id)
+
+    def rpc_net_listening(self):
+        return True
+
+    def rpc_eth_chainId(self):
+        return hex(self.chain_id)
+
+    def rpc_eth_syncing(self):
+        return False
+
+    def rpc_eth_gasPrice(self):
+        return hex(GAS_PRICE)
+
+    def rpc_eth_accounts(self):
+        return list(self.accounts)
+
+    def rpc_eth_blockNumber(self):
+        return hex(self.head())
+
+    def rpc_eth_getBalance(self, address, block_id='latest'):
+        return hex(100 * 10 ** 18)
+
+    def rpc_eth_getCode(self, address, block_id='latest'):
+        return '0x6080604052' if address.lower() == self.contract_address.lower() else '0x'
+
+    def rpc_eth_getTransactionCount(self, address, block_id='latest'):
+        return hex(self.nonces.get(to_checksum_address(address), 0))
+
+    def rpc_eth_getBlockByNumber(self, block_id, full_transactions=False):
+        number = self.block_number(block_id)
+        if number > self.head():
+            return None
+        block = self.blocks[number]
+        if full_transactions:
+            block = dict(block, transactions=[self.transactions[tx_hash][0] for tx_hash in block['transactions']])
+        return block
+
+    def rpc_eth_getBlockByHash(self, block_hash, full_transactions=False):
+        number = self.block_numbers.get(block_hash.lower())
+        return None if number is None else self.rpc_eth_getBlockByNumber(number, full_transactions)
+
+    def rpc_eth_getTransactionByHash(self, tx_hash):
+        found = self.transactions.get(tx_hash.lower())
+        return found[0] if found else None
+
+    def rpc_eth_getTransactionReceipt(self, tx_hash):
+        found = self.transactions.get(tx_hash.lower())
+        return found[1] if found else None
+
+    def rpc_eth_call(self, transaction, block_id='latest'):
+        to = transaction.get('to')
+        if not to or to.lower() != self.contract_address.lower():
+            return '0x'
+        sender = to_checksum_address(transaction.get('from') or ZERO_ADDRESS)
+        data = bytes.fromhex(transaction.get('data', transaction.get('input', '0x'))[2:])
+        try:
+            _, entry, result = self.call_contract(sender, data, GENESIS_TIMESTAMP + len(self.blocks) * BLOCK_INTERVAL)
+        except Revert as e:
+            raise RPCError(f"execution reverted: {e}")
+        types = [abi_type(param) for param in entry['outputs']]
+        if not types:
+            return '0x'
+        return '0x' + encode(types, result if len(types) > 1 else (result,)).hex()
+
+    def rpc_eth_estimateGas(self, transaction, block_id='latest'):
+        sender = to_checksum_address(transaction.get('from') or self.accounts[0])
+        data = bytes.fromhex(transaction.get('data', transaction.get('input', '0x'))[2:])
+        status, gas_used, _ = self.execute(sender, transaction.get('to'), data, BLOCK_GAS_LIMIT, commit=False)
+        if not status:
+            raise RPCError("execution reverted")
+        return hex(gas_used)
+
+    def rpc_eth_sendTransaction(self, transaction):
+        sender = to_checksum_address(transaction['from'])
+        if sender not in self.accounts:
+            raise RPCError(f"sender account not recognized: {sender}")
+        nonce = int(transaction['nonce'], 16) if 'nonce' in transaction else None
+        data = bytes.fromhex(transaction.get('data', transaction.get('input', '0x'))[2:])
+        tx_hash = '0x' + keccak(text=f"{sender}:{self.nonces.get(sender, 0)}").hex()
+        return self.send(sender, transaction.get('to'), data,
+                         int(transaction.get('gas', hex(BLOCK_GAS_LIMIT)), 16),
+                         int(transaction.get('gasPrice', hex(GAS_PRICE)), 16),
+                         int(transaction.get('value', '0x0'), 16), nonce,
+                         int(transaction['chainId'], 16) if 'chainId' in transaction else None, tx_hash)
+
+    def rpc_eth_sendRawTransaction(self, raw_transaction):
+        raw = bytes.fromhex(raw_transaction[2:])
+        if not raw or raw[0] < 0xc0:
+            raise RPCError("the fake chain only accepts legacy (untyped) transactions")
+        nonce, gas_price, gas, to, value, data, v, _, _ = rlp.decode(raw)
+        v = int.from_bytes(v, 'big')
+        return self.send(to_checksum_address(Account.recover_transaction(raw)),
+                         to_checksum_address(to) if to else None, data,
+                         int.from_bytes(gas, 'big'), int.from_bytes(gas_price, 'big'), int.from_bytes(value, 'big'),
+                         int.from_bytes(nonce, 'big'), (v - 35) // 2 if v >= 35 else None,
+                         '0x' + keccak(raw).hex())
+
+    def rpc_eth_getLogs(self, log_filter):
+        addresses = log_filter.get('address') or []
+        addresses = {address.lower() for address in ([addresses] if isinstance(addresses, str) else addresses)}
+        if 'blockHash' in log_filter:
+            number = self.block_numbers.get(log_filter['blockHash'].lower())
+            numbers = [] if number is None else [number]
+        else:
+            numbers = range(self.block_number(log_filter.get('fromBlock', 'latest')),
+                            min(self.block_number(log_filter.get('toBlock', 'latest')), self.head()) + 1)
+        wanted = log_filter.get('topics') or []
+        logs = []
+        for number in numbers:
+            for log in self.block_logs[number]:
+                if addresses and log['address'].lower() not in addresses:
+                    continue
+                if all(topic_matches(want, log['topics'][i] if i < len(log['topics']) else None)
+                       for i, want in enumerate(wanted)):
+                    logs.append(log)
+        return logs
+
+
+def topic_matches(want, topic):
+    """eth_getLogs topic filter entry: None matches anything, a list matches any of its topics"""
+    if want is None:
+        return True
+    if topic is None:
+        return False
+    if isinstance(want, (list, tuple)):
+        return any(topic_matches(option, topic) for option in want)
+    return want.lower() == topic.lower()
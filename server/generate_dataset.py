@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Synthetic Dataset Generator
+Fills hospital, donor, donor_organ, patient and match_record with large, deterministic
+datasets for scale testing. The same --seed always produces the same rows.
+
+Example:
+    python generate_dataset.py --hospitals 500 --donors 1000000 --patients 1500000 --matches 200000 --clear --ledger
+"""
+
+import argparse
+import datetime
+import hashlib
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+import uuid
+
+# Add the current directory to the Python path
+sys.path.append(os.path.dirname(__file__))
+
+from blood_compatibility import BLOOD_TYPES, compatible_recipient_types, is_compatible
+from donor_organs import DONOR_ORGAN_SCHEMA, backfill_donor_organs
+from geo import geocode
+
+# Use the database file in the same directory as this script
+DB = os.path.join(os.path.dirname(__file__), "database.db")
+
+# ABO/Rh distribution of the general population
+BLOOD_TYPE_WEIGHTS = {
+    'O+': 37.4, 'A+': 35.7, 'B+': 8.5, 'AB+': 3.4,
+    'O-': 6.6, 'A-': 6.3, 'B-': 1.5, 'AB-': 0.6
+}
+
+# Organs offered by deceased donors vs organs patients are waiting for
+DONOR_ORGAN_WEIGHTS = {
+    'Kidney': 52, 'Liver': 22, 'Heart': 10, 'Lungs': 9, 'Pancreas': 5, 'Intestine': 2
+}
+PATIENT_ORGAN_WEIGHTS = {
+    'Kidney': 83, 'Liver': 10, 'Heart': 3, 'Lungs': 2, 'Pancreas': 1.5, 'Intestine': 0.5
+}
+
+CITIES = [
+    'New York, NY', 'Los Angeles, CA', 'Chicago, IL', 'Houston, TX', 'Phoenix, AZ',
+    'Philadelphia, PA', 'San Antonio, TX', 'San Diego, CA', 'Dallas, TX', 'San Jose, CA',
+    'Austin, TX', 'Jacksonville, FL', 'Columbus, OH', 'Charlotte, NC', 'Indianapolis, IN',
+    'Seattle, WA', 'Denver, CO', 'Boston, MA', 'Nashville, TN', 'Detroit, MI',
+    'Portland, OR', 'Las Vegas, NV', 'Baltimore, MD', 'Milwaukee, WI', 'Atlanta, GA',
+    'Miami, FL', 'Minneapolis, MN', 'Cleveland, OH', 'Pittsburgh, PA', 'St. Louis, MO'
+]
+# Common serological HLA antigens at the A, B and DR loci
+HLA_ANTIGENS = {
+    'A': ['A1', 'A2', 'A3', 'A11', 'A23', 'A24', 'A26', 'A29', 'A30', 'A31', 'A32', 'A33', 'A68'],
+    'B': ['B7', 'B8', 'B13', 'B18', 'B27', 'B35', 'B38', 'B44', 'B49', 'B51', 'B57', 'B60', 'B62'],
+    'DR': ['DR1', 'DR4', 'DR7', 'DR8', 'DR9', 'DR10', 'DR11', 'DR12', 'DR13', 'DR14', 'DR15', 'DR16', 'DR17']
+}
+# Share of typed patients who are sensitized and list unacceptable antigens
+SENSITIZED_SHARE = 0.2
+# Share of waiting patients at each medical urgency level (0 = routine, 3 = critical)
+URGENCY_WEIGHTS = {0: 70, 1: 20, 2: 8, 3: 2}
+
+HOSPITAL_SUFFIXES = ['General Hospital', 'Medical Center', 'University Hospital',
+                     'Regional Health Center', 'Community Medical', 'Transplant Institute']
+
+FIRST_NAMES = ['James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael', 'Linda',
+               'David', 'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan', 'Joseph', 'Jessica',
+               'Thomas', 'Sarah', 'Carlos', 'Karen', 'Priya', 'Wei', 'Aisha', 'Mohammed']
+LAST_NAMES = ['Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis',
+              'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Wilson', 'Anderson', 'Thomas',
+              'Taylor', 'Moore', 'Jackson', 'Lee', 'Patel', 'Chen', 'Khan', 'Nguyen', 'Kim']
+
+
+class DatasetGenerator:
+    """Deterministic row generator driven by a single seeded RNG"""
+
+    def __init__(self, seed, start, end, hla_fraction=0.0):
+        self.rng = random.Random(seed)
+        self.hla_fraction = hla_fraction
+        self.start = start
+        self.span = (end - start).total_seconds()
+        self.blood_types = list(BLOOD_TYPE_WEIGHTS)
+        self.blood_cum = list(itertools.accumulate(BLOOD_TYPE_WEIGHTS.values()))
+        self.donor_organs = list(DONOR_ORGAN_WEIGHTS)
+        self.donor_organ_cum = list(itertools.accumulate(DONOR_ORGAN_WEIGHTS.values()))
+        self.patient_organs = list(PATIENT_ORGAN_WEIGHTS)
+        self.patient_organ_cum = list(itertools.accumulate(PATIENT_ORGAN_WEIGHTS.values()))
+        self.urgencies = list(URGENCY_WEIGHTS)
+        self.urgency_cum = list(itertools.accumulate(URGENCY_WEIGHTS.values()))
+        # Recipient blood types for each donor blood type
+        self.recipients = {donor_blood: compatible_recipient_types(donor_blood) for donor_blood in BLOOD_TYPES}
+
+    def unique_id(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def name(self):
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def blood_type(self):
+        return self.rng.choices(self.blood_types, cum_weights=self.blood_cum)[0]
+
+    def timestamp(self, after=None):
+        # Registrations grow over time, so skew towards the end of the window
+        if after is None:
+            offset = self.span * (self.rng.random() ** 0.5)
+            return (self.start + datetime.timedelta(seconds=offset)).isoformat()
+        after = datetime.datetime.fromisoformat(after)
+        return (after + datetime.timedelta(hours=self.rng.uniform(1, 24 * 30))).isoformat()
+
+    def hla_typing(self):
+        """Two antigens per locus, or None for untyped registrants"""
+        if not self.hla_fraction or self.rng.random() >= self.hla_fraction:
+            return None
+        return ', '.join(self.rng.choice(HLA_ANTIGENS[locus]) for locus in HLA_ANTIGENS for _ in range(2))
+
+    def unacceptable_antigens(self, typing):
+        if not typing or self.rng.random() >= SENSITIZED_SHARE:
+            return None
+        own = set(typing.split(', '))
+        pool = [antigen for antigens in HLA_ANTIGENS.values() for antigen in antigens if antigen not in own]
+        return ', '.join(self.rng.sample(pool, self.rng.randint(1, 4)))
+
+    def hospitals(self, first_id, count):
+        for i in range(first_id, first_id + count):
+            city = self.rng.choice(CITIES)
+            latitude, longitude = geocode(city)
+            yield (i, f"{city.split(',')[0]} {self.rng.choice(HOSPITAL_SUFFIXES)} {i}",
+                   f"hospital{i}@organchain.test", city, 'password', latitude, longitude)
+
+    def person(self, row_id, hospital_ids, organs, organ_cum, min_age, status='Not Matched',
+               organ=None, blood_type=None):
+        return (row_id, self.unique_id(), self.rng.choice(hospital_ids), self.name(),
+                self.rng.randint(min_age, 75), self.rng.choice(('Male', 'Female')),
+                blood_type or self.blood_type(),
+                organ or self.rng.choices(organs, cum_weights=organ_cum)[0],
+                status, self.timestamp())
+
+    def donor(self, row_id, hospital_ids, status='Not Matched'):
+        donor = self.person(row_id, hospital_ids, self.donor_organs, self.donor_organ_cum, 18, status)
+        return donor + (self.hla_typing(),)
+
+    def patient(self, row_id, hospital_ids, status='Not Matched', organ=None, blood_type=None):
+        patient = self.person(row_id, hospital_ids, self.patient_organs, self.patient_organ_cum, 1,
+                              status, organ, blood_type)
+        typing = self.hla_typing()
+        urgency = self.rng.choices(self.urgencies, cum_weights=self.urgency_cum)[0]
+        return patient + (typing, self.unacceptable_antigens(typing), urgency)
+
+    def matched_pair(self, donor_id, patient_id, hospital_ids):
+        """A donor and a compatible patient that are already matched"""
+        donor = self.donor(donor_id, hospital_ids, 'Matched')
+        patient_blood = self.rng.choice(self.recipients[donor[6]])
+        patient = self.patient(patient_id, hospital_ids, 'Matched', donor[7], patient_blood)
+        match_date = self.timestamp(after=max(donor[9], patient[9]))
+        match = (donor_id, patient_id, donor[2], patient[2], donor[7], donor[6], match_date)
+        return donor, patient, match
+
+    def exchange_pair(self, donor_id, patient_id, hospital_ids):
+        """A kidney patient and a willing living donor who cannot give to them directly"""
+        while True:
+            patient = self.patient(patient_id, hospital_ids, organ='Kidney')
+            donor = self.person(donor_id, hospital_ids, self.donor_organs, self.donor_organ_cum, 18,
+                                organ='Kidney', blood_type=self.blood_type())
+            typing = self.hla_typing()
+            crossmatch_positive = bool(typing and patient[11] and
+                                       set(typing.split(', ')) & set(patient[11].split(', ')))
+            if crossmatch_positive or not is_compatible(donor[6], patient[6]):
+                # Pairs are registered together at the same hospital
+                donor = donor[:2] + (patient[2],) + donor[3:9] + (patient[9],)
+                return donor + (typing, patient_id, 0), patient
+
+    def extra_organ(self, organ):
+        """Another organ offered by the same deceased donor"""
+        while True:
+            other = self.rng.choices(self.donor_organs, cum_weights=self.donor_organ_cum)[0]
+            if other != organ:
+                return other
+
+    def non_directed_donor(self, donor_id, hospital_ids):
+        """A living kidney donor with no intended recipient, who can start a chain"""
+        donor = self.person(donor_id, hospital_ids, self.donor_organs, self.donor_organ_cum, 18, organ='Kidney')
+        return donor + (self.hla_typing(), None, 1)
+
+
+def batched(rows, size):
+    """Yield lists of at most size rows from an iterator"""
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def next_id(c, table):
+    c.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return c.fetchone()[0]
+
+
+def ensure_schema(db):
+    """Create the application tables if the target database is empty"""
+    conn = sqlite3.connect(db)
+    c = conn.cursor()
+    c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='donor'")
+    exists = c.fetchone()
+    conn.close()
+    if not exists:
+        from app import init_db
+        init_db(db)
+
+
+def insert_rows(c, sql, rows, batch_size, label):
+    """Insert rows with executemany in batches, printing progress"""
+    total = 0
+    started = time.time()
+    for batch in batched(rows, batch_size):
+        c.executemany(sql, batch)
+        total += len(batch)
+        print(f"  {label}: {total:,} rows ({total / max(time.time() - started, 1e-9):,.0f}/s)")
+    return total
+
+
+DONOR_INSERT = """INSERT INTO donor (id, unique_id, hospital_id, name, age, gender, blood_type, organ,
+                 status, registration_date, hla_typing) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+PATIENT_INSERT = """INSERT INTO patient (id, unique_id, hospital_id, name, age, gender, blood_type, organ,
+                   status, registration_date, hla_typing, unacceptable_antigens, urgency)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+EXCHANGE_DONOR_INSERT = """INSERT INTO donor (id, unique_id, hospital_id, name, age, gender, blood_type, organ,
+                          status, registration_date, hla_typing, paired_patient_id, non_directed)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+MATCH_INSERT = """INSERT INTO match_record (donor_id, patient_id, donor_hospital_id, patient_hospital_id,
+                 organ, blood_type, match_date) VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+
+def populate_ledger(c, batch_size):
+    """Write hash-chained blockchain_records rows for every generated entity"""
+    c.execute("SELECT COALESCE(MAX(block_index), 0), "
+              "(SELECT current_hash FROM blockchain_records ORDER BY block_index DESC LIMIT 1) "
+              "FROM blockchain_records")
+    block_index, previous_hash = c.fetchone()
+    previous_hash = previous_hash or '0'
+
+    sources = [
+        ("SELECT 'hospital_' || id, 'hospital', name, 'hospital_registration', name, NULL FROM hospital", 'hospital'),
+        ("""SELECT d.unique_id, 'donor', d.name, d.organ, h.name, d.registration_date
+            FROM donor d JOIN hospital h ON d.hospital_id = h.id ORDER BY d.id""", 'donor'),
+        ("""SELECT p.unique_id, 'patient', p.name, p.organ, h.name, p.registration_date
+            FROM patient p JOIN hospital h ON p.hospital_id = h.id ORDER BY p.id""", 'patient'),
+        ("""SELECT 'match_' || mr.id, 'match', d.name || ' -> ' || p.name, mr.organ || '_match',
+                   hd.name || '_to_' || hp.name, mr.match_date
+            FROM match_record mr
+            JOIN donor d ON mr.donor_id = d.id
+            JOIN patient p ON mr.patient_id = p.id
+            JOIN hospital hd ON mr.donor_hospital_id = hd.id
+            JOIN hospital hp ON mr.patient_hospital_id = hp.id
+            ORDER BY mr.id""", 'match'),
+    ]
+
+    def rows():
+        nonlocal block_index, previous_hash
+        reader = c.connection.cursor()
+        for sql, _ in sources:
+            for unique_id, data_type, name, organ, hospital, timestamp in reader.execute(sql):
+                block_index += 1
+                timestamp = timestamp or datetime.datetime.now().isoformat()
+                current_hash = hashlib.sha256(
+                    f"{previous_hash}|{block_index}|{data_type}|{unique_id}|{timestamp}".encode('utf-8')
+                ).hexdigest()
+                yield (block_index, unique_id, previous_hash, current_hash, data_type,
+                       name, organ, hospital, timestamp)
+                previous_hash = current_hash
+
+    return insert_rows(c, """INSERT INTO blockchain_records
+                           (block_index, unique_id, previous_hash, current_hash, data_type, name, organ, hospital, timestamp)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows(), batch_size, 'ledger')
+
+
+def generate_dataset(db=DB, hospitals=100, donors=10000, patients=15000, matches=0, seed=42,
+                     start='2015-01-01', end='2025-01-01', batch_size=50000, clear=False, ledger=False,
+                     hla_fraction=0.0, exchange_pairs=0, non_directed=0, multi_organ=0.0):
+    """
+    Generate a synthetic dataset into db. Returns a dict of row counts.
+    exchange_pairs incompatible living donor/patient kidney pairs and
+    non_directed living donors are added on top of donors and patients.
+    A multi_organ share of the unmatched deceased donors offers a second organ.
+    """
+    if matches > min(donors, patients):
+        raise ValueError("matches cannot exceed the number of donors or patients")
+
+    ensure_schema(db)
+    gen = DatasetGenerator(seed, datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end),
+                           hla_fraction)
+
+    conn = sqlite3.connect(db)
+    # Bulk-load settings: the dataset can always be regenerated from its seed
+    conn.execute("PRAGMA journal_mode=MEMORY")
+    conn.execute("PRAGMA synchronous=OFF")
+    c = conn.cursor()
+    counts = {}
+
+    try:
+        c.execute(DONOR_ORGAN_SCHEMA)
+        if clear:
+            print("🧹 Clearing existing data...")
+            for table in ('match_record', 'donor_organ', 'donor', 'patient', 'hospital', 'blockchain_records'):
+                c.execute(f"DELETE FROM {table}")
+            c.execute("DELETE FROM sqlite_sequence WHERE name IN ('match_record', 'donor_organ', 'donor', 'patient', 'hospital', 'blockchain_records')")
+            conn.commit()
+
+        print(f"🏥 Adding {hospitals:,} hospitals...")
+        first_hospital = next_id(c, 'hospital')
+        counts['hospital'] = insert_rows(
+            c, "INSERT INTO hospital (id, name, email, location, password, latitude, longitude) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            gen.hospitals(first_hospital, hospitals), batch_size, 'hospital')
+        conn.commit()
+        c.execute("SELECT id FROM hospital")
+        hospital_ids = [row[0] for row in c.fetchall()]
+
+        first_donor = next_id(c, 'donor')
+        first_patient = next_id(c, 'patient')
+
+        # Matched pairs first so their donor/patient rows stay compatible
+        print(f"🔗 Adding {matches:,} matched donor/patient pairs...")
+        pairs = (gen.matched_pair(first_donor + i, first_patient + i, hospital_ids) for i in range(matches))
+        counts['match_record'] = 0
+        for batch in batched(pairs, batch_size):
+            c.executemany(DONOR_INSERT, [donor for donor, _, _ in batch])
+            c.executemany(PATIENT_INSERT, [patient for _, patient, _ in batch])
+            c.executemany(MATCH_INSERT, [match for _, _, match in batch])
+            counts['match_record'] += len(batch)
+            print(f"  match_record: {counts['match_record']:,} rows")
+        conn.commit()
+
+        first_unmatched_donor = first_donor + matches
+        print(f"🩸 Adding {donors - matches:,} unmatched donors...")
+        insert_rows(c, DONOR_INSERT,
+                    (gen.donor(first_donor + i, hospital_ids) for i in range(matches, donors)),
+                    batch_size, 'donor')
+        conn.commit()
+        counts['donor'] = donors
+
+        print(f"🏥 Adding {patients - matches:,} unmatched patients...")
+        insert_rows(c, PATIENT_INSERT,
+                    (gen.patient(first_patient + i, hospital_ids) for i in range(matches, patients)),
+                    batch_size, 'patient')
+        conn.commit()
+        counts['patient'] = patients
+
+        if exchange_pairs or non_directed:
+            # Drawn last so the rows above do not depend on these options
+            print(f"🔁 Adding {exchange_pairs:,} incompatible pairs and {non_directed:,} non-directed donors...")
+            first_donor = next_id(c, 'donor')
+            first_patient = next_id(c, 'patient')
+            rows = [gen.exchange_pair(first_donor + i, first_patient + i, hospital_ids) for i in range(exchange_pairs)]
+            c.executemany(PATIENT_INSERT, [patient for _, patient in rows])
+            c.executemany(EXCHANGE_DONOR_INSERT, [donor for donor, _ in rows]
+                          + [gen.non_directed_donor(first_donor + exchange_pairs + i, hospital_ids)
+                             for i in range(non_directed)])
+            conn.commit()
+            counts['donor'] += exchange_pairs + non_directed
+            counts['patient'] += exchange_pairs
+
+        # Every donor offers its organ; drawn after the rows above like the exchange pairs
+        counts['donor_organ'] = backfill_donor_organs(c)
+        if multi_organ:
+            print(f"🫀 Adding a second organ for {multi_organ:.0%} of unmatched deceased donors...")
+            c.execute("SELECT id, organ FROM donor WHERE id >= ? AND id < ? ORDER BY id",
+                      (first_unmatched_donor, first_unmatched_donor + donors - matches))
+            extra = [(donor_id, gen.extra_organ(organ)) for donor_id, organ in c.fetchall()
+                     if gen.rng.random() < multi_organ]
+            c.executemany("INSERT INTO donor_organ (donor_id, organ) VALUES (?, ?)", extra)
+            counts['donor_organ'] += len(extra)
+        conn.commit()
+
+        if ledger:
+            print("⛓️  Pre-populating ledger records...")
+            counts['blockchain_records'] = populate_ledger(c, batch_size)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic OrganChain dataset for scale testing")
+    parser.add_argument('--db', default=DB, help="SQLite database to fill (created if missing)")
+    parser.add_argument('--hospitals', type=int, default=100)
+    parser.add_argument('--donors', type=int, default=10000)
+    parser.add_argument('--patients', type=int, default=15000)
+    parser.add_argument('--matches', type=int, default=0,
+                        help="number of donors/patients generated as already-matched pairs")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--start', default='2015-01-01', help="earliest registration date")
+    parser.add_argument('--end', default='2025-01-01', help="latest registration date")
+    parser.add_argument('--batch-size', type=int, default=50000, help="rows per executemany call")
+    parser.add_argument('--clear', action='store_true', help="delete existing rows first")
+    parser.add_argument('--ledger', action='store_true', help="also pre-populate blockchain_records")
+    parser.add_argument('--hla-fraction', type=float, default=0.0,
+                        help="share of donors and patients with HLA typing (0-1)")
+    parser.add_argument('--exchange-pairs', type=int, default=0,
+                        help="extra incompatible living donor/patient kidney pairs for paired exchange")
+    parser.add_argument('--non-directed', type=int, default=0,
+                        help="extra non-directed living kidney donors that can start exchange chains")
+    parser.add_argument('--multi-organ', type=float, default=0.0,
+                        help="share of unmatched deceased donors that offer a second organ (0-1)")
+    args = parser.parse_args()
+
+    started = time.time()
+    counts = generate_dataset(args.db, args.hospitals, args.donors, args.patients, args.matches,
+                              args.seed, args.start, args.end, args.batch_size, args.clear, args.ledger,
+                              args.hla_fraction, args.exchange_pairs, args.non_directed, args.multi_organ)
+
+    print(f"\n📊 Generated in {time.time() - started:.1f}s:")
+    for table, count in counts.items():
+        print(f"   {table}: {count:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Geo
+Offline geocoding of hospital locations and a uniform grid index over
+hospital coordinates. Allocation circles built on the grid let the matcher
+offer an organ locally first without computing every pairwise distance.
+"""
+
+import math
+import os
+
+# Offline gazetteer: "City, ST" -> (latitude, longitude)
+CITY_COORDINATES = {
+    'New York, NY': (40.7128, -74.0060),
+    'Los Angeles, CA': (34.0522, -118.2437),
+    'Chicago, IL': (41.8781, -87.6298),
+    'Houston, TX': (29.7604, -95.3698),
+    'Phoenix, AZ': (33.4484, -112.0740),
+    'Philadelphia, PA': (39.9526, -75.1652),
+    'San Antonio, TX': (29.4241, -98.4936),
+    'San Diego, CA': (32.7157, -117.1611),
+    'Dallas, TX': (32.7767, -96.7970),
+    'San Jose, CA': (37.3382, -121.8863),
+    'Austin, TX': (30.2672, -97.7431),
+    'Jacksonville, FL': (30.3322, -81.6557),
+    'Columbus, OH': (39.9612, -82.9988),
+    'Charlotte, NC': (35.2271, -80.8431),
+    'Indianapolis, IN': (39.7684, -86.1581),
+    'Seattle, WA': (47.6062, -122.3321),
+    'Denver, CO': (39.7392, -104.9903),
+    'Boston, MA': (42.3601, -71.0589),
+    'Nashville, TN': (36.1627, -86.7816),
+    'Detroit, MI': (42.3314, -83.0458),
+    'Portland, OR': (45.5152, -122.6784),
+    'Las Vegas, NV': (36.1699, -115.1398),
+    'Baltimore, MD': (39.2904, -76.6122),
+    'Milwaukee, WI': (43.0389, -87.9065),
+    'Atlanta, GA': (33.7490, -84.3880),
+    'Miami, FL': (25.7617, -80.1918),
+    'Minneapolis, MN': (44.9778, -93.2650),
+    'Cleveland, OH': (41.4993, -81.6944),
+    'Pittsburgh, PA': (40.4406, -79.9959),
+    'St. Louis, MO': (38.6270, -90.1994),
+    'San Francisco, CA': (37.7749, -122.4194),
+    'Washington, DC': (38.9072, -77.0369),
+    'Sacramento, CA': (38.5816, -121.4944),
+    'Kansas City, MO': (39.0997, -94.5786),
+    'Salt Lake City, UT': (40.7608, -111.8910),
+    'New Orleans, LA': (29.9511, -90.0715),
+    'Oklahoma City, OK': (35.4676, -97.5164),
+    'Albuquerque, NM': (35.0844, -106.6504),
+    'Tampa, FL': (27.9506, -82.4572),
+    'Orlando, FL': (28.5384, -81.3789),
+    'Cincinnati, OH': (39.1031, -84.5120),
+    'Louisville, KY': (38.2527, -85.7585),
+    'Memphis, TN': (35.1495, -90.0490),
+    'Raleigh, NC': (35.7796, -78.6382),
+    'Richmond, VA': (37.5407, -77.4360),
+    'Buffalo, NY': (42.8864, -78.8784),
+    'Omaha, NE': (41.2565, -95.9345),
+    'Birmingham, AL': (33.5186, -86.8104),
+    'Honolulu, HI': (21.3069, -157.8583),
+    'Anchorage, AK': (61.2181, -149.9003),
+    'Chennai, TN': (13.0827, 80.2707),
+    'Bangalore, KA': (12.9716, 77.5946),
+    'Bengaluru, KA': (12.9716, 77.5946),
+    'Mumbai, MH': (19.0760, 72.8777),
+    'Delhi, DL': (28.7041, 77.1025),
+    'New Delhi, DL': (28.6139, 77.2090),
+    'Hyderabad, TG': (17.3850, 78.4867),
+    'Kolkata, WB': (22.5726, 88.3639),
+    'Pune, MH': (18.5204, 73.8567),
+    'Ahmedabad, GJ': (23.0225, 72.5714),
+    'Coimbatore, TN': (11.0168, 76.9558),
+    'Madurai, TN': (9.9252, 78.1198),
+    'Kochi, KL': (9.9312, 76.2673),
+    'Vellore, TN': (12.9165, 79.1325),
+    'Mysore, KA': (12.2958, 76.6394)
+}
+
+EARTH_RADIUS_KM = 6371.0
+
+# Grid cell size; one degree of latitude is about 111 km
+CELL_DEGREES = float(os.getenv("GEO_CELL_DEGREES", "1.0"))
+
+# Allocation circle radii around the donor hospital, innermost first.
+# Set MATCH_CIRCLE_RADII_KM to an empty string to match nationally only.
+CIRCLE_RADII_KM = [float(radius) for radius in os.getenv("MATCH_CIRCLE_RADII_KM", "250,500,1000").split(',')
+                   if radius.strip()]
+
+
+def _normalize(text):
+    return ' '.join(text.replace('.', '').lower().split())
+
+
+_GAZETTEER = {_normalize(city): coordinates for city, coordinates in CITY_COORDINATES.items()}
+# Bare city names too, when they are unambiguous
+for _city, _coordinates in CITY_COORDINATES.items():
+    _GAZETTEER.setdefault(_normalize(_city.split(',')[0]), _coordinates)
+
+
+def geocode(location):
+    """
+    (latitude, longitude) for a free-text hospital location, or None.
+    Accepts "City, ST", a bare city name, or literal "lat, lon" coordinates.
+    """
+    if not location or not location.strip():
+        return None
+    parts = [part.strip() for part in location.split(',')]
+    if len(parts) == 2:
+        try:
+            latitude, longitude = float(parts[0]), float(parts[1])
+            if -90 <= latitude <= 90 and -180 <= longitude <= 180:
+                return latitude, longitude
+        except ValueError:
+            pass
+    key = _normalize(location)
+    if key in _GAZETTEER:
+        return _GAZETTEER[key]
+    # "123 Main St, Boston, MA" or "Boston, Massachusetts": try each part as a city
+    for part in parts:
+        coordinates = _GAZETTEER.get(_normalize(part))
+        if coordinates:
+            return coordinates
+    return None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in kilometres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class HospitalGrid:
+    """
+    Uniform latitude/longitude grid over hospital coordinates.
+    A radius query only visits the cells overlapping the query's bounding box.
+    """
+
+    def __init__(self, hospitals, cell_degrees=CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.location = {}
+        self.cells = {}
+        for hospital_id, latitude, longitude in hospitals:
+            if latitude is None or longitude is None:
+                continue
+            self.location[hospital_id] = (latitude, longitude)
+            self.cells.setdefault(self.cell(latitude, longitude), []).append(hospital_id)
+
+    def __len__(self):
+        return len(self.location)
+
+    def cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def within(self, latitude, longitude, radius_km):
+        """[(distance_km, hospital_id)] within radius_km, nearest first"""
+        lat_span = radius_km / 111.0
+        # Longitude degrees shrink towards the poles; clamp to avoid dividing by zero
+        lon_span = min(180.0, radius_km / (111.0 * max(math.cos(math.radians(latitude)), 0.01)))
+        low_row, low_col = self.cell(latitude - lat_span, longitude - lon_span)
+        high_row, high_col = self.cell(latitude + lat_span, longitude + lon_span)
+        found = []
+        for row in range(low_row, high_row + 1):
+            for col in range(low_col, high_col + 1):
+                for hospital_id in self.cells.get((row, col), ()):
+                    distance = haversine_km(latitude, longitude, *self.location[hospital_id])
+                    if distance <= radius_km:
+                        found.append((distance, hospital_id))
+        found.sort()
+        return found
+
+
+class AllocationCircles:
+    """
+    Concentric allocation circles around each donor hospital.
+    rings(hospital_id) lists the hospitals in each circle, innermost first
+    and without repeats; hospitals outside every circle (or without
+    coordinates) are only reached by the national fallback.
+    Rings are computed once per donor hospital.
+    """
+
+    def __init__(self, grid, radii_km=CIRCLE_RADII_KM):
+        self.grid = grid
+        self.radii_km = sorted(radii_km)
+        self._rings = {}
+        self._circle_of = {}
+
+    def rings(self, hospital_id):
+        rings = self._rings.get(hospital_id)
+        if rings is None:
+            rings = []
+            location = self.grid.location.get(hospital_id)
+            if location is not None and self.radii_km:
+                nearby = self.grid.within(*location, self.radii_km[-1])
+                start = 0
+                for radius in self.radii_km:
+                    end = start
+                    while end < len(nearby) and nearby[end][0] <= radius:
+                        end += 1
+                    rings.append([hospital for _, hospital in nearby[start:end]])
+                    start = end
+            self._rings[hospital_id] = rings
+        return rings
+
+    def circle_of(self, hospital_id):
+        """Map hospital id -> circle index around hospital_id (missing = national)"""
+        circles = self._circle_of.get(hospital_id)
+        if circles is None:
+            circles = {hospital: circle for circle, ring in enumerate(self.rings(hospital_id)) for hospital in ring}
+            self._circle_of[hospital_id] = circles
+        return circles
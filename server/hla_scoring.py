@@ -0,0 +1,198 @@
+"""
+HLA scoring
+Virtual crossmatch and HLA mismatch scoring over NumPy antigen bitsets.
+A donor is scored against a whole window of waiting patients in one
+vectorized pass instead of comparing antigen lists patient by patient.
+"""
+
+import os
+import re
+
+import numpy as np
+
+from blood_compatibility import BLOOD_INDEX, DONATE_MASKS
+
+# A, B and DR loci are typed at two antigens each
+UNTYPED_MISMATCHES = 6
+
+# Highest-priority waiting candidates per blood type queue scored for each donor
+CANDIDATE_WINDOW = int(os.getenv("HLA_CANDIDATE_WINDOW", "2000"))
+
+# Row layout from matching_service.load_unmatched()
+ID = 0
+BLOOD_TYPE = 3
+HOSPITAL_ID = 4
+HLA_TYPING = 8
+UNACCEPTABLE_ANTIGENS = 9
+
+_POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def parse_antigens(value):
+    """Split an antigen list such as 'A1, A2 B8;DR3' into normalized names"""
+    if not value:
+        return []
+    return [antigen for antigen in re.split(r'[\s,;]+', value.upper()) if antigen]
+
+
+def popcount_rows(words):
+    """Number of set bits in each row of a 2-D uint64 array"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT8[words.view(np.uint8)].sum(axis=1, dtype=np.int32)
+
+
+class AntigenEncoder:
+    """Assigns each antigen seen in a partition a bit in a fixed-width bitset"""
+
+    def __init__(self, antigen_lists):
+        vocabulary = sorted({antigen for antigens in antigen_lists for antigen in antigens})
+        self.bits = {antigen: i for i, antigen in enumerate(vocabulary)}
+        self.words = max(1, (len(vocabulary) + 63) // 64)
+
+    def encode(self, antigens):
+        vector = np.zeros(self.words, dtype=np.uint64)
+        for antigen in antigens:
+            bit = self.bits.get(antigen)
+            if bit is not None:
+                vector[bit // 64] |= np.uint64(1 << (bit % 64))
+        return vector
+
+    def encode_many(self, antigen_lists):
+        matrix = np.zeros((len(antigen_lists), self.words), dtype=np.uint64)
+        for row, antigens in enumerate(antigen_lists):
+            for antigen in antigens:
+                bit = self.bits.get(antigen)
+                if bit is not None:
+                    matrix[row, bit // 64] |= np.uint64(1 << (bit % 64))
+        return matrix
+
+
+def needs_hla_scoring(donors):
+    """Without a typed donor there is nothing to crossmatch or score"""
+    return any(donor[HLA_TYPING] for donor in donors)
+
+
+class CandidatePool:
+    """
+    Waiting patients of one organ, held as NumPy arrays.
+    Patients must be in waiting-list priority order; row order is that order.
+    """
+
+    def __init__(self, patients, encoder):
+        self.patients = patients
+        self.encoder = encoder
+        typings = [parse_antigens(patient[HLA_TYPING]) for patient in patients]
+        self.typing = encoder.encode_many(typings)
+        self.typed = np.array([bool(typing) for typing in typings], dtype=bool)
+        self.unacceptable = encoder.encode_many(
+            [parse_antigens(patient[UNACCEPTABLE_ANTIGENS]) for patient in patients])
+        self.waiting = np.ones(len(patients), dtype=bool)
+        self.row_of = {patient[ID]: row for row, patient in enumerate(patients)}
+        # Dense hospital numbers, so allocation circles are looked up per row with one take
+        self.hospital_ids, self.hospital_index = np.unique(
+            np.array([patient[HOSPITAL_ID] or 0 for patient in patients], dtype=np.int64), return_inverse=True)
+        self.circle_tables = {}
+
+        # One priority-ordered queue of row numbers per exact blood type, with a moving head
+        blood = np.array([BLOOD_INDEX.get(patient[BLOOD_TYPE], -1) for patient in patients], dtype=np.int8)
+        self.queues = [np.flatnonzero(blood == index) for index in range(len(BLOOD_INDEX))]
+        self.heads = [0] * len(self.queues)
+
+    def candidates(self, donor_blood):
+        """Row numbers of the highest-priority waiting, blood-compatible patients"""
+        mask = DONATE_MASKS.get(donor_blood, 0)
+        windows = []
+        for index, queue in enumerate(self.queues):
+            if not mask & (1 << index):
+                continue
+            head = self.heads[index]
+            while head < len(queue) and not self.waiting[queue[head]]:
+                head += 1
+            self.heads[index] = head
+            if head < len(queue):
+                window = queue[head:head + CANDIDATE_WINDOW]
+                windows.append(window[self.waiting[window]])
+        if not windows:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(windows)
+
+    def score(self, donor_antigens, rows):
+        """
+        Score candidate rows against one donor.
+        Returns (eligible, mismatches): eligible is False where the virtual
+        crossmatch is positive, mismatches counts donor antigens the patient lacks.
+        """
+        donor_vector = self.encoder.encode(donor_antigens)
+        crossmatch_positive = (self.unacceptable[rows] & donor_vector).any(axis=1)
+        if donor_antigens:
+            mismatches = popcount_rows(donor_vector & ~self.typing[rows])
+            mismatches = np.where(self.typed[rows], mismatches, UNTYPED_MISMATCHES)
+        else:
+            mismatches = np.full(len(rows), UNTYPED_MISMATCHES, dtype=np.int32)
+        return ~crossmatch_positive, mismatches
+
+    def circle_table(self, circles, donor_hospital):
+        """Allocation circle of each pool hospital around donor_hospital (national = len(radii))"""
+        table = self.circle_tables.get(donor_hospital)
+        if table is None:
+            circle_of = circles.circle_of(donor_hospital)
+            table = np.array([circle_of.get(int(hospital), len(circles.radii_km)) for hospital in self.hospital_ids],
+                             dtype=np.int16)
+            self.circle_tables[donor_hospital] = table
+        return table
+
+    def best_candidate(self, donor, exclude=None, circles=None):
+        """
+        Fewest HLA mismatches among crossmatch-negative candidates not in
+        exclude (patient ids), waiting-list priority on ties. With
+        AllocationCircles, candidates in the donor's nearest circle come first.
+        Returns a row number or None.
+        """
+        rows = self.candidates(donor[BLOOD_TYPE])
+        if not len(rows):
+            return None
+        eligible, mismatches = self.score(parse_antigens(donor[HLA_TYPING]), rows)
+        if exclude:
+            excluded = [self.row_of[patient_id] for patient_id in exclude if patient_id in self.row_of]
+            eligible &= ~np.isin(rows, excluded)
+        if not eligible.any():
+            return None
+        rows, mismatches = rows[eligible], mismatches[eligible]
+        if circles is not None:
+            circle = self.circle_table(circles, donor[HOSPITAL_ID])[self.hospital_index[rows]]
+            return int(rows[np.lexsort((rows, mismatches, circle))[0]])
+        # Row numbers are priority positions, so they break mismatch ties
+        return int(rows[np.argmin(mismatches.astype(np.int64) * len(self.patients) + rows)])
+
+    def take(self, row):
+        self.waiting[row] = False
+        return self.patients[row]
+
+
+def build_candidate_pool(donors, patients):
+    """Encode one organ partition's antigens and load its waiting patients"""
+    encoder = AntigenEncoder(
+        [parse_antigens(row[HLA_TYPING]) for row in donors]
+        + [parse_antigens(row[HLA_TYPING]) for row in patients]
+        + [parse_antigens(row[UNACCEPTABLE_ANTIGENS]) for row in patients])
+    return CandidatePool(patients, encoder)
+
+
+def assign_from_pool(donors, pool, declined=None, circles=None):
+    """
+    Match donors in queue order to the best HLA-scored compatible patient,
+    skipping patients in declined[donor id].
+    Returns a list of (donor, patient) pairs.
+    """
+    pairs = []
+    for donor in donors:
+        row = pool.best_candidate(donor, declined.get(donor[ID]) if declined else None, circles)
+        if row is not None:
+            pairs.append((donor, pool.take(row)))
+    return pairs
+
+
+def assign_hla(donors, patients, declined=None, circles=None):
+    """HLA-scored matching for a single organ partition"""
+    return assign_from_pool(donors, build_candidate_pool(donors, patients), declined, circles)
@@ -0,0 +1,375 @@
+"""
+Matching service
+Donor-patient matching used by the /matches route. Donors are taken
+earliest-expiring first; each goes to the highest-priority compatible
+patient on the waiting list, nearest allocation circle first.
+"""
+
+import datetime
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from blood_compatibility import BLOOD_INDEX, DONATE_MASKS, iter_bits
+from donor_organs import set_organ_status
+from geo import CIRCLE_RADII_KM, AllocationCircles, HospitalGrid
+from hla_scoring import assign_hla, needs_hla_scoring
+from waiting_list import WaitingList
+
+# Below this many registrants a process pool costs more than it saves
+PARALLEL_THRESHOLD = int(os.getenv("MATCH_PARALLEL_THRESHOLD", "5000"))
+CPU_COUNT = os.cpu_count() or 1
+MAX_WORKERS = int(os.getenv("MATCH_MAX_WORKERS", "0")) or CPU_COUNT
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Row layout shared by the donor and patient queries in /matches:
+# (id, name, organ, blood_type, hospital_id, unique_id, registration_date, age,
+#  hla_typing, unacceptable_antigens, urgency, viability_deadline)
+# -- donors have no unacceptable antigens or urgency, patients no viability deadline
+ID = 0
+NAME = 1
+ORGAN = 2
+BLOOD_TYPE = 3
+HOSPITAL_ID = 4
+UNIQUE_ID = 5
+REGISTRATION_DATE = 6
+AGE = 7
+HLA_TYPING = 8
+UNACCEPTABLE_ANTIGENS = 9
+URGENCY = 10
+VIABILITY_DEADLINE = 11
+
+
+def partition_by_organ(donors, patients):
+    """
+    Split donors and patients into independent per-organ partitions.
+    Only organs with at least one donor and one patient are returned.
+    """
+    partitions = {}
+    for donor in donors:
+        partitions.setdefault(donor[ORGAN], ([], []))[0].append(donor)
+    for patient in patients:
+        if patient[ORGAN] in partitions:
+            partitions[patient[ORGAN]][1].append(patient)
+    return {organ: part for organ, part in partitions.items() if part[1]}
+
+
+def build_patient_buckets(patients):
+    """
+    One FCFS queue per exact patient blood type, indexed by blood type bit.
+    Patients must already be ordered by registration date; each entry keeps
+    its position in that order so queues can be compared across buckets.
+    """
+    buckets = [deque() for _ in BLOOD_INDEX]
+    for position, patient in enumerate(patients):
+        index = BLOOD_INDEX.get(patient[BLOOD_TYPE])
+        if index is not None:
+            buckets[index].append((position, patient))
+    return buckets
+
+
+def assign_fcfs(donors, buckets):
+    """
+    Give each donor, in FCFS order, the earliest compatible patient still waiting.
+    The compatible buckets are DONATE_MASKS[donor blood] & waiting, so each donor
+    only inspects the heads of at most eight non-empty queues.
+    Returns a list of (donor, patient) pairs.
+    """
+    waiting = 0
+    for index, queue in enumerate(buckets):
+        if queue:
+            waiting |= 1 << index
+
+    pairs = []
+    for donor in donors:
+        candidates = DONATE_MASKS.get(donor[BLOOD_TYPE], 0) & waiting
+        if not candidates:
+            continue
+        if candidates & (candidates - 1) == 0:
+            # Only one compatible queue is waiting
+            best = candidates.bit_length() - 1
+        else:
+            best = min(iter_bits(candidates), key=lambda index: buckets[index][0][0])
+        _, patient = buckets[best].popleft()
+        if not buckets[best]:
+            waiting &= ~(1 << best)
+        pairs.append((donor, patient))
+    return pairs
+
+
+def donor_order(donor):
+    """Donor queue order: earliest viability deadline first, then FCFS"""
+    return (donor[VIABILITY_DEADLINE] is None, donor[VIABILITY_DEADLINE] or '',
+            donor[REGISTRATION_DATE] or '', donor[ID])
+
+
+def assign_priority(donors, organ_list, declined=None, circles=None):
+    """
+    Give each donor, in queue order, the highest-priority compatible patient
+    on one organ's waiting list, skipping patients in declined[donor id].
+    With AllocationCircles the donor's innermost circle with a compatible
+    patient wins, then the rest of the country. Only the hospitals in each
+    circle are visited, never every patient's distance.
+    Matched patients are popped from its heaps.
+    Returns a list of (donor, patient) pairs.
+    """
+    if circles is not None:
+        organ_list.index_hospitals()
+    pairs = []
+    for donor in donors:
+        exclude = declined.get(donor[ID]) if declined else None
+        patient = None
+        if circles is not None:
+            for ring in circles.rings(donor[HOSPITAL_ID]):
+                patient = organ_list.take_best(donor[BLOOD_TYPE], exclude, ring)
+                if patient is not None:
+                    break
+        if patient is None:
+            patient = organ_list.take_best(donor[BLOOD_TYPE], exclude)
+        if patient is not None:
+            pairs.append((donor, patient))
+    return pairs
+
+
+def match_partition(donors, organ_list, declined=None, circles=None, hla=None):
+    """
+    Matching for a single organ.
+    Donors must already be in donor_order(). Once anyone in the
+    partition has a typed donor, candidates go through the HLA crossmatch
+    scoring stage in waiting-list priority order; otherwise each donor takes
+    the top of the compatible priority queues. hla overrides that choice for
+    callers matching only part of a partition. declined maps a donor id to
+    patients who already declined (or let time out) an offer of that organ.
+    circles (AllocationCircles) makes either stage prefer nearby hospitals.
+    """
+    if hla is None:
+        hla = needs_hla_scoring(donors)
+    if hla:
+        return assign_hla(donors, organ_list.ordered_patients(), declined, circles)
+    return assign_priority(donors, organ_list, declined, circles)
+
+
+def _match_partition_args(args):
+    return match_partition(*args)
+
+
+def match_pool():
+    """
+    The long-lived process pool partitions are matched in, or None on a
+    single-CPU host. Workers are spawned, not forked, so they never inherit
+    the database write lock or the waiting-list lock; create the pool at
+    startup, outside those locks, rather than on the first large run.
+    """
+    global _pool
+    if CPU_COUNT < 2:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+
+def discard_match_pool(pool):
+    """Drop a broken pool so the next parallel run starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def partition_waiting_list(donors, waiting_list):
+    """Pair each organ's donors with that organ's waiting list"""
+    partitions = {}
+    for donor in donors:
+        partitions.setdefault(donor[ORGAN], []).append(donor)
+    return {organ: (organ_donors, waiting_list.organ(organ))
+            for organ, organ_donors in partitions.items() if waiting_list.organ(organ)}
+
+
+def find_matches(donors, waiting_list, parallel=None, declined=None, circles=None):
+    """
+    Match donors to the waiting list organ by organ.
+    waiting_list may be a WaitingList or a plain list of patient rows.
+    circles (AllocationCircles) enables distance-aware matching.
+    Partitions run concurrently in the shared match_pool() when the backlog
+    is large enough and there is more than one CPU, and the results are
+    merged back into donor queue order.
+
+    The serial path pops matched patients from the waiting list's heaps in
+    place; either way callers should release_matches() once the run is saved.
+    """
+    if not isinstance(waiting_list, WaitingList):
+        waiting_list = WaitingList(waiting_list)
+    partitions = partition_waiting_list(donors, waiting_list)
+    # Ship each partition only its own donors' exclusions
+    partitions = {organ: (organ_donors, organ_list,
+                          {donor[ID]: declined[donor[ID]] for donor in organ_donors if donor[ID] in declined}
+                          if declined else None, circles)
+                  for organ, (organ_donors, organ_list) in partitions.items()}
+    if parallel is None:
+        parallel = len(partitions) > 1 and len(donors) + len(waiting_list) >= PARALLEL_THRESHOLD
+
+    pool = match_pool() if parallel and len(partitions) > 1 else None
+    results = None
+    if pool is not None:
+        try:
+            results = list(pool.map(_match_partition_args, partitions.values()))
+        except BrokenProcessPool as e:
+            # Workers only matched copies of the partitions: match them here instead
+            print(f"Match pool failed, matching serially: {e}")
+            discard_match_pool(pool)
+    if results is None:
+        results = [match_partition(*partition) for partition in partitions.values()]
+
+    return merge_pairs(results)
+
+
+def release_matches(waiting_list, pairs):
+    """Take matched patients off the waiting list after the run is persisted"""
+    for _, patient in pairs:
+        waiting_list.discard(patient[ID])
+
+
+def merge_pairs(results):
+    """Merge per-partition results back into donor queue order"""
+    pairs = [pair for result in results for pair in result]
+    pairs.sort(key=lambda pair: donor_order(pair[0]))
+    return pairs
+
+
+def load_unmatched_donors(cursor, now=None, include_expired=False):
+    """
+    Load unmatched donor organs that are still viable (or, with
+    include_expired, not yet marked Expired), earliest-expiring first.
+    A multi-organ donor appears once per waiting organ, with that organ's
+    deadline. Organs without a deadline follow in FCFS order. Living donors
+    are left to paired exchange.
+    """
+    now = '' if include_expired else now or datetime.datetime.now().isoformat()
+    cursor.execute('''
+    SELECT d.id, d.name, o.organ, d.blood_type, d.hospital_id, d.unique_id, d.registration_date, d.age,
+           d.hla_typing, NULL, NULL, o.viability_deadline
+    FROM donor_organ o
+    JOIN donor d ON d.id = o.donor_id
+    WHERE o.status='Not Matched'
+      AND (o.viability_deadline IS NULL OR o.viability_deadline > ?)
+      AND d.paired_patient_id IS NULL AND NOT COALESCE(d.non_directed, 0)
+      AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.donor_id = d.id AND mr.organ = o.organ)
+    ORDER BY o.viability_deadline IS NULL, o.viability_deadline ASC, d.registration_date ASC, d.id ASC
+    ''', (now,))
+    return cursor.fetchall()
+
+
+def load_unmatched_patients(cursor):
+    """Load unmatched patients ordered by registration date"""
+    cursor.execute('''
+    SELECT p.id, p.name, p.organ, p.blood_type, p.hospital_id, p.unique_id, p.registration_date, p.age,
+           p.hla_typing, p.unacceptable_antigens, p.urgency, NULL
+    FROM patient p
+    WHERE p.status='Not Matched'
+      AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.patient_id = p.id)
+    ORDER BY p.registration_date ASC
+    ''')
+    return cursor.fetchall()
+
+
+def load_donor(cursor, donor_id, organ):
+    """One donor organ row in the load_unmatched_donors() layout, whatever its status"""
+    cursor.execute('''
+    SELECT d.id, d.name, o.organ, d.blood_type, d.hospital_id, d.unique_id, d.registration_date, d.age,
+           d.hla_typing, NULL, NULL, o.viability_deadline
+    FROM donor_organ o
+    JOIN donor d ON d.id = o.donor_id
+    WHERE o.donor_id = ? AND o.organ = ?
+    ''', (donor_id, organ))
+    return cursor.fetchone()
+
+
+def load_patient(cursor, patient_id):
+    """One patient row in the load_unmatched_patients() layout, whatever its status"""
+    cursor.execute('''
+    SELECT p.id, p.name, p.organ, p.blood_type, p.hospital_id, p.unique_id, p.registration_date, p.age,
+           p.hla_typing, p.unacceptable_antigens, p.urgency, NULL
+    FROM patient p WHERE p.id = ?
+    ''', (patient_id,))
+    return cursor.fetchone()
+
+
+def load_unmatched(cursor):
+    """Load unmatched donors in queue order and patients ordered by registration date"""
+    return load_unmatched_donors(cursor), load_unmatched_patients(cursor)
+
+
+def load_hospital_names(cursor):
+    """Map hospital id -> name with a single query"""
+    cursor.execute("SELECT id, name FROM hospital")
+    return dict(cursor.fetchall())
+
+
+def load_allocation_circles(cursor, radii_km=CIRCLE_RADII_KM):
+    """
+    Allocation circles over geocoded hospitals, or None when circles are
+    disabled or no hospital has coordinates (national matching only).
+    """
+    if not radii_km:
+        return None
+    cursor.execute("SELECT id, latitude, longitude FROM hospital WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+    grid = HospitalGrid(cursor.fetchall())
+    return AllocationCircles(grid, radii_km) if len(grid) else None
+
+
+def persist_matches(cursor, pairs, offer_expiry=None):
+    """
+    Write all matched pairs with one executemany per statement.
+    With offer_expiry(donor) -> ISO deadline each pair is recorded as an open
+    offer to the patient's hospital; without it the match is accepted outright.
+    A pair is skipped when its donor organ or patient was matched, expired
+    or deleted since the run loaded them (the UNIQUE indexes on match_record
+    back this up). The caller owns the transaction, ideally started with
+    BEGIN IMMEDIATE, and commits once for the whole run.
+    Returns the pairs that were recorded, in input order.
+    """
+    if not pairs:
+        return []
+    offered_at = datetime.datetime.now().isoformat()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM match_record")
+    last_match_id = cursor.fetchone()[0]
+    cursor.executemany('''
+        INSERT OR IGNORE INTO match_record (donor_id, patient_id, donor_hospital_id, patient_hospital_id, organ, blood_type,
+                                            offer_status, offered_at, offer_expires_at)
+        SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?
+        WHERE EXISTS (SELECT 1 FROM donor_organ WHERE donor_id=? AND organ=? AND status='Not Matched')
+          AND EXISTS (SELECT 1 FROM patient WHERE id=? AND status='Not Matched')
+    ''', [(donor[ID], patient[ID], donor[HOSPITAL_ID], patient[HOSPITAL_ID], donor[ORGAN], donor[BLOOD_TYPE],
+           'Offered' if offer_expiry else 'Accepted', offered_at, offer_expiry(donor) if offer_expiry else None,
+           donor[ID], donor[ORGAN], patient[ID])
+          for donor, patient in pairs])
+
+    cursor.execute("SELECT donor_id, patient_id FROM match_record WHERE id > ?", (last_match_id,))
+    inserted = set(cursor.fetchall())
+    recorded = [(donor, patient) for donor, patient in pairs if (donor[ID], patient[ID]) in inserted]
+    set_organ_status(cursor, [(donor[ID], donor[ORGAN]) for donor, _ in recorded], 'Matched')
+    cursor.executemany("UPDATE patient SET status='Matched' WHERE id=?",
+                       [(patient[ID],) for _, patient in recorded])
+    return recorded
+
+
+def match_ledger_entries(pairs, hospital_names):
+    """Build one ledger transaction per matched pair"""
+    entries = []
+    for donor, patient in pairs:
+        donor_hospital_name = hospital_names.get(donor[HOSPITAL_ID], "Unknown")
+        patient_hospital_name = hospital_names.get(patient[HOSPITAL_ID], "Unknown")
+        entries.append({
+            'donor_id': donor[UNIQUE_ID],
+            'organ_type': f"{donor[ORGAN]}_match",
+            'hospital': f"{donor_hospital_name}_to_{patient_hospital_name}",
+            'receiver_id': patient[UNIQUE_ID]
+        })
+    return entries
@@ -0,0 +1,219 @@
+"""
+Offer service
+Offer workflow over match_record. A match starts as an offer to the
+patient's hospital; declines and timeouts move it to offer_history and
+cascade the organ to the next candidate. Timeouts come from a timer heap
+scheduler instead of polling queries.
+"""
+
+import datetime
+import heapq
+import os
+import threading
+import time
+
+from donor_organs import set_organ_status
+from hla_scoring import needs_hla_scoring
+from matching_service import (ORGAN, VIABILITY_DEADLINE, load_allocation_circles, load_donor, load_unmatched_donors,
+                              match_partition, persist_matches)
+from viability import deadline_timestamp
+
+OFFERED = 'Offered'
+ACCEPTED = 'Accepted'
+DECLINED = 'Declined'
+TIMED_OUT = 'Timed Out'
+
+# Allowed offer transitions; Accepted, Declined and Timed Out are final
+OFFER_TRANSITIONS = {
+    OFFERED: {ACCEPTED, DECLINED, TIMED_OUT}
+}
+
+# How long a hospital has to respond to an offer
+OFFER_TIMEOUT_MINUTES = float(os.getenv("OFFER_TIMEOUT_MINUTES", "60"))
+
+
+def offer_expiry(donor, now=None):
+    """Offer deadline: the response window, cut short by the organ's viability"""
+    now = now or datetime.datetime.now()
+    expires_at = (now + datetime.timedelta(minutes=OFFER_TIMEOUT_MINUTES)).isoformat()
+    deadline = donor[VIABILITY_DEADLINE]
+    return min(expires_at, deadline) if deadline else expires_at
+
+
+def accept_offer(cursor, match_id, hospital_id=None):
+    """
+    Offered -> Accepted. Only the receiving hospital may accept when
+    hospital_id is given. Returns True if the offer was open and is now accepted.
+    """
+    cursor.execute('''
+        UPDATE match_record SET offer_status=?, responded_at=?
+        WHERE id=? AND offer_status=? AND (? IS NULL OR patient_hospital_id=?)
+    ''', (ACCEPTED, datetime.datetime.now().isoformat(), match_id, OFFERED, hospital_id, hospital_id))
+    return cursor.rowcount == 1
+
+
+def close_offer(cursor, match_id, outcome, hospital_id=None):
+    """
+    Offered -> Declined or Timed Out. The offer is archived to offer_history,
+    the patient returns to the waiting list and the donor's organ is freed
+    for the cascade. Returns the closed (donor_id, patient_id, organ) or None
+    if the offer was not open (or not addressed to hospital_id).
+    """
+    if outcome not in OFFER_TRANSITIONS[OFFERED] - {ACCEPTED}:
+        raise ValueError(f"Cannot close an offer as {outcome}")
+    cursor.execute('''
+        SELECT donor_id, patient_id, donor_hospital_id, patient_hospital_id, organ, blood_type, offered_at
+        FROM match_record
+        WHERE id=? AND offer_status=? AND (? IS NULL OR patient_hospital_id=?)
+    ''', (match_id, OFFERED, hospital_id, hospital_id))
+    offer = cursor.fetchone()
+    if not offer:
+        return None
+
+    cursor.execute('''
+        INSERT INTO offer_history (match_id, donor_id, patient_id, donor_hospital_id, patient_hospital_id,
+                                   organ, blood_type, offered_at, responded_at, outcome)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (match_id, *offer, datetime.datetime.now().isoformat(), outcome))
+    cursor.execute("DELETE FROM match_record WHERE id=?", (match_id,))
+    cursor.execute("UPDATE patient SET status='Not Matched' WHERE id=?", (offer[1],))
+    set_organ_status(cursor, [(offer[0], offer[4])], 'Not Matched')
+    return offer[0], offer[1], offer[4]
+
+
+def declined_patients(cursor, donor_ids=None):
+    """Map donor id -> set of patients who declined or let an offer of that donor time out"""
+    if donor_ids is None:
+        cursor.execute('''
+            SELECT h.donor_id, h.patient_id FROM offer_history h
+            JOIN donor_organ o ON o.donor_id = h.donor_id AND o.organ = h.organ
+            WHERE o.status='Not Matched'
+        ''')
+    else:
+        donor_ids = list(donor_ids)
+        cursor.execute(f"SELECT donor_id, patient_id FROM offer_history WHERE donor_id IN ({','.join('?' * len(donor_ids))})",
+                       donor_ids)
+    declined = {}
+    for donor_id, patient_id in cursor.fetchall():
+        declined.setdefault(donor_id, set()).add(patient_id)
+    return declined
+
+
+def cascade_offer(cursor, donor_id, organ, waiting_list):
+    """
+    Offer a donor's freed organ to the next candidate on its waiting list,
+    skipping everyone who already declined it. An organ past its viability
+    deadline is expired instead. The candidate is picked by the same stage
+    /matches would use for the organ's partition (HLA scoring once any donor
+    waiting for that organ is typed); unlike a run, the organ does not compete
+    with those other donors, who wait for the next run.
+    Returns the new (donor, patient) pair or None.
+    The chosen patient is popped from waiting_list; the caller commits and
+    then releases it (or invalidates the list if the commit fails).
+    """
+    donor = load_donor(cursor, donor_id, organ)
+    if donor is None:
+        return None
+    if donor[VIABILITY_DEADLINE] and donor[VIABILITY_DEADLINE] <= datetime.datetime.now().isoformat():
+        set_organ_status(cursor, [(donor_id, organ)], 'Expired', only_if='Not Matched')
+        return None
+
+    organ_list = waiting_list.organ(organ)
+    if organ_list is None:
+        return None
+    partition = [other for other in load_unmatched_donors(cursor) if other[ORGAN] == organ]
+    pairs = match_partition([donor], organ_list, declined_patients(cursor, [donor_id]), load_allocation_circles(cursor),
+                            hla=needs_hla_scoring(partition + [donor]))
+    if not pairs:
+        return None
+    recorded = persist_matches(cursor, pairs, offer_expiry)
+    return recorded[0] if recorded else None
+
+
+def open_offers_since(cursor, last_match_id):
+    """(match id, expiry) of offers created after last_match_id, for scheduling"""
+    cursor.execute("SELECT id, offer_expires_at FROM match_record WHERE id > ? AND offer_status=? AND offer_expires_at IS NOT NULL",
+                   (last_match_id, OFFERED))
+    return cursor.fetchall()
+
+
+class OfferScheduler:
+    """
+    Timer heap of open offers. A single thread sleeps until the earliest
+    deadline, so thousands of pending offers cost nothing between expiries.
+    Cancelled offers are dropped lazily when they reach the top of the heap.
+    """
+
+    def __init__(self, on_timeout):
+        self.on_timeout = on_timeout
+        self.heap = []
+        self.deadlines = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.stopped = False
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def schedule(self, match_id, expires_at):
+        """Time out match_id at expires_at (ISO timestamp)"""
+        deadline = deadline_timestamp(expires_at)
+        with self.condition:
+            self.deadlines[match_id] = deadline
+            heapq.heappush(self.heap, (deadline, match_id))
+            if self.heap[0] == (deadline, match_id):
+                # New earliest deadline: wake the sleeper to re-arm
+                self.condition.notify()
+
+    def cancel(self, match_id):
+        with self.condition:
+            self.deadlines.pop(match_id, None)
+            # Compact once stale entries dominate the heap
+            if len(self.heap) > 64 and len(self.heap) > 2 * len(self.deadlines):
+                self.heap = [(deadline, key) for key, deadline in self.deadlines.items()]
+                heapq.heapify(self.heap)
+
+    def due(self, now=None):
+        """Pop every offer whose deadline has passed"""
+        now = time.time() if now is None else now
+        expired = []
+        with self.condition:
+            while self.heap and self.heap[0][0] <= now:
+                deadline, match_id = heapq.heappop(self.heap)
+                if self.deadlines.get(match_id) == deadline:
+                    del self.deadlines[match_id]
+                    expired.append(match_id)
+        return expired
+
+    def load(self, cursor):
+        """Schedule every offer still open in the database"""
+        cursor.execute("SELECT id, offer_expires_at FROM match_record WHERE offer_status=? AND offer_expires_at IS NOT NULL",
+                       (OFFERED,))
+        rows = cursor.fetchall()
+        for match_id, expires_at in rows:
+            self.schedule(match_id, expires_at)
+        return len(rows)
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (not self.heap or self.heap[0][0] > time.time()):
+                    self.condition.wait(self.heap[0][0] - time.time() if self.heap else None)
+                if self.stopped:
+                    return
+            for match_id in self.due():
+                try:
+                    self.on_timeout(match_id)
+                except Exception as e:
+                    print(f"Error timing out offer {match_id}: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="offer-scheduler", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
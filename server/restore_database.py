@@ -8,6 +8,8 @@ import sqlite3
 import uuid
 import datetime
 
+from donor_organs import DONOR_ORGAN_SCHEMA
+
 DB = "database.db"
 
 def restore_database():
@@ -21,6 +23,8 @@ def restore_database():
         # Clear existing data
         print("🧹 Clearing existing data...")
         c.execute("DELETE FROM match_record")
+        c.execute(DONOR_ORGAN_SCHEMA)
+        c.execute("DELETE FROM donor_organ")
         c.execute("DELETE FROM donor")
         c.execute("DELETE FROM patient")
         c.execute("DELETE FROM hospital")
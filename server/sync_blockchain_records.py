@@ -6,7 +6,8 @@ import json
 # Add the current directory to the Python path
 sys.path.append(os.path.dirname(__file__))
 
-from blockchain_service import is_connected, contract, web3, add_record_to_chain, add_match_to_chain, add_hospital_to_blockchain
+import blockchain_service
+from chain_outbox import OutboxDispatcher, enqueue_many, init_outbox
 
 # Use the database file in the same directory as this script
 DB = os.path.join(os.path.dirname(__file__), "database.db")
@@ -14,141 +15,90 @@ DB = os.path.join(os.path.dirname(__file__), "database.db")
 def sync_blockchain_records():
     """Sync database records with the blockchain"""
     
+    # Look the client up now: a backend may have been installed since this module was imported
+    client = blockchain_service.client
+
     # Check if blockchain is connected
-    if not is_connected():
+    if not blockchain_service.is_connected():
         print("Blockchain is not connected. Please start Ganache on http://127.0.0.1:7545")
         return False
     
-    if not contract:
+    if not client.contract:
         print("Contract not loaded. Cannot sync records.")
         return False
     
     print("Blockchain is connected. Starting sync process...")
     
     try:
+        # Bring an older database up to the app's schema (donor_organ, offer_status)
+        from app import init_db
+        init_db(DB)
+        
         # Connect to database
         conn = sqlite3.connect(DB)
         c = conn.cursor()
         
+        init_outbox(c)
+        
+        # Every row is queued in the chain outbox under a stable key, so rows
+        # already sent by a previous run are not sent again
         # Sync hospitals
         print("Syncing hospitals...")
         c.execute("SELECT id, name, email, location FROM hospital")
-        hospitals = c.fetchall()
-        for hospital in hospitals:
-            hospital_id, name, email, location = hospital
-            try:
-                receipt = add_hospital_to_blockchain(name, email, location)
-                if receipt:
-                    print(f"Added hospital {name} to blockchain")
-                else:
-                    print(f"Failed to add hospital {name} to blockchain")
-            except Exception as e:
-                print(f"Error adding hospital {name} to blockchain: {e}")
+        queued = enqueue_many(c, 'hospital', [(f"hospital:{hospital_id}", [name, email, location])
+                                              for hospital_id, name, email, location in c.fetchall()])
+        print(f"Queued {queued} new hospital(s)")
         
-        # Sync donors
+        # Sync donors, one record per organ. Runs before donor_organ keyed donors
+        # as record:donor:<id> with their first organ only; that organ is not sent again
         print("Syncing donors...")
-        c.execute("SELECT id, unique_id, name, organ, blood_type, hospital_id FROM donor")
-        donors = c.fetchall()
-        for donor in donors:
-            donor_id, unique_id, name, organ, blood_type, hospital_id = donor
-            # Get hospital name
-            c.execute("SELECT name FROM hospital WHERE id = ?", (hospital_id,))
-            hospital_record = c.fetchone()
-            hospital_name = hospital_record[0] if hospital_record else "Unknown"
-            
-            try:
-                receipt = add_record_to_chain(
-                    donor_id=unique_id,
-                    organ_type=organ,
-                    hospital=hospital_name,
-                    receiver_id=f"donor_{donor_id}"
-                )
-                if receipt:
-                    print(f"Added donor {name} to blockchain")
-                else:
-                    print(f"Failed to add donor {name} to blockchain")
-            except Exception as e:
-                print(f"Error adding donor {name} to blockchain: {e}")
+        c.execute('''
+            SELECT d.id, d.unique_id, o.organ, COALESCE(h.name, 'Unknown')
+            FROM donor_organ o
+            JOIN donor d ON d.id = o.donor_id
+            LEFT JOIN hospital h ON h.id = d.hospital_id
+            WHERE NOT (o.organ = d.organ AND EXISTS (SELECT 1 FROM chain_outbox WHERE idempotency_key = 'record:donor:' || d.id))
+            ORDER BY d.id, o.id
+        ''')
+        queued = enqueue_many(c, 'record', [(f"record:donor:{donor_id}:{organ}", [unique_id, organ, hospital_name, f"donor_{donor_id}"])
+                                            for donor_id, unique_id, organ, hospital_name in c.fetchall()])
+        print(f"Queued {queued} new donor record(s)")
         
         # Sync patients
         print("Syncing patients...")
-        c.execute("SELECT id, unique_id, name, organ, blood_type, hospital_id FROM patient")
-        patients = c.fetchall()
-        for patient in patients:
-            patient_id, unique_id, name, organ, blood_type, hospital_id = patient
-            # Get hospital name
-            c.execute("SELECT name FROM hospital WHERE id = ?", (hospital_id,))
-            hospital_record = c.fetchone()
-            hospital_name = hospital_record[0] if hospital_record else "Unknown"
-            
-            try:
-                receipt = add_record_to_chain(
-                    donor_id=f"patient_{patient_id}",
-                    organ_type=organ,
-                    hospital=hospital_name,
-                    receiver_id=unique_id
-                )
-                if receipt:
-                    print(f"Added patient {name} to blockchain")
-                else:
-                    print(f"Failed to add patient {name} to blockchain")
-            except Exception as e:
-                print(f"Error adding patient {name} to blockchain: {e}")
+        c.execute('''
+            SELECT p.id, p.unique_id, p.organ, COALESCE(h.name, 'Unknown')
+            FROM patient p LEFT JOIN hospital h ON h.id = p.hospital_id
+        ''')
+        queued = enqueue_many(c, 'record', [(f"record:patient:{patient_id}", [f"patient_{patient_id}", organ, hospital_name, unique_id])
+                                            for patient_id, unique_id, organ, hospital_name in c.fetchall()])
+        print(f"Queued {queued} new patient record(s)")
         
-        # Sync matches
+        # Sync matches. The chain is append-only, so only accepted offers go
+        # on it; open offers may still be declined or time out
         print("Syncing matches...")
-        c.execute("SELECT id, donor_id, patient_id, organ, match_date FROM match_record")
-        matches = c.fetchall()
-        for match in matches:
-            match_id, donor_id, patient_id, organ, match_date = match
-            # Get donor info
-            c.execute("SELECT name, age, hospital_id FROM donor WHERE id = ?", (donor_id,))
-            donor_record = c.fetchone()
-            donor_name = donor_record[0] if donor_record else "Unknown"
-            donor_age = donor_record[1] if donor_record else 0
-            donor_hospital_id = donor_record[2] if donor_record else None
-            
-            # Get patient info
-            c.execute("SELECT name, age, hospital_id FROM patient WHERE id = ?", (patient_id,))
-            patient_record = c.fetchone()
-            patient_name = patient_record[0] if patient_record else "Unknown"
-            patient_age = patient_record[1] if patient_record else 0
-            patient_hospital_id = patient_record[2] if patient_record else None
-            
-            # Get hospital names
-            donor_hospital_name = "Unknown"
-            patient_hospital_name = "Unknown"
-            
-            if donor_hospital_id:
-                c.execute("SELECT name FROM hospital WHERE id = ?", (donor_hospital_id,))
-                donor_hospital_record = c.fetchone()
-                donor_hospital_name = donor_hospital_record[0] if donor_hospital_record else "Unknown"
-                
-            if patient_hospital_id:
-                c.execute("SELECT name FROM hospital WHERE id = ?", (patient_hospital_id,))
-                patient_hospital_record = c.fetchone()
-                patient_hospital_name = patient_hospital_record[0] if patient_hospital_record else "Unknown"
-            
-            try:
-                match_data = {
-                    'donorName': donor_name,
-                    'donorAge': donor_age,
-                    'donorHospital': donor_hospital_name,
-                    'organ': organ,
-                    'bloodType': blood_type if blood_type else "Unknown",
-                    'patientName': patient_name,
-                    'patientAge': patient_age,
-                    'patientHospital': patient_hospital_name,
-                    'date': match_date
-                }
-                
-                receipt = add_match_to_chain(match_data)
-                if receipt:
-                    print(f"Added match {match_id} to blockchain")
-                else:
-                    print(f"Failed to add match {match_id} to blockchain")
-            except Exception as e:
-                print(f"Error adding match {match_id} to blockchain: {e}")
+        c.execute('''
+            SELECT mr.id, COALESCE(d.name, 'Unknown'), COALESCE(d.age, 0), COALESCE(hd.name, 'Unknown'),
+                   mr.organ, COALESCE(mr.blood_type, d.blood_type, 'Unknown'),
+                   COALESCE(p.name, 'Unknown'), COALESCE(p.age, 0), COALESCE(hp.name, 'Unknown'), mr.match_date
+            FROM match_record mr
+            LEFT JOIN donor d ON d.id = mr.donor_id
+            LEFT JOIN patient p ON p.id = mr.patient_id
+            LEFT JOIN hospital hd ON hd.id = d.hospital_id
+            LEFT JOIN hospital hp ON hp.id = p.hospital_id
+            WHERE mr.offer_status = 'Accepted'
+        ''')
+        fields = ['donorName', 'donorAge', 'donorHospital', 'organ', 'bloodType',
+                  'patientName', 'patientAge', 'patientHospital', 'date']
+        queued = enqueue_many(c, 'match', [(f"match:{match[0]}", dict(zip(fields, match[1:])))
+                                           for match in c.fetchall()])
+        print(f"Queued {queued} new match(es)")
+        conn.commit()
+        
+        # Send in batches and wait for the receipts
+        counts = OutboxDispatcher(DB).drain()
+        print(f"Outbox: {counts.get('confirmed', 0)} confirmed, {counts.get('pending', 0) + counts.get('sent', 0)} in flight, "
+              f"{counts.get('failed', 0)} failed")
         
         conn.close()
         print("Blockchain sync completed successfully!")
@@ -10,7 +10,7 @@ import sys
 # Add the server directory to the Python path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from blockchain_service import add_match_to_chain
+from chain_outbox import OutboxDispatcher, enqueue_many, init_outbox
 
 DB = os.path.join(os.path.dirname(__file__), "database.db")
 
@@ -18,65 +18,73 @@ def sync_matches_to_blockchain():
     """Sync existing database matches to blockchain"""
     print("🔄 Starting sync of database matches to blockchain...")
     
+    # Bring an older database up to the app's schema (offer_status)
+    from app import init_db
+    init_db(DB)
+    
     conn = sqlite3.connect(DB)
     c = conn.cursor()
     
     try:
-        # Get all match records with hospital names
+        # Get accepted match records with hospital names; the chain is append-only,
+        # so open offers that may still be declined or time out stay off it
         c.execute('''
             SELECT 
                 d.name as donor_name,
-                d.organ as donor_organ,
+                COALESCE(mr.organ, d.organ) as donor_organ,
                 d.blood_type as donor_blood_type,
                 hd.name as donor_hospital_name,
                 p.name as patient_name,
                 p.organ as patient_organ,
                 p.blood_type as patient_blood_type,
                 hp.name as patient_hospital_name,
-                mr.match_date
+                mr.match_date,
+                d.age as donor_age,
+                p.age as patient_age,
+                mr.id
             FROM match_record mr
             JOIN donor d ON mr.donor_id = d.id
             JOIN patient p ON mr.patient_id = p.id
             JOIN hospital hd ON mr.donor_hospital_id = hd.id
             JOIN hospital hp ON mr.patient_hospital_id = hp.id
+            WHERE mr.offer_status = 'Accepted'
             ORDER BY mr.match_date
         ''')
         
         matches = c.fetchall()
         print(f"Found {len(matches)} matches in database")
         
-        success_count = 0
-        error_count = 0
-        
+        # Queue every match in the chain outbox; matches queued by an earlier run are skipped
+        match_list = []
         for match in matches:
             donor_name, donor_organ, donor_blood_type, donor_hospital, \
             patient_name, patient_organ, patient_blood_type, patient_hospital, \
-            match_date = match
+            match_date, donor_age, patient_age, match_id = match
             
             # Create match object for blockchain
-            match_data = {
+            match_list.append((f"match:{match_id}", {
                 'donorName': donor_name,
-                'donorOrgan': donor_organ,
-                'donorBloodType': donor_blood_type,
+                'donorAge': donor_age or 0,
                 'donorHospital': donor_hospital,
+                'organ': donor_organ,
+                'bloodType': donor_blood_type or "Unknown",
                 'patientName': patient_name,
-                'patientOrgan': patient_organ,
-                'patientBloodType': patient_blood_type,
+                'patientAge': patient_age or 0,
                 'patientHospital': patient_hospital,
-                'date': match_date.split(' ')[0]  # Get just the date part
-            }
-            
-            try:
-                # Add to blockchain
-                receipt = add_match_to_chain(match_data)
-                print(f"✅ Added match {donor_name} -> {patient_name} to blockchain. TX: {receipt.transactionHash.hex()}")
-                success_count += 1
-            except Exception as e:
-                print(f"❌ Failed to add match {donor_name} -> {patient_name} to blockchain: {e}")
-                error_count += 1
+                'date': (match_date or '').split(' ')[0]  # Get just the date part
+            }))
+        
+        init_outbox(c)
+        queued = enqueue_many(c, 'match', match_list)
+        conn.commit()
+        
+        # Send in batches and wait for the receipts
+        counts = OutboxDispatcher(DB).drain()
+        error_count = counts.get('failed', 0)
         
         print(f"\n📊 Sync Summary:")
-        print(f"   Successful: {success_count}")
+        print(f"   Newly queued: {queued}")
+        print(f"   Confirmed: {counts.get('confirmed', 0)}")
         print(f"   Errors: {error_count}")
         print(f"   Total: {len(matches)}")
         
@@ -0,0 +1,98 @@
+"""
+Transaction cache
+Details of confirmed transactions (transaction, receipt and block fields)
+never change, so they are kept in SQLite by tx hash and block number with
+an in-memory LRU in front. Only transactions at least CONFIRMATIONS blocks
+deep are cached, so a reorg cannot leave a stale entry behind.
+"""
+
+import collections
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+from chain_indexer import CONFIRMATIONS
+
+TX_CACHE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS chain_tx_cache (
+        tx_hash TEXT PRIMARY KEY,
+        block_number INTEGER NOT NULL,
+        details TEXT NOT NULL,
+        cached_at TEXT
+    )
+'''
+TX_CACHE_INDEX = "CREATE INDEX IF NOT EXISTS idx_chain_tx_cache_block ON chain_tx_cache(block_number)"
+
+# Transactions kept in memory
+LRU_SIZE = int(os.getenv("CHAIN_TX_CACHE_SIZE", "1024"))
+
+
+def init_tx_cache(cursor):
+    cursor.execute(TX_CACHE_SCHEMA)
+    cursor.execute(TX_CACHE_INDEX)
+
+
+class TransactionCache:
+    """Confirmed transaction details: an LRU of dicts over the chain_tx_cache table"""
+
+    def __init__(self, db, size=LRU_SIZE, confirmations=CONFIRMATIONS):
+        self.db = db
+        self.size = size
+        self.confirmations = confirmations
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.ready = False
+
+    def connect(self):
+        conn = sqlite3.connect(self.db, timeout=30)
+        if not self.ready:
+            init_tx_cache(conn.cursor())
+            conn.commit()
+            self.ready = True
+        return conn
+
+    def _remember(self, tx_hash, details):
+        with self.lock:
+            self.entries[tx_hash] = details
+            self.entries.move_to_end(tx_hash)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def get_many(self, tx_hashes):
+        """Cached details for each hash, None where it is not cached"""
+        found = {}
+        with self.lock:
+            for tx_hash in tx_hashes:
+                if tx_hash in self.entries:
+                    self.entries.move_to_end(tx_hash)
+                    found[tx_hash] = self.entries[tx_hash]
+        missing = [tx_hash for tx_hash in dict.fromkeys(tx_hashes) if tx_hash not in found]
+        if missing:
+            conn = self.connect()
+            c = conn.cursor()
+            c.execute(f"SELECT tx_hash, details FROM chain_tx_cache WHERE tx_hash IN ({','.join('?' * len(missing))})",
+                      missing)
+            for tx_hash, details in c.fetchall():
+                found[tx_hash] = json.loads(details)
+                self._remember(tx_hash, found[tx_hash])
+            conn.close()
+        return [found.get(tx_hash) for tx_hash in tx_hashes]
+
+    def put_many(self, details_list, head_block):
+        """Cache the details that are at least `confirmations` blocks below head_block"""
+        confirmed = [details for details in details_list
+                     if details and details['block_number'] <= head_block - self.confirmations]
+        if not confirmed:
+            return 0
+        now = datetime.datetime.now().isoformat()
+        conn = self.connect()
+        conn.executemany("INSERT OR IGNORE INTO chain_tx_cache (tx_hash, block_number, details, cached_at) VALUES (?, ?, ?, ?)",
+                         [(details['transaction_hash'], details['block_number'], json.dumps(details), now)
+                          for details in confirmed])
+        conn.commit()
+        conn.close()
+        for details in confirmed:
+            self._remember(details['transaction_hash'], details)
+        return len(confirmed)
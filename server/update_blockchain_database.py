@@ -7,120 +7,92 @@ from datetime import datetime
 # Add the current directory to the Python path
 sys.path.append(os.path.dirname(__file__))
 
-from blockchain_service import is_connected, contract, web3, get_all_records, get_all_matches
+import blockchain_service
+from chain_indexer import get_checkpoint, index_events, init_chain_index, new_events, set_checkpoint
 
 # Use the database file in the same directory as this script
 DB = os.path.join(os.path.dirname(__file__), "database.db")
 
+def record_fields(args, block_index):
+    """(unique_id, data_type, name, organ, hospital) for an OrganRegistered event"""
+    donor_id = args['donorId']
+    organ_type = args['organType']
+    hospital = args['hospital']
+
+    # Determine record type
+    if donor_id.startswith('patient_'):
+        return donor_id, 'patient', 'Patient Record', organ_type, hospital
+    if donor_id.startswith('hospital_'):
+        return donor_id, 'hospital', hospital, organ_type, hospital
+    if '_match' in organ_type:
+        return f"match_{block_index}", 'match', 'Match Record', organ_type, hospital
+    return donor_id, 'donor', 'Donor Record', organ_type, hospital
+
+def match_fields(args, block_index):
+    """(unique_id, data_type, name, organ, hospital) for a MatchAdded event"""
+    return (f"match_{block_index}", 'match', 'Match Record', args['encryptedOrgan'],
+            f"{args['donorHospital']}_to_{args['patientHospital']}")
+
 def update_blockchain_database():
-    """Update blockchain records in the database based on the deployed contract"""
-    
+    """
+    Update blockchain records in the database from the contract's event logs.
+    Only blocks mined since the previous run are read from the node; the
+    table is rebuilt (from the local event index) on the first run and after
+    a chain reorganization.
+    """
+
+    # Look the client up now: a backend may have been installed since this module was imported
+    client = blockchain_service.client
+
     # Check if blockchain is connected
-    if not is_connected():
+    if not blockchain_service.is_connected():
         print("Blockchain is not connected. Please start Ganache on http://127.0.0.1:7545")
         return False
-    
-    if not contract:
+
+    if not client.contract:
         print("Contract not loaded. Cannot update records.")
         return False
-    
+
     print("Blockchain is connected. Updating database records...")
-    
+
     try:
         # Connect to database
         conn = sqlite3.connect(DB)
         c = conn.cursor()
-        
-        # Clear existing blockchain records
-        c.execute("DELETE FROM blockchain_records")
-        print("Cleared existing blockchain records")
-        
-        # Get all records from blockchain
-        print("Fetching records from blockchain...")
-        records = get_all_records()
-        print(f"Found {len(records)} records in blockchain")
-        
-        # Get all matches from blockchain
-        print("Fetching matches from blockchain...")
-        matches = get_all_matches()
-        print(f"Found {len(matches)} matches in blockchain")
-        
-        # Process records
-        block_index = 1
-        for record in records:
+        init_chain_index(c)
+
+        # Pull new OrganRegistered/MatchAdded/HospitalAdded logs into chain_event
+        print("Indexing new contract events...")
+        indexed, head, rewound = index_events(c, client.web3, client.contract, start_block=client.deploy_block)
+        print(f"Indexed {indexed} new events up to block {head}")
+
+        if rewound is not None or get_checkpoint(c, 'blockchain_records') is None:
+            # Clear existing blockchain records and replay every indexed event
+            c.execute("DELETE FROM blockchain_records")
+            set_checkpoint(c, 'blockchain_records', 0)
+            print("Cleared existing blockchain records")
+
+        c.execute("SELECT COALESCE(MAX(block_index), 0) FROM blockchain_records")
+        block_index = c.fetchone()[0] + 1
+        added = 0
+        last_id = None
+        for event_id, event, block_number, block_timestamp, args in new_events(c, 'blockchain_records', ('OrganRegistered', 'MatchAdded')):
+            last_id = max(event_id, last_id or 0)
             try:
-                donor_id = record['donorId']
-                organ_type = record['organType']
-                hospital = record['hospital']
-                receiver_id = record['receiverId']
-                timestamp = record['timestamp']
-                
-                # Determine record type
-                if donor_id.startswith('patient_'):
-                    record_type = 'patient'
-                    unique_id = donor_id
-                    name = 'Patient Record'
-                elif donor_id.startswith('hospital_'):
-                    record_type = 'hospital'
-                    unique_id = donor_id
-                    name = hospital
-                elif '_match' in organ_type:
-                    record_type = 'match'
-                    unique_id = f"match_{block_index}"
-                    name = 'Match Record'
+                if event == 'OrganRegistered':
+                    unique_id, record_type, name, organ, hospital = record_fields(args, block_index)
+                    timestamp = block_timestamp
                 else:
-                    record_type = 'donor'
-                    unique_id = donor_id
-                    name = 'Donor Record'
-                
-                # Generate hashes for blockchain structure
-                previous_hash = '0' if block_index == 1 else f"hash_{block_index-1}"
-                current_hash = f"hash_{block_index}"
-                
-                # Insert blockchain record into database
-                c.execute('''
-                    INSERT INTO blockchain_records 
-                    (block_index, unique_id, previous_hash, current_hash, data_type, name, organ, hospital, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    block_index,
-                    unique_id,
-                    previous_hash,
-                    current_hash,
-                    record_type,
-                    name,
-                    organ_type,
-                    hospital,
-                    timestamp
-                ))
-                
-                print(f"Added record {unique_id} to database (block {block_index})")
-                block_index += 1
-                
-            except Exception as e:
-                print(f"Error processing record: {e}")
-                continue
-        
-        # Process matches
-        for match in matches:
-            try:
-                donor_name = match['donorName']
-                patient_name = match['patientName']
-                organ = match['encryptedOrgan']
-                hospital = f"{match['donorHospital']}_to_{match['patientHospital']}"
-                timestamp = match['date']
-                
-                record_type = 'match'
-                unique_id = f"match_{block_index}"
-                name = 'Match Record'
-                
+                    unique_id, record_type, name, organ, hospital = match_fields(args, block_index)
+                    timestamp = args['date']
+
                 # Generate hashes for blockchain structure
                 previous_hash = '0' if block_index == 1 else f"hash_{block_index-1}"
                 current_hash = f"hash_{block_index}"
-                
+
                 # Insert blockchain record into database
                 c.execute('''
-                    INSERT INTO blockchain_records 
+                    INSERT INTO blockchain_records
                     (block_index, unique_id, previous_hash, current_hash, data_type, name, organ, hospital, timestamp)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
                 ''', (
@@ -134,23 +106,26 @@ def update_blockchain_database():
                     hospital,
                     timestamp
                 ))
-                
-                print(f"Added match record to database (block {block_index})")
+
                 block_index += 1
-                
+                added += 1
+
             except Exception as e:
-                print(f"Error processing match: {e}")
+                print(f"Error processing {event} event: {e}")
                 continue
-        
+
+        if last_id is not None:
+            set_checkpoint(c, 'blockchain_records', last_id)
+
         conn.commit()
         conn.close()
-        
-        print(f"Successfully updated {block_index-1} blockchain records in database!")
+
+        print(f"Successfully added {added} blockchain records to database!")
         return True
-        
+
     except Exception as e:
         print(f"Error updating blockchain database: {e}")
         return False
 
 if __name__ == "__main__":
-    update_blockchain_database()
\ No newline at end of file
+    update_blockchain_database()
@@ -0,0 +1,167 @@
+"""
+Viability
+Per-organ viability deadlines for donated organs and a hashed timer wheel
+that expires donor organs that are no longer viable, one slot per tick,
+without scanning the donor tables.
+"""
+
+import datetime
+import math
+import os
+import sqlite3
+import threading
+import time
+
+from donor_organs import set_organ_status
+
+# Hours a procured organ stays viable for transplant
+VIABILITY_HOURS = {
+    'Heart': 6,
+    'Lungs': 8,
+    'Intestine': 12,
+    'Pancreas': 18,
+    'Liver': 24,
+    'Kidney': 36
+}
+DEFAULT_VIABILITY_HOURS = 24
+
+# Sweeper resolution and wheel size: 60s x 4096 slots covers about 68 hours per turn
+TICK_SECONDS = float(os.getenv("VIABILITY_TICK_SECONDS", "60"))
+WHEEL_SLOTS = int(os.getenv("VIABILITY_WHEEL_SLOTS", "4096"))
+
+
+def viability_deadline(organ, registered_at=None):
+    """ISO deadline after which a donated organ can no longer be offered"""
+    if isinstance(registered_at, str):
+        registered_at = datetime.datetime.fromisoformat(registered_at)
+    registered_at = registered_at or datetime.datetime.now()
+    hours = VIABILITY_HOURS.get(organ, DEFAULT_VIABILITY_HOURS)
+    return (registered_at + datetime.timedelta(hours=hours)).isoformat()
+
+
+def deadline_timestamp(deadline):
+    """Epoch seconds for an ISO deadline (naive values are local time, like registration dates)"""
+    return datetime.datetime.fromisoformat(deadline).timestamp()
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel. A timer lands in the slot of its expiry tick, so
+    schedule and cancel are O(1) and each tick only visits one slot.
+    Timers more than one turn away stay in their slot until their tick comes round.
+    """
+
+    def __init__(self, tick_seconds=TICK_SECONDS, slots=WHEEL_SLOTS, now=None):
+        self.tick_seconds = tick_seconds
+        self.slots = [dict() for _ in range(slots)]
+        self.current_tick = int((time.time() if now is None else now) // tick_seconds)
+        self.slot_of = {}
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def __contains__(self, key):
+        return key in self.slot_of
+
+    def schedule(self, key, deadline):
+        """Fire key on the first tick at or after deadline (epoch seconds)"""
+        self.cancel(key)
+        expiry_tick = max(self.current_tick + 1, math.ceil(deadline / self.tick_seconds))
+        slot = expiry_tick % len(self.slots)
+        self.slots[slot][key] = expiry_tick
+        self.slot_of[key] = slot
+
+    def cancel(self, key):
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self, now=None):
+        """Move the wheel up to now and return the keys whose timers fired"""
+        target = int((time.time() if now is None else now) // self.tick_seconds)
+        fired = []
+        # After a long pause every slot is due at most once
+        for tick in range(self.current_tick + 1, min(target, self.current_tick + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            due = [key for key, expiry_tick in slot.items() if expiry_tick <= target]
+            for key in due:
+                del slot[key]
+                del self.slot_of[key]
+            fired.extend(due)
+        self.current_tick = max(self.current_tick, target)
+        return fired
+
+
+class ViabilitySweeper:
+    """
+    Expires donor organs on a timer wheel as their viability deadlines pass.
+    Timers are keyed by (donor_id, organ). on_expire(keys), if given, is
+    called after each sweep that expired anything.
+    """
+
+    def __init__(self, db, tick_seconds=TICK_SECONDS, slots=WHEEL_SLOTS, on_expire=None):
+        self.db = db
+        self.on_expire = on_expire
+        self.wheel = TimerWheel(tick_seconds, slots)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def load(self):
+        """Schedule every unmatched donor organ that has a deadline"""
+        conn = sqlite3.connect(self.db)
+        c = conn.cursor()
+        c.execute("SELECT donor_id, organ, viability_deadline FROM donor_organ WHERE status='Not Matched' AND viability_deadline IS NOT NULL")
+        rows = c.fetchall()
+        conn.close()
+        with self.lock:
+            for donor_id, organ, deadline in rows:
+                self.wheel.schedule((donor_id, organ), deadline_timestamp(deadline))
+        return len(rows)
+
+    def schedule(self, donor_id, organ, deadline):
+        with self.lock:
+            self.wheel.schedule((donor_id, organ), deadline_timestamp(deadline))
+
+    def cancel(self, keys):
+        """Stop the timers of (donor_id, organ) keys"""
+        with self.lock:
+            for key in keys:
+                self.wheel.cancel(key)
+
+    def tick(self, now=None):
+        """Advance the wheel and mark the donor organs that fired as Expired"""
+        with self.lock:
+            expired = self.wheel.advance(now)
+        if expired:
+            conn = sqlite3.connect(self.db)
+            c = conn.cursor()
+            # Organs matched in the meantime keep their status
+            set_organ_status(c, expired, 'Expired', only_if='Not Matched')
+            conn.commit()
+            conn.close()
+            print(f"Expired {len(expired)} donor organ(s) past their viability deadline")
+            if self.on_expire:
+                self.on_expire(expired)
+        return expired
+
+    def run(self):
+        while not self.stopped.wait(self.wheel.tick_seconds):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error sweeping viability deadlines: {e}")
+
+    def start(self):
+        """Load pending deadlines and sweep in a daemon thread"""
+        if self.thread is None:
+            try:
+                self.load()
+            except sqlite3.OperationalError as e:
+                print(f"Error loading viability deadlines: {e}")
+            self.thread = threading.Thread(target=self.run, name="viability-sweeper", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
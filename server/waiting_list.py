@@ -0,0 +1,563 @@
+"""
+Waiting list
+Urgency-weighted patient priority queues, one indexed heap per
+(organ, blood type) bucket. Urgency changes are applied with
+decrease/increase-key updates instead of re-sorting the list.
+Order-statistics lists answer "how many patients are ahead of me" in O(log n).
+"""
+
+import bisect
+import datetime
+import os
+import threading
+
+from blood_compatibility import BLOOD_INDEX, DONATE_MASKS, iter_bits
+from db_watch import CommitWatch
+
+# Row layout from matching_service.load_unmatched_patients()
+ID = 0
+ORGAN = 2
+BLOOD_TYPE = 3
+HOSPITAL_ID = 4
+REGISTRATION_DATE = 6
+AGE = 7
+URGENCY = 10
+
+# Default priority weights, in days of waiting time:
+# one urgency level is worth URGENCY_WEIGHT days on the list and
+# patients under PEDIATRIC_AGE get PEDIATRIC_BONUS extra days.
+URGENCY_WEIGHT = float(os.getenv("PRIORITY_URGENCY_WEIGHT", "365"))
+PEDIATRIC_BONUS = float(os.getenv("PRIORITY_PEDIATRIC_BONUS", "180"))
+PEDIATRIC_AGE = int(os.getenv("PRIORITY_PEDIATRIC_AGE", "18"))
+WAIT_WEIGHT = float(os.getenv("PRIORITY_WAIT_WEIGHT", "1"))
+
+# Medical urgency levels recorded on the patient table
+URGENCY_LEVELS = {0: 'Routine', 1: 'Elevated', 2: 'Urgent', 3: 'Critical'}
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_urgency(value):
+    """Validate a submitted urgency level; blank means routine"""
+    if value is None or str(value).strip() == '':
+        return 0
+    try:
+        urgency = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Urgency must be one of {sorted(URGENCY_LEVELS)}")
+    if urgency not in URGENCY_LEVELS:
+        raise ValueError(f"Urgency must be one of {sorted(URGENCY_LEVELS)}")
+    return urgency
+
+
+def registration_days(value):
+    """Registration date as days since the epoch (now if missing or invalid)"""
+    try:
+        moment = datetime.datetime.fromisoformat(value)
+        if moment.tzinfo is not None:
+            moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    except (TypeError, ValueError):
+        moment = datetime.datetime.now()
+    return (moment - _EPOCH).total_seconds() / 86400
+
+
+class PriorityPolicy:
+    """
+    Priority score of a waiting patient: higher scores are served first.
+
+    score = urgency_weight * urgency + pediatric bonus + wait_weight * days waited
+
+    Every patient's days waited grows at the same rate, so the wait term is
+    expressed as -registration_days. Scores then never change with time and
+    heap keys only move when urgency changes. Any picklable callable taking a
+    patient row can be used in its place.
+    """
+
+    def __init__(self, urgency_weight=URGENCY_WEIGHT, pediatric_bonus=PEDIATRIC_BONUS,
+                 pediatric_age=PEDIATRIC_AGE, wait_weight=WAIT_WEIGHT):
+        self.urgency_weight = urgency_weight
+        self.pediatric_bonus = pediatric_bonus
+        self.pediatric_age = pediatric_age
+        self.wait_weight = wait_weight
+
+    def __call__(self, patient):
+        try:
+            pediatric = self.pediatric_bonus if int(patient[AGE]) < self.pediatric_age else 0
+        except (TypeError, ValueError):
+            pediatric = 0
+        return (self.urgency_weight * (patient[URGENCY] or 0) + pediatric
+                - self.wait_weight * registration_days(patient[REGISTRATION_DATE]))
+
+
+default_priority = PriorityPolicy()
+
+
+class IndexedHeap:
+    """
+    Binary min-heap of (key, item_id) with a position index, so any item
+    can be re-keyed or removed in O(log n).
+    """
+
+    def __init__(self, entries=()):
+        self.heap = list(entries)
+        self.position = {}
+        # Bottom-up heapify is O(n)
+        for i in reversed(range(len(self.heap) // 2)):
+            self._sift_down(i)
+        for i, (_, item_id) in enumerate(self.heap):
+            self.position[item_id] = i
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __contains__(self, item_id):
+        return item_id in self.position
+
+    def peek(self):
+        return self.heap[0] if self.heap else None
+
+    def push(self, item_id, key):
+        self.heap.append((key, item_id))
+        self.position[item_id] = len(self.heap) - 1
+        self._sift_up(len(self.heap) - 1)
+
+    def pop(self):
+        key, item_id = self.heap[0]
+        self._remove_at(0)
+        return item_id, key
+
+    def update(self, item_id, key):
+        """Change an item's key, moving it up (decrease-key) or down"""
+        i = self.position[item_id]
+        old_key = self.heap[i][0]
+        self.heap[i] = (key, item_id)
+        if key < old_key:
+            self._sift_up(i)
+        else:
+            self._sift_down(i)
+
+    def remove(self, item_id):
+        i = self.position.get(item_id)
+        if i is not None:
+            self._remove_at(i)
+
+    def keys(self):
+        return list(self.heap)
+
+    def _remove_at(self, i):
+        last = self.heap.pop()
+        del self.position[(last if i == len(self.heap) else self.heap[i])[1]]
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.position[last[1]] = i
+            self._sift_up(i)
+            self._sift_down(self.position[last[1]])
+
+    def _sift_up(self, i):
+        heap, position = self.heap, self.position
+        entry = heap[i]
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= entry:
+                break
+            heap[i] = heap[parent]
+            position[heap[i][1]] = i
+            i = parent
+        heap[i] = entry
+        position[entry[1]] = i
+
+    def _sift_down(self, i):
+        heap, position = self.heap, self.position
+        size = len(heap)
+        entry = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and heap[child + 1] < heap[child]:
+                child += 1
+            if entry <= heap[child]:
+                break
+            heap[i] = heap[child]
+            position[heap[i][1]] = i
+            i = child
+        heap[i] = entry
+        position[entry[1]] = i
+
+
+class FenwickTree:
+    """Binary indexed tree of counts: point update and prefix sum in O(log n)"""
+
+    def __init__(self, counts=()):
+        self.tree = [0] + list(counts)
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def add(self, i, delta):
+        i += 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def prefix(self, i):
+        """Sum of counts[0:i]"""
+        total = 0
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+
+class RankedList:
+    """
+    Sorted keys in fixed-size chunks, with a Fenwick tree over chunk sizes.
+    rank() is two bisects plus a prefix sum, O(log n); add and remove only
+    shift one chunk instead of the whole list.
+    """
+
+    CHUNK = 512
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.chunks = [keys[i:i + self.CHUNK] for i in range(0, len(keys), self.CHUNK)]
+        self._reindex()
+
+    def _reindex(self):
+        self.maxes = [chunk[-1] for chunk in self.chunks]
+        self.sizes = FenwickTree(len(chunk) for chunk in self.chunks)
+        self.count = sum(len(chunk) for chunk in self.chunks)
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        if not self.chunks:
+            self.chunks = [[key]]
+            self._reindex()
+            return
+        i = min(bisect.bisect_left(self.maxes, key), len(self.chunks) - 1)
+        chunk = self.chunks[i]
+        bisect.insort(chunk, key)
+        self.maxes[i] = chunk[-1]
+        self.count += 1
+        if len(chunk) > 2 * self.CHUNK:
+            self.chunks[i:i + 1] = [chunk[:self.CHUNK], chunk[self.CHUNK:]]
+            self._reindex()
+        else:
+            self.sizes.add(i, 1)
+
+    def remove(self, key):
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.chunks):
+            return False
+        chunk = self.chunks[i]
+        j = bisect.bisect_left(chunk, key)
+        if j == len(chunk) or chunk[j] != key:
+            return False
+        del chunk[j]
+        self.count -= 1
+        if not chunk:
+            del self.chunks[i]
+            self._reindex()
+        else:
+            self.maxes[i] = chunk[-1]
+            self.sizes.add(i, -1)
+        return True
+
+    def rank(self, key):
+        """Number of keys smaller than key"""
+        i = bisect.bisect_left(self.maxes, key)
+        if i == len(self.chunks):
+            return self.count
+        return self.sizes.prefix(i) + bisect.bisect_left(self.chunks[i], key)
+
+
+class OrganWaitingList:
+    """
+    Priority queues of one organ's waiting patients, one per recipient blood type.
+    index_hospitals() adds a second set of queues per (hospital, blood type)
+    for distance-aware matching, and index_ranks() order-statistics lists for
+    queue positions; each is kept in step with the heaps once built.
+    """
+
+    def __init__(self, organ, patients, priority):
+        self.organ = organ
+        self.priority = priority
+        self.patients = {patient[ID]: patient for patient in patients}
+        entries = [[] for _ in BLOOD_INDEX]
+        for patient in patients:
+            index = BLOOD_INDEX.get(patient[BLOOD_TYPE])
+            if index is not None:
+                entries[index].append((self.key(patient), patient[ID]))
+        self.heaps = [IndexedHeap(bucket) for bucket in entries]
+        self.local_heaps = None
+        self.rank_lists = None
+
+    def __len__(self):
+        return sum(len(heap) for heap in self.heaps)
+
+    def key(self, patient):
+        # Min-heap: negate the score, and break ties by earliest id
+        return (-self.priority(patient), patient[ID])
+
+    def heap_for(self, patient):
+        index = BLOOD_INDEX.get(patient[BLOOD_TYPE])
+        return None if index is None else self.heaps[index]
+
+    def local_heap_for(self, patient, create=False):
+        index = BLOOD_INDEX.get(patient[BLOOD_TYPE])
+        if self.local_heaps is None or index is None:
+            return None
+        key = (patient[HOSPITAL_ID], index)
+        if create and key not in self.local_heaps:
+            self.local_heaps[key] = IndexedHeap()
+        return self.local_heaps.get(key)
+
+    def index_hospitals(self):
+        """Build the per-(hospital, blood type) queues from the waiting patients"""
+        if self.local_heaps is not None:
+            return
+        entries = {}
+        for heap in self.heaps:
+            for key, patient_id in heap.keys():
+                patient = self.patients[patient_id]
+                entries.setdefault((patient[HOSPITAL_ID], BLOOD_INDEX[patient[BLOOD_TYPE]]), []).append((key, patient_id))
+        self.local_heaps = {bucket: IndexedHeap(bucket_entries) for bucket, bucket_entries in entries.items()}
+
+    def index_ranks(self):
+        """Build the order-statistics lists from the keys currently queued"""
+        if self.rank_lists is None:
+            self.rank_lists = [RankedList(key for key, _ in heap.keys()) for heap in self.heaps]
+
+    def _rank_list_for(self, patient):
+        index = BLOOD_INDEX.get(patient[BLOOD_TYPE])
+        return None if self.rank_lists is None or index is None else self.rank_lists[index]
+
+    def add(self, patient):
+        self.patients[patient[ID]] = patient
+        for heap in (self.heap_for(patient), self.local_heap_for(patient, create=True)):
+            if heap is not None:
+                heap.push(patient[ID], self.key(patient))
+        ranks = self._rank_list_for(patient)
+        if ranks is not None:
+            ranks.add(self.key(patient))
+
+    def remove(self, patient_id):
+        patient = self.patients.pop(patient_id, None)
+        if patient is not None:
+            heap = self.heap_for(patient)
+            ranks = self._rank_list_for(patient)
+            # Patients popped by take_best() already left the rank lists
+            if ranks is not None and heap is not None and patient_id in heap:
+                ranks.remove(heap.heap[heap.position[patient_id]][0])
+            for heap in (heap, self.local_heap_for(patient)):
+                if heap is not None:
+                    heap.remove(patient_id)
+        return patient
+
+    def update(self, patient):
+        """Re-key a patient whose urgency (or other priority input) changed"""
+        self.patients[patient[ID]] = patient
+        heap = self.heap_for(patient)
+        ranks = self._rank_list_for(patient)
+        if ranks is not None and heap is not None and patient[ID] in heap:
+            ranks.remove(heap.heap[heap.position[patient[ID]]][0])
+            ranks.add(self.key(patient))
+        for heap in (heap, self.local_heap_for(patient)):
+            if heap is not None and patient[ID] in heap:
+                heap.update(patient[ID], self.key(patient))
+
+    def position(self, patient_id):
+        """
+        Queue position of a waiting patient as {donor blood type: (position, queue size)}:
+        for each donor blood type that can give to the patient, how many compatible
+        candidates rank ahead of them (plus one) among all such donors' candidates.
+        Returns None if the patient is not queued.
+        """
+        patient = self.patients.get(patient_id)
+        heap = self.heap_for(patient) if patient else None
+        if heap is None or patient_id not in heap:
+            return None
+        self.index_ranks()
+        key = heap.heap[heap.position[patient_id]][0]
+        positions = {}
+        for donor_blood, recipients in DONATE_MASKS.items():
+            if not recipients & (1 << BLOOD_INDEX[patient[BLOOD_TYPE]]):
+                continue
+            ahead = sum(self.rank_lists[index].rank(key) for index in iter_bits(recipients))
+            size = sum(len(self.rank_lists[index]) for index in iter_bits(recipients))
+            positions[donor_blood] = (ahead + 1, size)
+        return positions
+
+    def take_best(self, donor_blood, exclude=None, hospitals=None):
+        """
+        Pop the highest-priority patient who can receive from donor_blood
+        and is not in exclude, optionally only among patients of the given
+        hospitals (which needs index_hospitals()). The row stays in
+        self.patients until remove() so callers can still account for it.
+        """
+        mask = DONATE_MASKS.get(donor_blood, 0)
+        if hospitals is None:
+            heaps = [self.heaps[index] for index in iter_bits(mask)]
+        else:
+            heaps = [self.local_heaps[(hospital, index)] for hospital in hospitals for index in iter_bits(mask)
+                     if (hospital, index) in self.local_heaps]
+        best = None
+        skipped = []
+        for heap in heaps:
+            # Set excluded heads aside; they go back once the best is chosen
+            while exclude and heap and heap.peek()[1] in exclude:
+                skipped.append((heap, heap.pop()))
+            top = heap.peek()
+            if top is not None and (best is None or top < best[0]):
+                best = (top, heap)
+        patient = None
+        if best is not None:
+            patient_id, key = best[1].pop()
+            patient = self.patients[patient_id]
+            ranks = self._rank_list_for(patient)
+            if ranks is not None:
+                ranks.remove(key)
+            # Keep the other set of queues in step
+            for heap in (self.heap_for(patient), self.local_heap_for(patient)):
+                if heap is not None and heap is not best[1]:
+                    heap.remove(patient_id)
+        for heap, (patient_id, key) in skipped:
+            heap.push(patient_id, key)
+        return patient
+
+    def ordered_patients(self):
+        """All waiting patients, highest priority first"""
+        entries = [entry for heap in self.heaps for entry in heap.keys()]
+        entries.sort()
+        return [self.patients[patient_id] for _, patient_id in entries]
+
+
+class WaitingList:
+    """
+    All waiting patients, partitioned by organ.
+    Tracks the count, id total and urgency total of its patients so callers
+    can cheaply check whether the database changed underneath it.
+    """
+
+    def __init__(self, patients=(), priority=default_priority):
+        self.priority = priority
+        self.organs = {}
+        self.organ_of = {}
+        self.count = 0
+        self.id_total = 0
+        self.urgency_total = 0
+        grouped = {}
+        for patient in patients:
+            grouped.setdefault(patient[ORGAN], []).append(patient)
+            self._track(patient, 1)
+        for organ, organ_patients in grouped.items():
+            self.organs[organ] = OrganWaitingList(organ, organ_patients, priority)
+
+    def __len__(self):
+        return self.count
+
+    def _track(self, patient, sign):
+        if sign > 0:
+            self.organ_of[patient[ID]] = patient[ORGAN]
+        else:
+            del self.organ_of[patient[ID]]
+        self.count += sign
+        self.id_total += sign * patient[ID]
+        self.urgency_total += sign * (patient[URGENCY] or 0)
+
+    def signature(self):
+        return (self.count, self.id_total, self.urgency_total)
+
+    def organ(self, organ):
+        return self.organs.get(organ)
+
+    def add(self, patient):
+        if patient[ID] in self.organ_of:
+            return
+        if patient[ORGAN] not in self.organs:
+            self.organs[patient[ORGAN]] = OrganWaitingList(patient[ORGAN], [], self.priority)
+        self.organs[patient[ORGAN]].add(patient)
+        self._track(patient, 1)
+
+    def discard(self, patient_id):
+        """Forget a patient that was matched or deleted"""
+        organ = self.organ_of.get(patient_id)
+        if organ is None:
+            return
+        self._track(self.organs[organ].remove(patient_id), -1)
+
+    def set_urgency(self, patient_id, urgency):
+        """Apply an urgency change with a single heap re-key"""
+        organ = self.organ_of.get(patient_id)
+        if organ is None:
+            return False
+        patient = self.organs[organ].patients[patient_id]
+        updated = patient[:URGENCY] + (urgency,) + patient[URGENCY + 1:]
+        self.urgency_total += (urgency or 0) - (patient[URGENCY] or 0)
+        self.organs[organ].update(updated)
+        return True
+
+
+# Process-wide waiting list, loaded on first use, and the watch that tells when to re-check it.
+# Request threads and the offer scheduler share it: hold waiting_list_lock() from getting
+# the list until the last read or change of it (take_best, add, discard, set_urgency, position)
+_waiting_list = None
+_watch = None
+_lock = threading.RLock()
+
+# Same filter as matching_service.load_unmatched_patients()
+SIGNATURE_QUERY = '''
+    SELECT COUNT(*), TOTAL(p.id), TOTAL(COALESCE(p.urgency, 0))
+    FROM patient p
+    WHERE p.status='Not Matched'
+      AND NOT EXISTS (SELECT 1 FROM match_record mr WHERE mr.patient_id = p.id)
+'''
+
+
+def database_signature(cursor):
+    cursor.execute(SIGNATURE_QUERY)
+    count, id_total, urgency_total = cursor.fetchone()
+    return (count, int(id_total), int(urgency_total))
+
+
+def waiting_list_lock():
+    """
+    The lock guarding the process-wide waiting list. Callers that also take
+    the database write lock (BEGIN IMMEDIATE) must take that one first.
+    """
+    return _lock
+
+
+def get_waiting_list(cursor, load_patients, db=None):
+    """
+    Return the process-wide waiting list, reloading it with load_patients(cursor)
+    when it has not been built yet or the patient table changed in another process.
+    Given the database path, the signature query is skipped while nobody has
+    committed to it (CommitWatch).
+    """
+    global _waiting_list, _watch
+    with _lock:
+        if db is not None:
+            if _watch is None or _watch.db != db:
+                _watch = CommitWatch(db)
+            if not _watch.changed() and _waiting_list is not None:
+                return _waiting_list
+        if _waiting_list is None or _waiting_list.signature() != database_signature(cursor):
+            _waiting_list = WaitingList(load_patients(cursor))
+        return _waiting_list
+
+
+def cached_waiting_list():
+    """The loaded waiting list, or None if nothing has loaded it yet"""
+    with _lock:
+        return _waiting_list
+
+
+def invalidate_waiting_list():
+    """Force the next get_waiting_list() call to reload from the database"""
+    global _waiting_list
+    with _lock:
+        _waiting_list = None